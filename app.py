@@ -1,7 +1,9 @@
 import os
+import hmac
 import logging
-from flask import Flask, render_template, jsonify, request, make_response
+from flask import Flask, Response, render_template, jsonify, request, make_response, stream_with_context
 import db_operations as db
+import export
 from db_init import init_database
 
 # Configure logging
@@ -51,6 +53,22 @@ def get_vehicles():
     vehicles = db.get_all_vehicles()
     return jsonify(vehicles)
 
+@app.route('/api/roster')
+def vehicle_roster():
+    """API endpoint for the vehicle list: ?q= (plate or model prefix), ?offset=, ?limit="""
+    roster = db.get_fleet_roster()
+    query = request.args.get('q', default='')
+    offset = max(0, request.args.get('offset', default=0, type=int))
+    limit = min(max(1, request.args.get('limit', default=50, type=int)), 500)
+
+    vehicles = roster.search(query) if query else roster.vehicles
+    return jsonify({
+        'vehicles': list(vehicles[offset:offset + limit]),
+        'total': len(vehicles),
+        'offset': offset,
+        'has_more': offset + limit < len(vehicles)
+    })
+
 @app.route('/api/vehicle/<int:vehicle_id>')
 def vehicle_info(vehicle_id):
     """API endpoint to get vehicle information"""
@@ -92,6 +110,51 @@ def fuel_history(vehicle_id):
     }
     return jsonify(data)
 
+@app.route('/api/expiring')
+def expiring_documents():
+    """API endpoint to get documents expiring within ?days= (default 30)"""
+    days = request.args.get('days', default=30, type=int)
+    include_expired = request.args.get('expired', default=0, type=int) == 1
+    return jsonify(db.get_expiring_documents(days, include_expired))
+
+@app.route('/api/search')
+def search_history():
+    """API endpoint for full-text search: ?q=&offset=&limit=&vehicle_id="""
+    query = request.args.get('q', default='')
+    offset = max(0, request.args.get('offset', default=0, type=int))
+    limit = min(max(1, request.args.get('limit', default=20, type=int)), 100)
+    vehicle_id = request.args.get('vehicle_id', type=int)
+
+    results, has_more, truncated = db.search_history(query, offset, limit, vehicle_id)
+    return jsonify({
+        'results': results,
+        'offset': offset,
+        'has_more': has_more,
+        # Старые совпадения не вошли в выдачу - запрос стоит уточнить
+        'truncated': truncated,
+        'hint': 'Уточните запрос: показаны только самые свежие совпадения' if truncated else None
+    })
+
+# Токен для выгрузки данных (?token= или заголовок Authorization: Bearer <токен>).
+# Если не задан, выгрузка через веб-интерфейс отключена: в ней есть данные пользователей
+EXPORT_API_TOKEN = os.environ.get("EXPORT_API_TOKEN", "")
+
+@app.route('/api/export/<table>.<fmt>')
+def export_table(table, fmt):
+    """API endpoint streaming a table export: /api/export/vehicles.xlsx (csv, ndjson)"""
+    token = request.args.get('token') or request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not EXPORT_API_TOKEN or not hmac.compare_digest(token.encode(), EXPORT_API_TOKEN.encode()):
+        return jsonify({'error': 'forbidden'}), 403
+    if table not in export.EXPORT_TABLES or fmt not in export.EXPORT_FORMATS:
+        return jsonify({'error': 'unknown table or format'}), 404
+
+    # Файл формируется по мере отправки: строки читаются из базы порциями
+    return Response(
+        stream_with_context(export.export_chunks(table, fmt)),
+        mimetype=export.EXPORT_FORMATS[fmt][1],
+        headers={'Content-Disposition': f'attachment; filename="{export.export_filename(table, fmt)}"'}
+    )
+
 if __name__ == '__main__':
     # Create templates directory if it doesn't exist
     os.makedirs('templates', exist_ok=True)
@@ -1,17 +1,18 @@
 import os
 import datetime
 import sqlite3
-import shutil
 import asyncio
 import logging
 from aiogram import Bot
 from config import TOKEN
+import db_pool
+from send_queue import send_queue
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 
-# Инициализация бота
-bot = Bot(token=TOKEN)
+# Инициализация бота (запросы идут через общую очередь отправки)
+bot = send_queue.attach(Bot(token=TOKEN))
 
 # ID администраторов - должны соответствовать списку в telegram_bot.py
 ADMIN_IDS = [936544929]  # Убедитесь, что ID совпадает с ID в telegram_bot.py
@@ -20,7 +21,29 @@ ADMIN_IDS = [936544929]  # Убедитесь, что ID совпадает с I
 BACKUP_DIR = "backups"
 
 # Имя файла базы данных
-DB_FILE = "vehicles.db"
+DB_FILE = db_pool.DB_PATH
+
+def _copy_database(backup_file):
+    """
+    Скопировать базу данных через онлайн-бэкап SQLite
+    
+    В отличие от копирования файла, захватывает и содержимое WAL, и не требует
+    остановки бота и веб-приложения на время копирования.
+    
+    Args:
+        backup_file (str): Путь к файлу резервной копии
+    """
+    with db_pool.connection() as conn:
+        result = conn.execute("PRAGMA quick_check").fetchone()[0]
+        if result != "ok":
+            raise sqlite3.DatabaseError(f"Проверка целостности не пройдена: {result}")
+        
+        dest = sqlite3.connect(backup_file)
+        try:
+            # Копируем по 256 страниц за шаг, чтобы не задерживать писателя надолго
+            conn.backup(dest, pages=256)
+        finally:
+            dest.close()
 
 async def create_backup():
     """
@@ -38,14 +61,8 @@ async def create_backup():
     backup_file = os.path.join(BACKUP_DIR, f"vehicles_backup_{timestamp}.db")
     
     try:
-        # Проверяем, открыта ли база данных
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("PRAGMA quick_check")
-        conn.close()
-        
-        # Создаем резервную копию базы данных
-        shutil.copy2(DB_FILE, backup_file)
+        # Проверяем базу данных и создаем резервную копию в отдельном потоке
+        await asyncio.to_thread(_copy_database, backup_file)
         logging.info(f"Резервная копия создана: {backup_file}")
         
         # Удаляем старые резервные копии (оставляем только 10 последних)
@@ -143,9 +160,12 @@ async def scheduled_backup(hour=3, minute=0):
             # Создаем и отправляем резервную копию
             backup_file = await create_backup()
             if backup_file:
-                for admin_id in ADMIN_IDS:
-                    success = await send_backup_to_admin(admin_id, backup_file)
-                    if success:
+                # Рассылаем всем администраторам одновременно; частоту ограничивает очередь
+                results = await send_queue.broadcast(
+                    ADMIN_IDS, lambda admin_id: send_backup_to_admin(admin_id, backup_file)
+                )
+                for admin_id, success in results.items():
+                    if success is True:
                         logging.info(f"Резервная копия успешно отправлена администратору {admin_id}")
                     else:
                         logging.error(f"Не удалось отправить резервную копию администратору {admin_id}")
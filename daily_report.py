@@ -3,7 +3,9 @@ import logging
 import asyncio
 import datetime
 from aiogram import Bot
-from utils import generate_expiration_report
+from aiogram.types import BufferedInputFile
+from report_pool import report_pool
+from send_queue import send_queue
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -17,42 +19,39 @@ ADMIN_IDS = [936544929]  # Replace with your Telegram ID
 
 async def send_daily_report():
     """Generate and send daily report to admin users"""
-    # Create a bot instance
-    bot = Bot(token=BOT_TOKEN)
+    # Create a bot instance; requests go through the shared send queue
+    bot = send_queue.attach(Bot(token=BOT_TOKEN))
     
     try:
         # Generate the report
         logger.info("Generating daily report...")
-        report_path = generate_expiration_report()
+        report = await report_pool.expiration_report()
         
         # Get current date
         today = datetime.datetime.now()
         date_str = today.strftime('%d.%m.%Y')
         
-        # Send the report to each admin
-        for admin_id in ADMIN_IDS:
-            try:
-                # Send a message with the report
-                await bot.send_message(
-                    admin_id,
-                    f"📊 Ежедневный отчет об истечении сроков документов от {date_str}"
-                )
-                
-                # Send the PDF file
-                with open(report_path, 'rb') as pdf:
-                    await bot.send_document(
-                        admin_id,
-                        pdf,
-                        caption="Отчет содержит информацию о сроках действия документов для всех транспортных средств."
-                    )
-                
-                logger.info(f"Report sent to admin {admin_id}")
-            except Exception as e:
-                logger.error(f"Failed to send report to admin {admin_id}: {e}")
+        async def send_report(admin_id):
+            # Send a message with the report
+            await bot.send_message(
+                admin_id,
+                f"📊 Ежедневный отчет об истечении сроков документов от {date_str}"
+            )
+            
+            # Send the PDF file
+            await bot.send_document(
+                admin_id,
+                BufferedInputFile(report, filename=f"report_{today.strftime('%Y%m%d')}.pdf"),
+                caption="Отчет содержит информацию о сроках действия документов для всех транспортных средств."
+            )
         
-        # Cleanup the file
-        os.remove(report_path)
-        logger.info("Report file cleaned up")
+        # Send the report to all admins at once; the queue keeps within Telegram limits
+        results = await send_queue.broadcast(ADMIN_IDS, send_report)
+        for admin_id, result in results.items():
+            if isinstance(result, Exception):
+                logger.error(f"Failed to send report to admin {admin_id}: {result}")
+            else:
+                logger.info(f"Report sent to admin {admin_id}")
     
     except Exception as e:
         logger.error(f"Error in send_daily_report: {e}")
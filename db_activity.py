@@ -0,0 +1,141 @@
+import os
+import atexit
+import logging
+import datetime
+import threading
+
+import db_writer
+
+# Как часто накопленная активность пользователей записывается в базу (секунды)
+ACTIVITY_FLUSH_INTERVAL = float(os.environ.get("ACTIVITY_FLUSH_INTERVAL", "5"))
+
+# После стольких событий запись выполняется, не дожидаясь интервала
+ACTIVITY_FLUSH_EVENTS = int(os.environ.get("ACTIVITY_FLUSH_EVENTS", "200"))
+
+# Один UPSERT на пользователя: счетчик увеличивается на число накопленных событий
+UPSERT_SQL = """
+INSERT INTO users (id, username, full_name, is_admin, first_seen, last_activity, interaction_count)
+VALUES (?, ?, ?, 0, ?, ?, ?)
+ON CONFLICT (id) DO UPDATE SET
+    username = excluded.username,
+    full_name = excluded.full_name,
+    last_activity = MAX(last_activity, excluded.last_activity),
+    interaction_count = interaction_count + excluded.interaction_count
+"""
+
+
+class ActivityTracker:
+    """
+    Write-behind buffer for user activity
+
+    track() only updates a dict: per user it keeps the latest name, the
+    number of interactions and the time of the last one. A background thread
+    writes the buffer as one UPSERT batch every ACTIVITY_FLUSH_INTERVAL
+    seconds, or sooner once ACTIVITY_FLUSH_EVENTS events have accumulated.
+    Functions that read the users table call flush() first, so their
+    results include the buffered activity.
+    """
+
+    def __init__(self, flush_interval=ACTIVITY_FLUSH_INTERVAL, flush_events=ACTIVITY_FLUSH_EVENTS):
+        self.flush_interval = flush_interval
+        self.flush_events = flush_events
+        self.events = 0
+        self.flushes = 0
+
+        self._pending = {}  # user_id -> [username, full_name, count, first_seen, last_activity]
+        self._pending_events = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def track(self, user_id, username, full_name):
+        """
+        Record one interaction of a user (no database access)
+
+        Args:
+            user_id (int): Telegram user ID
+            username (str): Username
+            full_name (str): Full name
+        """
+        now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            entry = self._pending.get(user_id)
+            if entry is None:
+                self._pending[user_id] = [username, full_name, 1, now, now]
+            else:
+                entry[0], entry[1] = username, full_name
+                entry[2] += 1
+                entry[4] = now
+            self.events += 1
+            self._pending_events += 1
+            full = self._pending_events >= self.flush_events
+
+        if self._thread is None:
+            self._start()
+        if full:
+            self._wakeup.set()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="activity-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered activity in one transaction (blocking)
+
+        Returns:
+            int: Number of users written
+        """
+        # Одновременно выполняется только одна запись, чтобы счетчики не разошлись
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                pending, self._pending = self._pending, {}
+                self._pending_events = 0
+
+            rows = [
+                (user_id, username, full_name, first_seen, last_activity, count)
+                for user_id, (username, full_name, count, first_seen, last_activity) in pending.items()
+            ]
+            try:
+                db_writer.execute(lambda conn: conn.executemany(UPSERT_SQL, rows))
+                self.flushes += 1
+                return len(rows)
+            except Exception as e:
+                logging.error(f"Ошибка при записи активности пользователей: {e}")
+                # Возвращаем события в буфер, чтобы не потерять их
+                with self._lock:
+                    for user_id, entry in pending.items():
+                        current = self._pending.get(user_id)
+                        if current is None:
+                            self._pending[user_id] = entry
+                        else:
+                            current[2] += entry[2]
+                            current[3] = entry[3]
+                return 0
+
+    def stop(self):
+        """Write what is left and stop the background thread"""
+        self._stopping = True
+        self._wakeup.set()
+        self.flush()
+
+
+# Общий буфер для процесса
+activity_tracker = ActivityTracker()
+
+# Запись оставшихся событий при выходе (до остановки db_writer, который
+# зарегистрирован раньше и поэтому останавливается позже)
+atexit.register(activity_tracker.stop)
@@ -0,0 +1,167 @@
+import os
+import time
+import asyncio
+import logging
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import db_pool
+import db_operations
+
+# Потоки для обычных запросов обработчиков (не больше размера пула соединений)
+DB_WORKERS = int(os.environ.get("DB_ASYNC_WORKERS", str(max(1, db_pool.POOL_MAX_SIZE - 1))))
+
+# Потоки для тяжелых задач (отчеты, экспорт) - отдельно, чтобы не занимать обычные
+HEAVY_WORKERS = int(os.environ.get("DB_ASYNC_HEAVY_WORKERS", "1"))
+
+# Максимальное число запросов, ожидающих выполнения одновременно
+MAX_PENDING = int(os.environ.get("DB_ASYNC_MAX_PENDING", "100"))
+
+# Запросы дольше этого времени попадают в журнал (миллисекунды)
+SLOW_QUERY_MS = float(os.environ.get("DB_SLOW_QUERY_MS", "200"))
+
+
+class AsyncRepository:
+    """
+    Async facade over db_operations for aiogram handlers
+
+    Every blocking call runs on a dedicated thread pool, so a slow query
+    never stalls the event loop. Functions of db_operations are available
+    as coroutines with the same names and arguments:
+
+        vehicle = await repo.get_vehicle(vehicle_id)
+
+    Any other blocking function can be run with repo.run(fn, ...), and
+    long-running jobs (reports) with repo.run_heavy(fn, ...), which uses a
+    separate pool so it cannot take all regular workers.
+    """
+
+    def __init__(self, workers=DB_WORKERS, heavy_workers=HEAVY_WORKERS,
+                 max_pending=MAX_PENDING, slow_query_ms=SLOW_QUERY_MS):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db")
+        self._heavy_executor = ThreadPoolExecutor(max_workers=heavy_workers, thread_name_prefix="db-heavy")
+        self.max_pending = max_pending
+        self.slow_query_ms = slow_query_ms
+
+        # Семафор создается в цикле событий, где используется впервые
+        self._semaphore = None
+        self._stats_lock = threading.Lock()
+        self._timings = {}
+
+    def _get_semaphore(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_pending)
+        return self._semaphore
+
+    def _record(self, name, elapsed_ms):
+        with self._stats_lock:
+            count, total, worst = self._timings.get(name, (0, 0.0, 0.0))
+            self._timings[name] = (count + 1, total + elapsed_ms, max(worst, elapsed_ms))
+        if elapsed_ms > self.slow_query_ms:
+            logging.warning(f"Медленный запрос к БД: {name} - {elapsed_ms:.1f} мс")
+
+    def _timed(self, fn, args, kwargs):
+        """Run fn in a worker thread and record its duration"""
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._record(getattr(fn, "__name__", repr(fn)), (time.perf_counter() - started) * 1000)
+
+    async def _submit(self, executor, fn, args, kwargs):
+        async with self._get_semaphore():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, functools.partial(self._timed, fn, args, kwargs))
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Run a blocking function on the DB thread pool
+
+        Returns:
+            The value returned by fn
+        """
+        return await self._submit(self._executor, fn, args, kwargs)
+
+    async def run_heavy(self, fn, *args, **kwargs):
+        """
+        Run a long blocking job (e.g. PDF report) on the separate heavy pool
+
+        Returns:
+            The value returned by fn
+        """
+        return await self._submit(self._heavy_executor, fn, args, kwargs)
+
+    def __getattr__(self, name):
+        fn = getattr(db_operations, name, None)
+        if name.startswith("_") or not callable(fn):
+            raise AttributeError(f"db_operations has no function '{name}'")
+
+        async def call(*args, **kwargs):
+            return await self.run(fn, *args, **kwargs)
+
+        call.__name__ = name
+        call.__doc__ = fn.__doc__
+        # Кэшируем обертку, чтобы не создавать ее при каждом вызове
+        setattr(self, name, call)
+        return call
+
+    def stats(self):
+        """
+        Get per-function timing statistics
+
+        Returns:
+            dict: name -> {"count", "avg_ms", "max_ms"}, slowest first
+        """
+        with self._stats_lock:
+            items = list(self._timings.items())
+        items.sort(key=lambda item: item[1][2], reverse=True)
+        return {
+            name: {"count": count, "avg_ms": round(total / count, 2), "max_ms": round(worst, 2)}
+            for name, (count, total, worst) in items
+        }
+
+    def shutdown(self):
+        """Stop the worker threads (waits for running queries)"""
+        self._executor.shutdown(wait=True)
+        self._heavy_executor.shutdown(wait=True)
+
+
+# Общий репозиторий для процесса
+repo = AsyncRepository()
+
+
+if __name__ == "__main__":
+    # Задержка запросов карточки, пока в фоне строится отчет: python db_async.py [число запросов]
+    import sys
+    import utils
+
+    logging.basicConfig(level=logging.INFO)
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    from db_migrations import apply_migrations
+    apply_migrations()
+
+    async def measure():
+        vehicles = await repo.get_all_vehicles()
+        if not vehicles:
+            print("В базе нет автомобилей")
+            return
+        report = asyncio.ensure_future(repo.run_heavy(utils.generate_expiration_report))
+
+        async def one(vehicle_id):
+            started = time.perf_counter()
+            await repo.get_vehicle_card_data(vehicle_id)
+            return (time.perf_counter() - started) * 1000
+
+        latencies = sorted(await asyncio.gather(
+            *(one(vehicles[i % len(vehicles)]["id"]) for i in range(requests))
+        ))
+        await report
+        print(f"p50 {latencies[len(latencies) // 2]:.2f} ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.2f} ms, max {latencies[-1]:.2f} ms")
+        for name, values in repo.stats().items():
+            print(f"{name:<32} {values}")
+
+    asyncio.run(measure())
+    repo.shutdown()
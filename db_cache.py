@@ -0,0 +1,211 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+# Сколько секунд статус администратора считается актуальным. Изменения через
+# set_admin_status сбрасывают кэш сразу; срок жизни нужен для изменений,
+# сделанных другим процессом (веб-интерфейс, скрипты)
+ADMIN_CACHE_TTL = float(os.environ.get("ADMIN_CACHE_TTL", "60"))
+
+# Сколько отрисованных карточек ТС хранится в памяти
+CARD_CACHE_SIZE = int(os.environ.get("CARD_CACHE_SIZE", "256"))
+
+# Срок жизни карточки (секунды) - на случай изменений из другого процесса
+CARD_CACHE_TTL = float(os.environ.get("CARD_CACHE_TTL", "300"))
+
+
+class AdminCache:
+    """
+    In-process cache of user admin flags
+
+    Checks read a dict instead of querying the users table. Entries expire
+    after ttl seconds. invalidate() drops one user (or everyone) and bumps a
+    generation counter, so a lookup that started before the change cannot
+    put the stale value back:
+
+        generation = admin_cache.generation
+        value = admin_cache.get(user_id)
+        if value is None:
+            value = db_operations.is_user_admin(user_id)
+            admin_cache.put(user_id, value, generation)
+    """
+
+    def __init__(self, ttl=ADMIN_CACHE_TTL):
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}  # user_id -> (is_admin, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """
+        Get the cached admin flag
+
+        Returns:
+            bool: Cached flag, or None if the user is not cached or expired
+        """
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[1] > time.monotonic():
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        return None
+
+    def put(self, user_id, is_admin, generation=None):
+        """
+        Store an admin flag read from the database
+
+        Args:
+            user_id (int): Telegram user ID
+            is_admin (bool): Flag from the database
+            generation (int): Value of self.generation taken before the read;
+                the flag is dropped if an invalidation happened since
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[user_id] = (bool(is_admin), time.monotonic() + self.ttl)
+
+    def warm(self, admin_ids):
+        """
+        Fill the cache with the current admins (at startup)
+
+        Args:
+            admin_ids (Iterable[int]): IDs of users with is_admin = 1
+        """
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for user_id in admin_ids:
+                self._entries[user_id] = (True, expires_at)
+        logging.info(f"Кэш администраторов заполнен: {len(self._entries)} записей")
+
+    def invalidate(self, user_id=None):
+        """
+        Forget one user's flag, or all flags if user_id is None
+        """
+        with self._lock:
+            self.generation += 1
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def stats(self):
+        """
+        Get cache counters
+
+        Returns:
+            dict: hits, misses, hit_rate and number of cached users
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "size": len(self._entries),
+        }
+
+
+class DataVersions:
+    """
+    Per-vehicle data version counters
+
+    Every write that changes what is shown for a vehicle bumps its version
+    after the commit. Caches put the version into their keys, so entries
+    built from older data are never served again. Read the version before
+    loading the data: a load that races with a write is then stored under
+    the old version and simply ages out.
+    """
+
+    def __init__(self):
+        self._global = 0
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, vehicle_id):
+        """
+        Get the current data version of a vehicle
+
+        Returns:
+            tuple: Hashable version usable as part of a cache key
+        """
+        return (self._global, self._versions.get(vehicle_id, 0))
+
+    def bump(self, vehicle_id=None):
+        """
+        Mark a vehicle's data as changed (all vehicles if vehicle_id is None)
+        """
+        with self._lock:
+            if vehicle_id is None:
+                self._global += 1
+            else:
+                self._versions[vehicle_id] = self._versions.get(vehicle_id, 0) + 1
+
+
+class LRUCache:
+    """
+    Bounded least-recently-used cache with optional expiry and hit counters
+    """
+
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get a cached value
+
+        Returns:
+            The cached value, or None if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entry when full"""
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Get cache counters
+
+        Returns:
+            dict: hits, misses, hit_rate and number of cached entries
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "size": len(self._entries),
+        }
+
+
+# Общие кэши для процесса
+admin_cache = AdminCache()
+data_versions = DataVersions()
+card_cache = LRUCache(CARD_CACHE_SIZE, CARD_CACHE_TTL)
@@ -0,0 +1,175 @@
+import logging
+
+# Текстовые даты ДД.ММ.ГГГГ, для которых хранится копия в формате ISO (ГГГГ-ММ-ДД).
+# Столбец-копия называется <столбец>_iso и заполняется триггерами, поэтому
+# код, который пишет только старые столбцы, продолжает работать без изменений.
+DATE_COLUMNS = {
+    "maintenance": ("date",),
+    "repairs": ("date",),
+    "refueling": ("date",),
+    "vehicles": (
+        "osago_valid", "tech_inspection_date", "tech_inspection_valid",
+        "skzi_install_date", "skzi_valid_date", "last_to_date", "next_to_date",
+    ),
+}
+
+# Документы с ограниченным сроком действия (столбец, название)
+EXPIRING_DOCUMENTS = (
+    ("osago_valid", "ОСАГО"),
+    ("tech_inspection_valid", "Техосмотр"),
+    ("skzi_valid_date", "СКЗИ"),
+)
+
+
+def iso_sql(expr):
+    """
+    SQL expression converting a D.M.YYYY / DD.MM.YYYY value to YYYY-MM-DD
+
+    Day and month may be written without a leading zero (older records were
+    entered that way). Values in any other format ('-', typos) become NULL.
+
+    Args:
+        expr (str): SQL expression with the text date
+
+    Returns:
+        str: SQL expression
+    """
+    day = f"CAST(substr({expr}, 1, instr({expr}, '.') - 1) AS INTEGER)"
+    month = f"CAST(substr({expr}, instr({expr}, '.') + 1, length({expr}) - 5 - instr({expr}, '.')) AS INTEGER)"
+    return (
+        f"CASE WHEN {expr} GLOB '[0-9]*.[0-9]*.[0-9][0-9][0-9][0-9]' "
+        f"AND length({expr}) BETWEEN 8 AND 10 AND NOT {expr} GLOB '*[^0-9.]*' "
+        f"THEN date(printf('%s-%02d-%02d', substr({expr}, -4), {month}, {day})) "
+        f"END"
+    )
+
+
+def days_left_sql(column):
+    """
+    SQL expression with the number of days from today to an ISO date column
+
+    Args:
+        column (str): Name of the *_iso column
+
+    Returns:
+        str: SQL expression (NULL if the date is not set)
+    """
+    return f"CAST(julianday({column}) - julianday('now', 'localtime', 'start of day') AS INTEGER)"
+
+
+def expiry_days_sql():
+    """
+    SELECT-list fragment with days left for every expiring document
+
+    Adds <column>_days for each column in EXPIRING_DOCUMENTS, so callers get
+    the numbers from SQLite instead of parsing the text dates in Python.
+
+    Returns:
+        str: SQL fragment, e.g. "<expr> AS osago_valid_days, ..."
+    """
+    return ", ".join(f"{days_left_sql(col + '_iso')} AS {col}_days" for col, name in EXPIRING_DOCUMENTS)
+
+
+def _table_columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+
+
+def _create_triggers(conn, table, columns):
+    """Create triggers that keep *_iso columns in sync with the text dates"""
+    assignments = ", ".join(f"{col}_iso = {iso_sql('NEW.' + col)}" for col in columns)
+    # При вставке с уже заполненными ISO-датами (пакетная загрузка) триггер не нужен
+    missing = " OR ".join(f"NEW.{col}_iso IS NULL" for col in columns)
+
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_{table}_iso_insert
+    AFTER INSERT ON {table}
+    WHEN {missing}
+    BEGIN
+        UPDATE {table} SET {assignments} WHERE id = NEW.id;
+    END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_{table}_iso_update
+    AFTER UPDATE OF {", ".join(columns)} ON {table}
+    BEGIN
+        UPDATE {table} SET {assignments} WHERE id = NEW.id;
+    END
+    """)
+
+
+def add_iso_columns(conn):
+    """
+    Add missing *_iso columns and the triggers that keep them in sync
+
+    Args:
+        conn (sqlite3.Connection): Open connection (the caller commits)
+
+    Returns:
+        list: (table, column) pairs that were added
+    """
+    added = []
+    for table, columns in DATE_COLUMNS.items():
+        existing = _table_columns(conn, table)
+        for col in columns:
+            if f"{col}_iso" not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {col}_iso TEXT")
+                added.append((table, col))
+
+        _create_triggers(conn, table, columns)
+    return added
+
+
+def recreate_triggers(conn):
+    """
+    Drop and recreate the sync triggers with the current definition
+
+    Args:
+        conn (sqlite3.Connection): Open connection (the caller commits)
+    """
+    for table, columns in DATE_COLUMNS.items():
+        conn.execute(f"DROP TRIGGER IF EXISTS trg_{table}_iso_insert")
+        conn.execute(f"DROP TRIGGER IF EXISTS trg_{table}_iso_update")
+        _create_triggers(conn, table, columns)
+
+
+def to_iso(date_str):
+    """
+    Convert a validated DD.MM.YYYY string to YYYY-MM-DD
+
+    Args:
+        date_str (str): Date that passed services_db.validate_date
+
+    Returns:
+        str: ISO date
+    """
+    day, month, year = date_str.split(".")
+    return f"{year}-{month}-{day}"
+
+
+def backfill_iso_dates(conn, batch_size=1000):
+    """
+    Recompute *_iso values from the text dates, batch_size rows at a time
+
+    This is a generator: it yields the number of rows updated after every
+    batch, so the caller can commit between batches and let other writers in.
+
+    Args:
+        conn (sqlite3.Connection): Open connection (the caller commits)
+        batch_size (int): Rows per batch
+
+    Yields:
+        int: Rows updated in the batch
+    """
+    for table, columns in DATE_COLUMNS.items():
+        assignments = ", ".join(f"{col}_iso = {iso_sql(col)}" for col in columns)
+        last_id = 0
+        while True:
+            ids = conn.execute(
+                f"SELECT id FROM {table} WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size)
+            ).fetchall()
+            if not ids:
+                break
+            conn.execute(f"UPDATE {table} SET {assignments} WHERE id BETWEEN ? AND ?", (ids[0][0], ids[-1][0]))
+            last_id = ids[-1][0]
+            logging.debug(f"Заполнены ISO-даты в таблице {table} до id={last_id}")
+            yield len(ids)
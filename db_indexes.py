@@ -0,0 +1,148 @@
+import sys
+import sqlite3
+import logging
+
+import db_pool
+
+# Индексы для горячих запросов (имя, SQL)
+INDEXES = (
+    # История ТО по машине: WHERE vehicle_id = ? ORDER BY date_iso DESC, mileage DESC.
+    # Для запроса "пробег последнего ТО" индекс покрывающий - таблица не читается.
+    ("idx_maintenance_vehicle_date",
+     "CREATE INDEX IF NOT EXISTS idx_maintenance_vehicle_date ON maintenance (vehicle_id, date_iso, mileage)"),
+    # История ремонтов по машине
+    ("idx_repairs_vehicle_date",
+     "CREATE INDEX IF NOT EXISTS idx_repairs_vehicle_date ON repairs (vehicle_id, date_iso, mileage)"),
+    # История заправок по машине
+    ("idx_refueling_vehicle_date",
+     "CREATE INDEX IF NOT EXISTS idx_refueling_vehicle_date ON refueling (vehicle_id, date_iso, mileage)"),
+    # Покрывающий индекс для calculate_fuel_stats (ORDER BY mileage)
+    ("idx_refueling_vehicle_mileage",
+     "CREATE INDEX IF NOT EXISTS idx_refueling_vehicle_mileage "
+     "ON refueling (vehicle_id, mileage, liters, cost_per_liter)"),
+    # Частичный индекс: администраторов единицы, пользователей - много
+    ("idx_users_admin",
+     "CREATE INDEX IF NOT EXISTS idx_users_admin ON users (id) WHERE is_admin = 1"),
+    # Сроки действия документов: "что истекает в ближайшие N дней"
+    ("idx_vehicles_osago_valid",
+     "CREATE INDEX IF NOT EXISTS idx_vehicles_osago_valid ON vehicles (osago_valid_iso)"),
+    ("idx_vehicles_tech_inspection_valid",
+     "CREATE INDEX IF NOT EXISTS idx_vehicles_tech_inspection_valid ON vehicles (tech_inspection_valid_iso)"),
+    ("idx_vehicles_skzi_valid",
+     "CREATE INDEX IF NOT EXISTS idx_vehicles_skzi_valid ON vehicles (skzi_valid_date_iso)"),
+)
+
+# Запросы, которые не должны превращаться в полный просмотр таблицы
+# (имя, SQL, параметры, индекс, который должен использоваться)
+HOT_QUERIES = (
+    ("get_maintenance_history",
+     "SELECT * FROM maintenance WHERE vehicle_id = ? ORDER BY date_iso DESC, mileage DESC", (1,),
+     "idx_maintenance_vehicle_date"),
+    ("get_repairs",
+     "SELECT * FROM repairs WHERE vehicle_id = ? ORDER BY date_iso DESC, mileage DESC", (1,),
+     "idx_repairs_vehicle_date"),
+    ("get_refueling_history",
+     "SELECT * FROM refueling WHERE vehicle_id = ? ORDER BY date_iso DESC, mileage DESC", (1,),
+     "idx_refueling_vehicle_date"),
+    ("calculate_fuel_stats",
+     "SELECT mileage, liters, cost_per_liter FROM refueling WHERE vehicle_id = ? ORDER BY mileage", (1,),
+     "idx_refueling_vehicle_mileage"),
+    ("last_to_mileage",
+     "SELECT mileage FROM maintenance WHERE vehicle_id = ? ORDER BY date_iso DESC, mileage DESC LIMIT 1", (1,),
+     "idx_maintenance_vehicle_date"),
+    ("admin_count",
+     "SELECT COUNT(*) FROM users WHERE is_admin = 1", (),
+     "idx_users_admin"),
+    ("get_expiring_documents",
+     "SELECT id FROM vehicles WHERE osago_valid_iso BETWEEN ? AND ?", ("2025-01-01", "2025-02-01"),
+     "idx_vehicles_osago_valid"),
+)
+
+
+def create_indexes(conn):
+    """
+    Create missing indexes, rebuild the ones whose definition changed and
+    refresh planner statistics
+
+    Args:
+        conn (sqlite3.Connection): Open connection (the caller commits)
+
+    Returns:
+        list: Names of created or rebuilt indexes
+    """
+    existing = dict(conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL").fetchall())
+    changed = []
+
+    for name, sql in INDEXES:
+        # SQLite хранит определение без "IF NOT EXISTS"
+        expected = sql.replace("CREATE INDEX IF NOT EXISTS", "CREATE INDEX")
+        if existing.get(name) == expected:
+            continue
+        if name in existing:
+            logging.info(f"Определение индекса {name} изменилось, индекс пересоздается")
+            conn.execute(f"DROP INDEX {name}")
+        conn.execute(sql)
+        changed.append(name)
+
+    if changed:
+        # Обновляем статистику планировщика для новых индексов
+        conn.execute("ANALYZE")
+    return changed
+
+
+def explain(conn, sql, params=()):
+    """
+    Get the EXPLAIN QUERY PLAN rows for a query
+
+    Returns:
+        list: Plan step descriptions
+    """
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+
+
+def check_query_plans(conn):
+    """
+    Check that the hot queries use their indexes
+
+    A query regresses if its plan does not use the expected index, reads a
+    table without any index, or needs a temporary B-tree to sort the result.
+    Scanning a partial index is fine - it only holds the matching rows.
+
+    Args:
+        conn (sqlite3.Connection): Open connection
+
+    Returns:
+        list: (query name, plan) for every regressed query; empty if all is well
+    """
+    regressions = []
+    for name, sql, params, index in HOT_QUERIES:
+        plan = explain(conn, sql, params)
+        uses_index = any(index in step for step in plan)
+        bad_step = any(
+            (step.startswith("SCAN") and "INDEX" not in step) or "TEMP B-TREE" in step
+            for step in plan
+        )
+        if not uses_index or bad_step:
+            regressions.append((name, plan))
+    return regressions
+
+
+if __name__ == "__main__":
+    # Проверка планов запросов: python db_indexes.py [путь к БД]
+    logging.basicConfig(level=logging.INFO)
+    db_path = sys.argv[1] if len(sys.argv) > 1 else db_pool.DB_PATH
+
+    # Индексы создаются миграциями
+    from db_migrations import apply_migrations
+    apply_migrations(db_path)
+
+    conn = sqlite3.connect(db_path)
+
+    failed = check_query_plans(conn)
+    failed_names = {name for name, plan in failed}
+    for name, sql, params, index in HOT_QUERIES:
+        status = "FAIL" if name in failed_names else "ok"
+        print(f"[{status}] {name}: {'; '.join(explain(conn, sql, params))}")
+    conn.close()
+
+    sys.exit(1 if failed else 0)
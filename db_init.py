@@ -1,91 +1,18 @@
-import sqlite3
 import logging
+import db_pool
+from db_migrations import apply_migrations
 
 def init_database():
     """
-    Initialize the SQLite database and create necessary tables with enhanced schema
+    Initialize the SQLite database: apply pending schema migrations and add
+    sample data to an empty database
     """
     try:
-        conn = sqlite3.connect('vehicles.db')
-        cursor = conn.cursor()
-        
-        # Create enhanced vehicles table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS vehicles (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            model TEXT NOT NULL,
-            reg_number TEXT NOT NULL UNIQUE,
-            vin TEXT UNIQUE,
-            category TEXT,
-            qualification TEXT,
-            year INTEGER,
-            mileage INTEGER DEFAULT 0,
-            tachograph_required BOOLEAN DEFAULT FALSE,
-            osago_valid TEXT,
-            tech_inspection_date TEXT,
-            tech_inspection_valid TEXT,
-            skzi_install_date TEXT,
-            skzi_valid_date TEXT,
-            next_to INTEGER,
-            last_to_date TEXT,
-            next_to_date TEXT,
-            fuel_type TEXT,
-            fuel_tank_capacity REAL,
-            avg_fuel_consumption REAL,
-            notes TEXT
-        )
-        ''')
-        
-        # Create maintenance history table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS maintenance (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            vehicle_id INTEGER NOT NULL,
-            date TEXT NOT NULL,
-            mileage INTEGER NOT NULL,
-            works TEXT NOT NULL,
-            FOREIGN KEY (vehicle_id) REFERENCES vehicles (id)
-        )
-        ''')
+        # Create or upgrade the schema (see db_migrations.py)
+        apply_migrations()
         
-        # Create repairs table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS repairs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            vehicle_id INTEGER NOT NULL,
-            date TEXT NOT NULL,
-            mileage INTEGER NOT NULL,
-            description TEXT NOT NULL,
-            cost REAL,
-            FOREIGN KEY (vehicle_id) REFERENCES vehicles (id)
-        )
-        ''')
-        
-        # Create refueling table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS refueling (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            vehicle_id INTEGER NOT NULL,
-            date TEXT NOT NULL,
-            mileage INTEGER NOT NULL,
-            liters REAL NOT NULL,
-            cost_per_liter REAL NOT NULL,
-            FOREIGN KEY (vehicle_id) REFERENCES vehicles (id)
-        )
-        ''')
-        
-        # Create users table for tracking bot users
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY,
-            username TEXT,
-            full_name TEXT,
-            is_admin BOOLEAN DEFAULT 0,
-            first_seen TEXT NOT NULL,
-            last_activity TEXT NOT NULL,
-            interaction_count INTEGER DEFAULT 1
-        )
-        ''')
+        conn = db_pool.create_connection()
+        cursor = conn.cursor()
         
         # Add test vehicles if no vehicles exist
         cursor.execute("SELECT COUNT(*) FROM vehicles")
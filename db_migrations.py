@@ -0,0 +1,379 @@
+import sys
+import time
+import logging
+import argparse
+import datetime
+from typing import NamedTuple, Callable
+
+import db_pool
+import db_dates
+import db_stats
+import db_search
+import db_indexes
+
+# Сколько строк обрабатывает одна транзакция пакетной миграции
+MIGRATION_BATCH_SIZE = 1000
+
+# Пауза между пакетами (секунды), чтобы бот успевал записывать свои изменения
+MIGRATION_BATCH_PAUSE = 0.05
+
+
+class Migration(NamedTuple):
+    """A numbered schema or data change"""
+    version: int
+    name: str
+    apply: Callable
+    batched: bool
+
+
+# Зарегистрированные миграции в порядке номеров
+MIGRATIONS = []
+
+
+def migration(version, name, batched=False):
+    """
+    Register a migration
+
+    A regular migration is called as fn(conn) and runs in one transaction
+    together with its schema_version record.
+
+    A batched migration is a generator called as fn(conn, batch_size). It
+    yields after each batch; the engine commits there, so a long data
+    migration never holds the write lock for the whole run. Batched
+    migrations must be safe to restart from the beginning.
+
+    Args:
+        version (int): Unique, increasing migration number
+        name (str): Short description
+        batched (bool): Whether fn is a batch generator
+    """
+    def decorator(fn):
+        if any(m.version == version for m in MIGRATIONS):
+            raise ValueError(f"Миграция {version} уже зарегистрирована")
+        MIGRATIONS.append(Migration(version, name, fn, batched))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return fn
+    return decorator
+
+
+# Migrations
+@migration(1, "Base schema")
+def _base_schema(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS vehicles (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        model TEXT NOT NULL,
+        reg_number TEXT NOT NULL UNIQUE,
+        vin TEXT UNIQUE,
+        category TEXT,
+        qualification TEXT,
+        year INTEGER,
+        mileage INTEGER DEFAULT 0,
+        tachograph_required BOOLEAN DEFAULT FALSE,
+        osago_valid TEXT,
+        tech_inspection_date TEXT,
+        tech_inspection_valid TEXT,
+        skzi_install_date TEXT,
+        skzi_valid_date TEXT,
+        next_to INTEGER,
+        last_to_date TEXT,
+        next_to_date TEXT,
+        fuel_type TEXT,
+        fuel_tank_capacity REAL,
+        avg_fuel_consumption REAL,
+        notes TEXT
+    )
+    ''')
+
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS maintenance (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        vehicle_id INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        mileage INTEGER NOT NULL,
+        works TEXT NOT NULL,
+        FOREIGN KEY (vehicle_id) REFERENCES vehicles (id)
+    )
+    ''')
+
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS repairs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        vehicle_id INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        mileage INTEGER NOT NULL,
+        description TEXT NOT NULL,
+        cost REAL,
+        FOREIGN KEY (vehicle_id) REFERENCES vehicles (id)
+    )
+    ''')
+
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS refueling (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        vehicle_id INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        mileage INTEGER NOT NULL,
+        liters REAL NOT NULL,
+        cost_per_liter REAL NOT NULL,
+        FOREIGN KEY (vehicle_id) REFERENCES vehicles (id)
+    )
+    ''')
+
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        username TEXT,
+        full_name TEXT,
+        is_admin BOOLEAN DEFAULT 0,
+        first_seen TEXT NOT NULL,
+        last_activity TEXT NOT NULL,
+        interaction_count INTEGER DEFAULT 1
+    )
+    ''')
+
+
+@migration(2, "Add vehicle columns missing in old databases")
+def _vehicle_columns(conn):
+    # Раньше выполнялось скриптом update_mileage.py
+    columns = {
+        "year": "INTEGER",
+        "mileage": "INTEGER DEFAULT 0",
+        "next_to": "INTEGER",
+        "last_to_date": "TEXT",
+        "next_to_date": "TEXT",
+        "fuel_type": "TEXT",
+        "fuel_tank_capacity": "REAL",
+        "avg_fuel_consumption": "REAL",
+        "notes": "TEXT",
+    }
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(vehicles)").fetchall()}
+    for name, definition in columns.items():
+        if name not in existing:
+            logging.info(f"Добавление столбца vehicles.{name}")
+            conn.execute(f"ALTER TABLE vehicles ADD COLUMN {name} {definition}")
+
+
+@migration(3, "ISO date columns and sync triggers")
+def _iso_date_columns(conn):
+    db_dates.add_iso_columns(conn)
+
+
+@migration(4, "Backfill ISO dates", batched=True)
+def _backfill_iso_dates(conn, batch_size):
+    yield from db_dates.backfill_iso_dates(conn, batch_size)
+
+
+@migration(5, "Secondary indexes")
+def _secondary_indexes(conn):
+    db_indexes.create_indexes(conn)
+
+
+@migration(6, "Skip ISO insert triggers when the value is supplied")
+def _conditional_iso_triggers(conn):
+    db_dates.recreate_triggers(conn)
+
+
+@migration(7, "Per-vehicle stats summary table")
+def _vehicle_stats(conn):
+    db_stats.create_stats_table(conn)
+    db_stats.rebuild_stats(conn)
+
+
+@migration(8, "Full-text search index over history")
+def _history_search(conn):
+    db_search.create_search_index(conn)
+
+
+@migration(9, "Persistent FSM storage for bot dialogs")
+def _fsm_storage(conn):
+    # Используется fsm_storage.SQLiteStorage
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS fsm_storage (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated ON fsm_storage (updated_at)")
+
+
+@migration(10, "Record dates in the history search index")
+def _history_search_dates(conn):
+    # Столбцы FTS5 нельзя добавить через ALTER TABLE - индекс строится заново
+    db_search.create_search_index(conn, rebuild=True)
+
+
+# Engine
+def _ensure_version_table(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TEXT NOT NULL,
+        duration_ms REAL
+    )
+    ''')
+
+
+def get_applied_versions(conn):
+    """
+    Get the numbers of migrations already applied to a database
+
+    Returns:
+        set: Applied migration versions
+    """
+    _ensure_version_table(conn)
+    return {row[0] for row in conn.execute("SELECT version FROM schema_version").fetchall()}
+
+
+def get_pending_migrations(conn, target=None):
+    """
+    Get migrations that are not applied yet
+
+    Args:
+        conn (sqlite3.Connection): Open connection
+        target (int): Stop at this version (all pending if None)
+
+    Returns:
+        list: Pending Migration objects in order
+    """
+    applied = get_applied_versions(conn)
+    return [
+        m for m in MIGRATIONS
+        if m.version not in applied and (target is None or m.version <= target)
+    ]
+
+
+def _run_migration(conn, m, batch_size, pause, commit):
+    """Run one migration; returns the number of processed batches"""
+    if not m.batched:
+        m.apply(conn)
+        return 1
+
+    batches = 0
+    for rows in m.apply(conn, batch_size):
+        batches += 1
+        if commit:
+            conn.execute("COMMIT")
+            if pause:
+                time.sleep(pause)
+            conn.execute("BEGIN IMMEDIATE")
+    return batches
+
+
+def apply_migrations(db_path=None, dry_run=False, target=None,
+                     batch_size=MIGRATION_BATCH_SIZE, pause=MIGRATION_BATCH_PAUSE):
+    """
+    Apply pending migrations
+
+    Each migration runs in its own transaction (batched migrations commit
+    after every batch). With dry_run=True all pending migrations are run in a
+    single transaction that is rolled back, which gives timings without
+    changing the database.
+
+    After the migrations, every run (without target) compares the indexes
+    with db_indexes.INDEXES and creates or rebuilds the ones that differ,
+    so a change to the index set reaches existing databases.
+
+    Args:
+        db_path (str): Database path (db_pool.DB_PATH by default)
+        dry_run (bool): Roll back instead of committing
+        target (int): Apply migrations up to this version only
+        batch_size (int): Rows per transaction for batched migrations
+        pause (float): Sleep between batches, seconds
+
+    Returns:
+        list: (version, name, duration_ms, batches) for every migration that was run
+
+    Raises:
+        Exception from a failing migration; its transaction is rolled back and
+        later migrations are not applied
+    """
+    conn = db_pool.create_connection(db_path or db_pool.DB_PATH, isolation_level=None)
+    results = []
+
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        pending = get_pending_migrations(conn, target)
+
+        for m in pending:
+            # Миграцию мог уже применить другой процесс (бот и веб стартуют одновременно)
+            if m.version in get_applied_versions(conn):
+                continue
+
+            started = time.perf_counter()
+            try:
+                batches = _run_migration(conn, m, batch_size, pause, commit=not dry_run)
+            except Exception:
+                logging.error(f"Ошибка в миграции {m.version} ({m.name}), изменения отменены")
+                raise
+            duration_ms = (time.perf_counter() - started) * 1000
+
+            conn.execute(
+                "INSERT INTO schema_version (version, name, applied_at, duration_ms) VALUES (?, ?, ?, ?)",
+                (m.version, m.name, datetime.datetime.now().isoformat(timespec="seconds"), duration_ms)
+            )
+            results.append((m.version, m.name, duration_ms, batches))
+
+            if not dry_run:
+                conn.execute("COMMIT")
+                logging.info(f"Применена миграция {m.version} ({m.name}) за {duration_ms:.1f} мс")
+                conn.execute("BEGIN IMMEDIATE")
+
+        if target is None:
+            # Набор индексов сверяется при каждом запуске: миграция 5 выполняется
+            # один раз, а INDEXES может измениться позже
+            changed = db_indexes.create_indexes(conn)
+            if changed:
+                logging.info(f"Созданы или пересозданы индексы: {', '.join(changed)}")
+
+        conn.execute("ROLLBACK" if dry_run else "COMMIT")
+        return results
+    finally:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        conn.close()
+
+
+def migration_status(db_path=None):
+    """
+    Get the state of every known migration
+
+    Returns:
+        list: (version, name, applied_at or None)
+    """
+    conn = db_pool.create_connection(db_path or db_pool.DB_PATH)
+    try:
+        _ensure_version_table(conn)
+        conn.commit()
+        applied = dict(conn.execute("SELECT version, applied_at FROM schema_version").fetchall())
+    finally:
+        conn.close()
+    return [(m.version, m.name, applied.get(m.version)) for m in MIGRATIONS]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Применение миграций схемы vehicles.db")
+    parser.add_argument("--db", default=db_pool.DB_PATH, help="путь к базе данных")
+    parser.add_argument("--dry-run", action="store_true", help="выполнить и откатить, показав время")
+    parser.add_argument("--status", action="store_true", help="показать примененные миграции")
+    parser.add_argument("--target", type=int, help="применить миграции до указанной версии")
+    parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if args.status:
+        for version, name, applied_at in migration_status(args.db):
+            print(f"{version:>4}  {'applied ' + applied_at if applied_at else 'pending':<28} {name}")
+        sys.exit(0)
+
+    results = apply_migrations(args.db, dry_run=args.dry_run, target=args.target, batch_size=args.batch_size)
+    if not results:
+        print("Нет новых миграций")
+    for version, name, duration_ms, batches in results:
+        print(f"{version:>4}  {duration_ms:>10.1f} ms  {batches:>5} batch(es)  {name}")
+    if args.dry_run:
+        print("Dry run: изменения отменены")
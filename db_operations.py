@@ -1,11 +1,27 @@
+import json
 import sqlite3
 import logging
 import datetime
-from typing import List, Dict, Tuple, Optional, Union, Any
+from typing import List, Dict, Tuple, Optional, Union, Any, NamedTuple, Iterable
+
+import db_pool
+import db_writer
+import db_dates
+import db_search
+import fleet_expiry
+from db_cache import admin_cache, data_versions
+from db_roster import fleet_roster, RosterSnapshot
+from db_activity import activity_tracker
+from services_db import validate_date, validate_mileage, validate_float
 
 def get_connection():
-    """Get a connection to the SQLite database"""
-    return sqlite3.connect('vehicles.db')
+    """
+    Get a standalone connection to the SQLite database
+
+    Kept for scripts that manage the connection themselves; functions in this
+    module borrow long-lived connections from db_pool instead.
+    """
+    return sqlite3.connect(db_pool.DB_PATH)
 
 # Vehicle operations
 def get_all_vehicles() -> List[Dict]:
@@ -16,19 +32,37 @@ def get_all_vehicles() -> List[Dict]:
         List of dictionaries with vehicle data
     """
     try:
-        conn = get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM vehicles ORDER BY model")
-        vehicles = [dict(row) for row in cursor.fetchall()]
+        with db_pool.connection() as conn:
+            cursor = conn.execute("SELECT * FROM vehicles ORDER BY model")
+            vehicles = [dict(row) for row in cursor.fetchall()]
         
-        conn.close()
         return vehicles
     except Exception as e:
         logging.error(f"Error retrieving vehicles: {e}")
         return []
 
+def get_fleet_roster() -> RosterSnapshot:
+    """
+    Get the shared snapshot of vehicle IDs, models and registration numbers
+    
+    The snapshot is rebuilt only after a vehicle is added or renamed (or
+    after db_roster.ROSTER_TTL), so menus can page and search it without
+    querying the database.
+    
+    Returns:
+        RosterSnapshot ordered by model (empty if the database is unavailable)
+    """
+    def load():
+        with db_pool.connection() as conn:
+            cursor = conn.execute("SELECT id, model, reg_number FROM vehicles ORDER BY model, reg_number")
+            return [dict(row) for row in cursor.fetchall()]
+    
+    try:
+        return fleet_roster.get(load)
+    except Exception as e:
+        logging.error(f"Error building vehicle roster: {e}")
+        return RosterSnapshot([], version=-1)
+
 def get_vehicle(vehicle_id: int) -> Optional[Dict]:
     """
     Get a vehicle by ID
@@ -40,19 +74,129 @@ def get_vehicle(vehicle_id: int) -> Optional[Dict]:
         Dictionary with vehicle data or None if not found
     """
     try:
-        conn = get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        with db_pool.connection() as conn:
+            cursor = conn.execute("SELECT * FROM vehicles WHERE id = ?", (vehicle_id,))
+            vehicle = cursor.fetchone()
         
-        cursor.execute("SELECT * FROM vehicles WHERE id = ?", (vehicle_id,))
-        vehicle = cursor.fetchone()
-        
-        conn.close()
         return dict(vehicle) if vehicle else None
     except Exception as e:
         logging.error(f"Error retrieving vehicle {vehicle_id}: {e}")
         return None
 
+class VehicleCardData(NamedTuple):
+    """Everything the vehicle card needs, loaded by get_vehicle_card_data"""
+    vehicle: Dict
+    maintenance: List[Dict]
+    repairs: List[Dict]
+    has_more_maintenance: bool
+    has_more_repairs: bool
+    last_to_mileage: Optional[int]
+
+# Сколько последних записей ТО и ремонтов показывать в карточке
+CARD_HISTORY_LIMIT = 10
+
+def get_vehicle_card_data(vehicle_id: int, history_limit: int = CARD_HISTORY_LIMIT) -> Optional[VehicleCardData]:
+    """
+    Load the vehicle row and its most recent history in a single query
+    
+    Both history lists are capped at history_limit rows (one extra row is
+    read only to tell whether older records exist), so the cost does not
+    grow with the length of the vehicle's history.
+    
+    Args:
+        vehicle_id (int): The vehicle ID
+        history_limit (int): Maximum number of maintenance and repair records
+        
+    Returns:
+        VehicleCardData or None if the vehicle was not found
+    """
+    query = f"""
+    WITH m AS (
+        SELECT date, mileage, works,
+               ROW_NUMBER() OVER (ORDER BY date_iso DESC, mileage DESC) AS rn
+        FROM maintenance
+        WHERE vehicle_id = :vehicle_id
+        ORDER BY date_iso DESC, mileage DESC
+        LIMIT :limit
+    ), r AS (
+        SELECT date, mileage, description, cost,
+               ROW_NUMBER() OVER (ORDER BY date_iso DESC, mileage DESC) AS rn
+        FROM repairs
+        WHERE vehicle_id = :vehicle_id
+        ORDER BY date_iso DESC, mileage DESC
+        LIMIT :limit
+    )
+    SELECT v.*,
+           (SELECT json_group_array(json_array(rn, date, mileage, works)) FROM m) AS maintenance_json,
+           (SELECT json_group_array(json_array(rn, date, mileage, description, cost)) FROM r) AS repairs_json
+    FROM vehicles v
+    WHERE v.id = :vehicle_id
+    """
+    try:
+        with db_pool.connection() as conn:
+            row = conn.execute(query, {"vehicle_id": vehicle_id, "limit": history_limit + 1}).fetchone()
+        
+        if not row:
+            return None
+        
+        vehicle = dict(row)
+        maintenance = [
+            {"date": date, "mileage": mileage, "works": works}
+            for rn, date, mileage, works in sorted(json.loads(vehicle.pop("maintenance_json")))
+        ]
+        repairs = [
+            {"date": date, "mileage": mileage, "description": description, "cost": cost}
+            for rn, date, mileage, description, cost in sorted(json.loads(vehicle.pop("repairs_json")))
+        ]
+        
+        return VehicleCardData(
+            vehicle=vehicle,
+            maintenance=maintenance[:history_limit],
+            repairs=repairs[:history_limit],
+            has_more_maintenance=len(maintenance) > history_limit,
+            has_more_repairs=len(repairs) > history_limit,
+            last_to_mileage=maintenance[0]["mileage"] if maintenance else None,
+        )
+    except Exception as e:
+        logging.error(f"Error loading card data for vehicle {vehicle_id}: {e}")
+        return None
+
+def get_history_page(vehicle_id: int, kind: str, offset: int = 0, limit: int = 20) -> Tuple[List[Dict], bool]:
+    """
+    Get one page of a vehicle's maintenance or repair history, newest first
+    
+    Args:
+        vehicle_id (int): The vehicle ID
+        kind (str): "maintenance" or "repairs"
+        offset (int): Number of records to skip
+        limit (int): Page size
+        
+    Returns:
+        Tuple of (records, has_more)
+    """
+    columns = {
+        "maintenance": "id, date, mileage, works",
+        "repairs": "id, date, mileage, description, cost",
+    }
+    if kind not in columns:
+        logging.error(f"Unknown history kind: {kind}")
+        return [], False
+    
+    try:
+        with db_pool.connection() as conn:
+            cursor = conn.execute(f"""
+            SELECT {columns[kind]} FROM {kind}
+            WHERE vehicle_id = ?
+            ORDER BY date_iso DESC, mileage DESC
+            LIMIT ? OFFSET ?
+            """, (vehicle_id, limit + 1, offset))
+            records = [dict(row) for row in cursor.fetchall()]
+        
+        return records[:limit], len(records) > limit
+    except Exception as e:
+        logging.error(f"Error retrieving {kind} history for vehicle {vehicle_id}: {e}")
+        return [], False
+
 def update_vehicle_mileage(vehicle_id: int, new_mileage: int) -> bool:
     """
     Update a vehicle's mileage
@@ -64,27 +208,65 @@ def update_vehicle_mileage(vehicle_id: int, new_mileage: int) -> bool:
     Returns:
         bool: True if updated successfully, False otherwise
     """
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
+    def write(conn):
         # Get current mileage
-        cursor.execute("SELECT mileage FROM vehicles WHERE id = ?", (vehicle_id,))
-        current_mileage = cursor.fetchone()[0]
+        current_mileage = conn.execute("SELECT mileage FROM vehicles WHERE id = ?", (vehicle_id,)).fetchone()[0]
         
         # Check if new mileage is greater than current
         if new_mileage <= current_mileage:
-            conn.close()
             return False
         
         # Update mileage
-        cursor.execute("UPDATE vehicles SET mileage = ? WHERE id = ?", (new_mileage, vehicle_id))
-        conn.commit()
-        conn.close()
+        conn.execute("UPDATE vehicles SET mileage = ? WHERE id = ?", (new_mileage, vehicle_id))
         return True
+    
+    try:
+        return db_writer.execute(write)
     except Exception as e:
         logging.error(f"Error updating mileage for vehicle {vehicle_id}: {e}")
         return False
+    finally:
+        data_versions.bump(vehicle_id)
+
+# Vehicle fields that can be edited from the bot
+EDITABLE_VEHICLE_FIELDS = (
+    "model", "vin", "category", "reg_number", "qualification", "tachograph_required",
+    "osago_valid", "tech_inspection_date", "tech_inspection_valid", "skzi_install_date",
+    "skzi_valid_date", "notes", "mileage", "fuel_type", "fuel_tank_capacity", "avg_fuel_consumption"
+)
+
+def update_vehicle_fields(vehicle_id: int, fields: Dict[str, Any]) -> bool:
+    """
+    Update one or more vehicle fields
+    
+    Args:
+        vehicle_id (int): The vehicle ID
+        fields (dict): Mapping of column name to new value
+        
+    Returns:
+        bool: True if updated successfully, False otherwise
+    """
+    unknown = [name for name in fields if name not in EDITABLE_VEHICLE_FIELDS]
+    if unknown or not fields:
+        logging.error(f"Недопустимые поля для обновления ТС {vehicle_id}: {unknown}")
+        return False
+    
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    params = list(fields.values()) + [vehicle_id]
+    
+    def write(conn):
+        cursor = conn.execute(f"UPDATE vehicles SET {assignments} WHERE id = ?", params)
+        return cursor.rowcount > 0
+    
+    try:
+        return db_writer.execute(write)
+    except Exception as e:
+        logging.error(f"Error updating vehicle {vehicle_id}: {e}")
+        return False
+    finally:
+        data_versions.bump(vehicle_id)
+        if "model" in fields or "reg_number" in fields:
+            fleet_roster.invalidate()
 
 def add_vehicle(
     model: str, 
@@ -117,11 +299,8 @@ def add_vehicle(
     Returns:
         int: The ID of the new vehicle, or -1 if an error occurred
     """
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+    def write(conn):
+        cursor = conn.execute('''
         INSERT INTO vehicles (
             model, reg_number, vin, category, qualification, year, mileage, 
             tachograph_required, osago_valid, tech_inspection_date, tech_inspection_valid,
@@ -134,14 +313,15 @@ def add_vehicle(
             skzi_install_date, skzi_valid_date, next_to, last_to_date,
             next_to_date, fuel_type, fuel_tank_capacity, avg_fuel_consumption, notes
         ))
-        
-        vehicle_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return vehicle_id
+        return cursor.lastrowid
+    
+    try:
+        return db_writer.execute(write)
     except Exception as e:
         logging.error(f"Error adding vehicle: {e}")
         return -1
+    finally:
+        fleet_roster.invalidate()
 
 # Maintenance operations
 def get_maintenance_history(vehicle_id: int) -> List[Dict]:
@@ -155,24 +335,20 @@ def get_maintenance_history(vehicle_id: int) -> List[Dict]:
         List of dictionaries with maintenance records
     """
     try:
-        conn = get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-        SELECT * FROM maintenance 
-        WHERE vehicle_id = ? 
-        ORDER BY date DESC, mileage DESC
-        """, (vehicle_id,))
-        
-        maintenance = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        with db_pool.connection() as conn:
+            cursor = conn.execute("""
+            SELECT * FROM maintenance 
+            WHERE vehicle_id = ? 
+            ORDER BY date_iso DESC, mileage DESC
+            """, (vehicle_id,))
+            
+            maintenance = [dict(row) for row in cursor.fetchall()]
         return maintenance
     except Exception as e:
         logging.error(f"Error retrieving maintenance history for vehicle {vehicle_id}: {e}")
         return []
 
-def add_maintenance(vehicle_id: int, date: str, mileage: int, works: str) -> bool:
+def add_maintenance(vehicle_id: int, date: str, mileage: int, works: str, update_last_to_date: bool = False) -> bool:
     """
     Add a maintenance record
     
@@ -181,25 +357,131 @@ def add_maintenance(vehicle_id: int, date: str, mileage: int, works: str) -> boo
         date (str): Date of maintenance
         mileage (int): Mileage at maintenance
         works (str): Description of maintenance works
+        update_last_to_date (bool): Also store the date as the vehicle's last TO date
         
     Returns:
         bool: True if added successfully, False otherwise
     """
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
+    def write(conn):
+        conn.execute("""
         INSERT INTO maintenance (vehicle_id, date, mileage, works) 
         VALUES (?, ?, ?, ?)
         """, (vehicle_id, date, mileage, works))
         
-        conn.commit()
-        conn.close()
+        if update_last_to_date:
+            conn.execute("UPDATE vehicles SET last_to_date = ? WHERE id = ?", (date, vehicle_id))
         return True
+    
+    try:
+        return db_writer.execute(write)
     except Exception as e:
         logging.error(f"Error adding maintenance record for vehicle {vehicle_id}: {e}")
         return False
+    finally:
+        data_versions.bump(vehicle_id)
+
+def get_maintenance_record(maintenance_id: int) -> Optional[Dict]:
+    """
+    Get a single maintenance record with its vehicle model and registration number
+    
+    Args:
+        maintenance_id (int): The maintenance record ID
+        
+    Returns:
+        Dictionary with the record or None if not found
+    """
+    try:
+        with db_pool.connection() as conn:
+            record = conn.execute("""
+            SELECT m.id, m.date, m.mileage, m.works, m.vehicle_id, v.model, v.reg_number
+            FROM maintenance m
+            JOIN vehicles v ON m.vehicle_id = v.id
+            WHERE m.id = ?
+            """, (maintenance_id,)).fetchone()
+        return dict(record) if record else None
+    except Exception as e:
+        logging.error(f"Error retrieving maintenance record {maintenance_id}: {e}")
+        return None
+
+def update_maintenance(maintenance_id: int, date: str, mileage: int, works: str) -> bool:
+    """
+    Update a maintenance record
+    
+    If the record is the most recent TO of its vehicle, the vehicle's
+    last_to_date is updated as well.
+    
+    Args:
+        maintenance_id (int): The maintenance record ID
+        date (str): Date of maintenance
+        mileage (int): Mileage at maintenance
+        works (str): Description of maintenance works
+        
+    Returns:
+        bool: True if updated successfully, False otherwise
+    """
+    touched = []
+    
+    def write(conn):
+        row = conn.execute("SELECT vehicle_id FROM maintenance WHERE id = ?", (maintenance_id,)).fetchone()
+        if not row:
+            return False
+        vehicle_id = row[0]
+        touched.append(vehicle_id)
+        
+        conn.execute(
+            "UPDATE maintenance SET date = ?, mileage = ?, works = ? WHERE id = ?",
+            (date, mileage, works, maintenance_id)
+        )
+        
+        # If this is the most recent maintenance, update vehicle's last_to_date
+        latest = conn.execute("""
+        SELECT id FROM maintenance
+        WHERE vehicle_id = ?
+        ORDER BY date_iso DESC, mileage DESC
+        LIMIT 1
+        """, (vehicle_id,)).fetchone()
+        
+        if latest and latest[0] == maintenance_id:
+            conn.execute("UPDATE vehicles SET last_to_date = ? WHERE id = ?", (date, vehicle_id))
+        return True
+    
+    try:
+        return db_writer.execute(write)
+    except Exception as e:
+        logging.error(f"Error updating maintenance record {maintenance_id}: {e}")
+        return False
+    finally:
+        for vehicle_id in touched:
+            data_versions.bump(vehicle_id)
+
+def delete_maintenance(maintenance_id: int) -> Optional[int]:
+    """
+    Delete a maintenance record
+    
+    Args:
+        maintenance_id (int): The maintenance record ID
+        
+    Returns:
+        int: ID of the vehicle the record belonged to, or None if nothing was deleted
+    """
+    touched = []
+    
+    def write(conn):
+        row = conn.execute("SELECT vehicle_id FROM maintenance WHERE id = ?", (maintenance_id,)).fetchone()
+        if not row:
+            return None
+        touched.append(row[0])
+        conn.execute("DELETE FROM maintenance WHERE id = ?", (maintenance_id,))
+        return row[0]
+    
+    try:
+        return db_writer.execute(write)
+    except Exception as e:
+        logging.error(f"Error deleting maintenance record {maintenance_id}: {e}")
+        return None
+    finally:
+        for vehicle_id in touched:
+            data_versions.bump(vehicle_id)
 
 # Repair operations
 def get_repairs(vehicle_id: int) -> List[Dict]:
@@ -213,18 +495,14 @@ def get_repairs(vehicle_id: int) -> List[Dict]:
         List of dictionaries with repair records
     """
     try:
-        conn = get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-        SELECT * FROM repairs 
-        WHERE vehicle_id = ? 
-        ORDER BY date DESC, mileage DESC
-        """, (vehicle_id,))
-        
-        repairs = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        with db_pool.connection() as conn:
+            cursor = conn.execute("""
+            SELECT * FROM repairs 
+            WHERE vehicle_id = ? 
+            ORDER BY date_iso DESC, mileage DESC
+            """, (vehicle_id,))
+            
+            repairs = [dict(row) for row in cursor.fetchall()]
         return repairs
     except Exception as e:
         logging.error(f"Error retrieving repairs for vehicle {vehicle_id}: {e}")
@@ -244,23 +522,81 @@ def add_repair(vehicle_id: int, date: str, mileage: int, description: str, cost:
     Returns:
         bool: True if added successfully, False otherwise
     """
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
+    def write(conn):
+        conn.execute("""
         INSERT INTO repairs (vehicle_id, date, mileage, description, cost) 
         VALUES (?, ?, ?, ?, ?)
         """, (vehicle_id, date, mileage, description, cost))
-        
-        conn.commit()
-        conn.close()
         return True
+    
+    try:
+        return db_writer.execute(write)
     except Exception as e:
         logging.error(f"Error adding repair record for vehicle {vehicle_id}: {e}")
         return False
+    finally:
+        data_versions.bump(vehicle_id)
+
+def update_repair(repair_id: int, date: str, mileage: int, description: str, cost: float = None) -> bool:
+    """
+    Update a repair record
+    
+    Args:
+        repair_id (int): The repair record ID
+        date (str): Date of repair
+        mileage (int): Mileage at repair
+        description (str): Description of repair
+        cost (float): Cost of repair
+        
+    Returns:
+        bool: True if updated successfully, False otherwise
+    """
+    touched = []
+    
+    def write(conn):
+        row = conn.execute("SELECT vehicle_id FROM repairs WHERE id = ?", (repair_id,)).fetchone()
+        if not row:
+            return False
+        touched.append(row[0])
+        cursor = conn.execute(
+            "UPDATE repairs SET date = ?, mileage = ?, description = ?, cost = ? WHERE id = ?",
+            (date, mileage, description, cost, repair_id)
+        )
+        return cursor.rowcount > 0
+    
+    try:
+        return db_writer.execute(write)
+    except Exception as e:
+        logging.error(f"Error updating repair record {repair_id}: {e}")
+        return False
+    finally:
+        for vehicle_id in touched:
+            data_versions.bump(vehicle_id)
 
 # Refueling operations
+def get_repair_record(repair_id: int) -> Optional[Dict]:
+    """
+    Get a single repair record with its vehicle model and registration number
+    
+    Args:
+        repair_id (int): The repair record ID
+        
+    Returns:
+        Dictionary with the record or None if not found
+    """
+    try:
+        with db_pool.connection() as conn:
+            record = conn.execute("""
+            SELECT r.id, r.date, r.mileage, r.description, r.cost, r.vehicle_id, v.model, v.reg_number
+            FROM repairs r
+            JOIN vehicles v ON r.vehicle_id = v.id
+            WHERE r.id = ?
+            """, (repair_id,)).fetchone()
+        return dict(record) if record else None
+    except Exception as e:
+        logging.error(f"Error retrieving repair record {repair_id}: {e}")
+        return None
+
 def get_refueling_history(vehicle_id: int) -> List[Dict]:
     """
     Get refueling records for a vehicle
@@ -272,18 +608,14 @@ def get_refueling_history(vehicle_id: int) -> List[Dict]:
         List of dictionaries with refueling records
     """
     try:
-        conn = get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-        SELECT * FROM refueling 
-        WHERE vehicle_id = ? 
-        ORDER BY date DESC, mileage DESC
-        """, (vehicle_id,))
-        
-        refueling = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        with db_pool.connection() as conn:
+            cursor = conn.execute("""
+            SELECT * FROM refueling 
+            WHERE vehicle_id = ? 
+            ORDER BY date_iso DESC, mileage DESC
+            """, (vehicle_id,))
+            
+            refueling = [dict(row) for row in cursor.fetchall()]
         return refueling
     except Exception as e:
         logging.error(f"Error retrieving refueling records for vehicle {vehicle_id}: {e}")
@@ -303,90 +635,355 @@ def add_refueling(vehicle_id: int, date: str, mileage: int, liters: float, cost_
     Returns:
         bool: True if added successfully, False otherwise
     """
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
+    def write(conn):
+        conn.execute("""
         INSERT INTO refueling (vehicle_id, date, mileage, liters, cost_per_liter) 
         VALUES (?, ?, ?, ?, ?)
         """, (vehicle_id, date, mileage, liters, cost_per_liter))
-        
-        conn.commit()
-        conn.close()
         return True
+    
+    try:
+        return db_writer.execute(write)
     except Exception as e:
         logging.error(f"Error adding refueling record for vehicle {vehicle_id}: {e}")
         return False
+    finally:
+        data_versions.bump(vehicle_id)
 
-def calculate_fuel_stats(vehicle_id: int) -> Dict:
+# Сколько последних совпадений каждого типа (ТО, ремонты, заметки) ранжируется
+# по релевантности. Общие запросы ("замена") находят сотни тысяч записей;
+# их полное ранжирование слишком дорого
+SEARCH_RANK_WINDOW = 1000
+
+def search_history(text: str, offset: int = 0, limit: int = 20, vehicle_id: int = None,
+                   highlight: str = "*") -> Tuple[List[Dict], bool, bool]:
     """
-    Calculate fuel statistics for a vehicle
+    Full-text search over TO works, repair descriptions and vehicle notes
+    
+    For every kind of record the SEARCH_RANK_WINDOW matches with the latest
+    date are taken, so notes are not crowded out by TO records, and these
+    are returned best first.
     
     Args:
-        vehicle_id (int): The vehicle ID
+        text (str): Search text; word endings are ignored ("колодки" finds "колодок")
+        offset (int): Number of results to skip
+        limit (int): Page size
+        vehicle_id (int): Search only this vehicle's records (all vehicles if None)
+        highlight (str): Marker placed around matched words in the snippet
         
     Returns:
-        Dictionary with fuel statistics
+        Tuple (results ordered by relevance, whether more results exist,
+        whether older matches were left out and the query should be refined).
+        Each result has kind ('maintenance', 'repairs' or 'vehicles'),
+        record_id, vehicle_id, model, reg_number, date, mileage, cost and
+        snippet with the matched words wrapped in the highlight marker.
     """
+    match = db_search.build_match_query(text or "")
+    if not match:
+        return [], False, False
+    
+    vehicle_filter = "AND f.vehicle_id = :vehicle_id" if vehicle_id is not None else ""
+    params = {"vehicle_id": vehicle_id}
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        # Get vehicle data
-        cursor.execute("SELECT avg_fuel_consumption FROM vehicles WHERE id = ?", (vehicle_id,))
-        vehicle = cursor.fetchone()
-        avg_consumption = vehicle[0] if vehicle else 0
-        
-        # Get refueling records
-        cursor.execute("""
-        SELECT mileage, liters, cost_per_liter FROM refueling 
-        WHERE vehicle_id = ? 
-        ORDER BY mileage
-        """, (vehicle_id,))
-        
-        refueling = cursor.fetchall()
-        conn.close()
-        
-        if len(refueling) < 2:
-            total_fuel_cost = sum(r[1] * r[2] for r in refueling)
-            total_fuel_liters = sum(r[1] for r in refueling)
-            avg_cost_per_liter = sum(r[2] for r in refueling) / len(refueling) if refueling else 0
+        with db_pool.connection() as conn:
+            # Окно по каждому типу: rowid начинается с дня даты записи, поэтому
+            # ORDER BY rowid DESC сразу дает самые свежие совпадения
+            ranked, truncated = [], False
+            for kind, *_ in db_search.SEARCH_SOURCES:
+                kind_match = db_search.kind_match_query(kind, match)
+                recent = conn.execute(f"""
+                SELECT rowid FROM history_fts f
+                WHERE history_fts MATCH :match {vehicle_filter}
+                ORDER BY rowid DESC
+                LIMIT :window
+                """, {"match": kind_match, "vehicle_id": vehicle_id, "window": SEARCH_RANK_WINDOW + 1}).fetchall()
+                if not recent:
+                    continue
+                truncated = truncated or len(recent) > SEARCH_RANK_WINDOW
+                recent = recent[:SEARCH_RANK_WINDOW]
+                params[f"{kind}_match"] = kind_match
+                params[f"{kind}_from"] = recent[-1][0]
+                ranked.append(f"""
+                SELECT rowid, {db_search.RANK_SQL} AS score FROM history_fts f
+                WHERE history_fts MATCH :{kind}_match AND rowid >= :{kind}_from {vehicle_filter}
+                """)
+            if not ranked:
+                return [], False, False
             
-            return {
-                "avg_consumption": avg_consumption,
-                "total_fuel_cost": total_fuel_cost,
-                "total_fuel_liters": total_fuel_liters,
-                "avg_cost_per_liter": round(avg_cost_per_liter, 2)
-            }
-        
-        # Calculate actual consumption
-        total_distance = refueling[-1][0] - refueling[0][0]
-        total_fuel = sum(r[1] for r in refueling[1:])  # Exclude the first refueling
-        
-        if total_distance > 0:
-            actual_consumption = (total_fuel / total_distance) * 100
+            # Затем FTS5 ранжирует окна и отбирает страницу, и только для нее
+            # выполняются соединения и строятся фрагменты текста
+            rows = conn.execute(f"""
+            WITH page AS (
+                {" UNION ALL ".join(ranked)}
+                ORDER BY score
+                LIMIT :limit OFFSET :offset
+            )
+            SELECT f.kind, f.record_id, f.vehicle_id, v.model, v.reg_number,
+                   COALESCE(m.date, r.date) AS date,
+                   COALESCE(m.mileage, r.mileage) AS mileage,
+                   r.cost,
+                   snippet(history_fts, 0, :highlight, :highlight, '…', 12) AS snippet
+            FROM page
+            -- CROSS JOIN сохраняет порядок: строки индекса читаются по rowid страницы,
+            -- а не перебором всех совпадений
+            CROSS JOIN history_fts f ON f.rowid = page.rowid
+            JOIN vehicles v ON v.id = f.vehicle_id
+            LEFT JOIN maintenance m ON f.kind = 'maintenance' AND m.id = f.record_id
+            LEFT JOIN repairs r ON f.kind = 'repairs' AND r.id = f.record_id
+            WHERE history_fts MATCH :match
+            ORDER BY page.score
+            """, {**params, "match": match, "highlight": highlight, "limit": limit + 1, "offset": offset}).fetchall()
+        
+        results = [dict(row) for row in rows]
+        return results[:limit], len(results) > limit, truncated
+    except Exception as e:
+        logging.error(f"Error searching history for '{text}': {e}")
+        return [], False, False
+
+# Bulk operations
+class BulkResult(NamedTuple):
+    """Outcome of a bulk insert"""
+    inserted: int
+    errors: List[Tuple[int, str]]  # (row index in the input, error message)
+
+# Сколько строк передается в один executemany
+BULK_CHUNK_SIZE = 1000
+
+# Названия числовых полей для сообщений об ошибках
+_BULK_FIELD_NAMES = {
+    "cost": "стоимость",
+    "liters": "количество литров",
+    "cost_per_liter": "цена за литр",
+}
+
+def _validate_history_row(row: Union[Dict, Tuple], fields: Tuple[str, ...], vehicle_ids: set) -> Tuple:
+    """
+    Validate one bulk row and convert it to a tuple in column order
+
+    The first three fields are always vehicle_id, date and mileage; the rest
+    are the table-specific fields. Rows may be dicts or tuples in that order.
+    The returned tuple ends with the ISO copy of the date.
+
+    Raises:
+        ValueError: With the message stored in BulkResult.errors
+    """
+    if isinstance(row, dict):
+        values = [row.get(field) for field in fields]
+    else:
+        values = list(row)
+        if len(values) != len(fields):
+            raise ValueError(f"ожидается {len(fields)} полей, получено {len(values)}")
+    record = dict(zip(fields, values))
+
+    try:
+        vehicle_id = int(record["vehicle_id"])
+    except (TypeError, ValueError):
+        raise ValueError("некорректный ID автомобиля")
+    if vehicle_id not in vehicle_ids:
+        raise ValueError(f"автомобиль {vehicle_id} не найден")
+
+    date = str(record["date"] or "").strip()
+    if not validate_date(date):
+        raise ValueError(f"некорректная дата '{date}', ожидается ДД.ММ.ГГГГ")
+
+    is_valid, mileage = validate_mileage(str(record["mileage"]))
+    if not is_valid:
+        raise ValueError(mileage)
+
+    result = [vehicle_id, date, mileage]
+    for field in fields[3:]:
+        value = record[field]
+        if field in ("works", "description"):
+            value = str(value or "").strip()
+            if not value:
+                raise ValueError(f"не заполнено поле {field}")
+        elif field == "cost" and value in (None, "", 0):
+            # Стоимость ремонта необязательна
+            value = None
         else:
-            actual_consumption = avg_consumption
+            is_valid, value = validate_float(str(value), _BULK_FIELD_NAMES[field])
+            if not is_valid:
+                raise ValueError(value)
+        result.append(value)
+    # ISO-дата вычисляется здесь, чтобы триггер не обновлял каждую вставленную строку
+    result.append(db_dates.to_iso(date))
+    return tuple(result)
+
+def _bulk_insert(table: str, fields: Tuple[str, ...], rows: Iterable) -> BulkResult:
+    """
+    Validate rows and insert the valid ones in a single transaction
+
+    Rows are validated before the write starts, so the write lock is held only
+    for the executemany calls. A chunk that fails in SQLite is retried row by
+    row, so one bad row does not abort the batch.
+    """
+    with db_pool.connection() as conn:
+        vehicle_ids = {row[0] for row in conn.execute("SELECT id FROM vehicles").fetchall()}
+
+    errors = []
+    valid = []
+    for index, row in enumerate(rows):
+        try:
+            valid.append((index, _validate_history_row(row, fields, vehicle_ids)))
+        except (ValueError, TypeError, AttributeError) as e:
+            errors.append((index, str(e)))
+
+    columns = fields + ("date_iso",)
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+    def write(conn):
+        inserted = 0
+        write_errors = []
+        for start in range(0, len(valid), BULK_CHUNK_SIZE):
+            chunk = valid[start:start + BULK_CHUNK_SIZE]
+            conn.execute("SAVEPOINT bulk_chunk")
+            try:
+                conn.executemany(sql, [values for index, values in chunk])
+                conn.execute("RELEASE bulk_chunk")
+                inserted += len(chunk)
+                continue
+            except sqlite3.Error:
+                conn.execute("ROLLBACK TO bulk_chunk")
+                conn.execute("RELEASE bulk_chunk")
+
+            # Повторяем пакет построчно, чтобы найти ошибочные строки
+            for index, values in chunk:
+                try:
+                    conn.execute(sql, values)
+                    inserted += 1
+                except sqlite3.Error as e:
+                    write_errors.append((index, str(e)))
+        return inserted, write_errors
+
+    if not valid:
+        return BulkResult(0, errors)
+
+    try:
+        inserted, write_errors = db_writer.execute(write, timeout=None)
+    except Exception as e:
+        logging.error(f"Error bulk inserting into {table}: {e}")
+        return BulkResult(0, errors + [(index, str(e)) for index, values in valid])
+    finally:
+        for vehicle_id in {values[0] for index, values in valid}:
+            data_versions.bump(vehicle_id)
+
+    errors = sorted(errors + write_errors)
+    if errors:
+        logging.warning(f"Пакетная загрузка в {table}: {inserted} строк добавлено, {len(errors)} с ошибками")
+    return BulkResult(inserted, errors)
+
+def add_maintenance_bulk(rows: Iterable[Union[Dict, Tuple]]) -> BulkResult:
+    """
+    Add many maintenance records in one transaction
+    
+    Args:
+        rows: Dicts with vehicle_id, date, mileage, works, or tuples in that order
         
-        total_fuel_cost = sum(r[1] * r[2] for r in refueling)
-        total_fuel_liters = sum(r[1] for r in refueling)
-        avg_cost_per_liter = sum(r[2] for r in refueling) / len(refueling) if refueling else 0
+    Returns:
+        BulkResult: Number of inserted rows and (index, message) for rejected rows
+    """
+    return _bulk_insert("maintenance", ("vehicle_id", "date", "mileage", "works"), rows)
+
+def add_repairs_bulk(rows: Iterable[Union[Dict, Tuple]]) -> BulkResult:
+    """
+    Add many repair records in one transaction
+    
+    Args:
+        rows: Dicts with vehicle_id, date, mileage, description, cost (optional),
+            or tuples in that order
         
-        return {
-            "avg_consumption": round(actual_consumption, 2),
-            "total_fuel_cost": round(total_fuel_cost, 2),
-            "total_fuel_liters": round(total_fuel_liters, 2),
-            "avg_cost_per_liter": round(avg_cost_per_liter, 2)
-        }
+    Returns:
+        BulkResult: Number of inserted rows and (index, message) for rejected rows
+    """
+    fields = ("vehicle_id", "date", "mileage", "description", "cost")
+    # Стоимость в кортежах можно не указывать
+    rows = (row + (None,) if isinstance(row, tuple) and len(row) == 4 else row for row in rows)
+    return _bulk_insert("repairs", fields, rows)
+
+def add_refueling_bulk(rows: Iterable[Union[Dict, Tuple]]) -> BulkResult:
+    """
+    Add many refueling records in one transaction (e.g. a fuel card export)
+    
+    Args:
+        rows: Dicts with vehicle_id, date, mileage, liters, cost_per_liter,
+            or tuples in that order
+        
+    Returns:
+        BulkResult: Number of inserted rows and (index, message) for rejected rows
+    """
+    return _bulk_insert("refueling", ("vehicle_id", "date", "mileage", "liters", "cost_per_liter"), rows)
+
+def get_vehicle_stats(vehicle_id: int) -> Optional[Dict]:
+    """
+    Get the precomputed totals for a vehicle (see db_stats)
+    
+    Args:
+        vehicle_id (int): The vehicle ID
+        
+    Returns:
+        Dictionary with the vehicle_stats row or None if the vehicle was not found
+    """
+    try:
+        with db_pool.connection() as conn:
+            row = conn.execute("""
+            SELECT v.avg_fuel_consumption, s.*
+            FROM vehicles v
+            LEFT JOIN vehicle_stats s ON s.vehicle_id = v.id
+            WHERE v.id = ?
+            """, (vehicle_id,)).fetchone()
+        return dict(row) if row else None
     except Exception as e:
-        logging.error(f"Error calculating fuel stats for vehicle {vehicle_id}: {e}")
+        logging.error(f"Error retrieving stats for vehicle {vehicle_id}: {e}")
+        return None
+
+def calculate_fuel_stats(vehicle_id: int) -> Dict:
+    """
+    Calculate fuel statistics for a vehicle
+    
+    Args:
+        vehicle_id (int): The vehicle ID
+        
+    Returns:
+        Dictionary with fuel statistics
+    """
+    stats = get_vehicle_stats(vehicle_id)
+    if not stats:
         return {
             "avg_consumption": 0,
             "total_fuel_cost": 0,
             "total_fuel_liters": 0,
             "avg_cost_per_liter": 0
         }
+    
+    avg_consumption = stats["avg_fuel_consumption"]
+    count = stats["refuel_count"] or 0
+    total_fuel_cost = stats["total_fuel_cost"] or 0
+    total_fuel_liters = stats["total_liters"] or 0
+    avg_cost_per_liter = stats["sum_cost_per_liter"] / count if count else 0
+    
+    if count < 2:
+        return {
+            "avg_consumption": avg_consumption,
+            "total_fuel_cost": total_fuel_cost,
+            "total_fuel_liters": total_fuel_liters,
+            "avg_cost_per_liter": round(avg_cost_per_liter, 2)
+        }
+    
+    # Calculate actual consumption
+    total_distance = stats["last_mileage"] - stats["first_mileage"]
+    total_fuel = total_fuel_liters - stats["first_liters"]  # Exclude the first refueling
+    
+    if total_distance > 0:
+        actual_consumption = (total_fuel / total_distance) * 100
+    else:
+        actual_consumption = avg_consumption or 0
+    
+    return {
+        "avg_consumption": round(actual_consumption, 2),
+        "total_fuel_cost": round(total_fuel_cost, 2),
+        "total_fuel_liters": round(total_fuel_liters, 2),
+        "avg_cost_per_liter": round(avg_cost_per_liter, 2)
+    }
 
 def get_maintenance_alert(vehicle_id: int) -> str:
     """
@@ -399,12 +996,9 @@ def get_maintenance_alert(vehicle_id: int) -> str:
         str: Alert message or empty string if no alert
     """
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT mileage, next_to FROM vehicles WHERE id = ?", (vehicle_id,))
-        vehicle = cursor.fetchone()
-        conn.close()
+        with db_pool.connection() as conn:
+            cursor = conn.execute("SELECT mileage, next_to FROM vehicles WHERE id = ?", (vehicle_id,))
+            vehicle = cursor.fetchone()
         
         if not vehicle:
             return ""
@@ -416,12 +1010,13 @@ def get_maintenance_alert(vehicle_id: int) -> str:
             return ""
         
         remaining_km = next_to_mileage - current_mileage
+        status = fleet_expiry.to_status(remaining_km)
         
-        if remaining_km <= 0:
+        if status == fleet_expiry.EXPIRED:
             return "⚠️ **ВНИМАНИЕ!** Техническое обслуживание просрочено! Требуется немедленное ТО!\n\n"
-        elif remaining_km <= 500:
+        elif status == fleet_expiry.CRITICAL:
             return f"⚠️ **ВНИМАНИЕ!** Техническое обслуживание требуется в ближайшее время (осталось {remaining_km} км)!\n\n"
-        elif remaining_km <= 1000:
+        elif status == fleet_expiry.SOON:
             return f"⚠️ Приближается плановое ТО (осталось {remaining_km} км)!\n\n"
         
         return ""
@@ -429,11 +1024,59 @@ def get_maintenance_alert(vehicle_id: int) -> str:
         logging.error(f"Error getting maintenance alert for vehicle {vehicle_id}: {e}")
         return ""
 
+def get_expiring_documents(days: int = 30, include_expired: bool = False) -> List[Dict]:
+    """
+    Get vehicle documents (OSAGO, tech inspection, SKZI) expiring within a number of days
+    
+    The date range is filtered by SQLite on the indexed *_iso columns.
+    
+    Args:
+        days (int): Look-ahead window in days
+        include_expired (bool): Also return documents that have already expired
+        
+    Returns:
+        List of dicts with vehicle_id, model, reg_number, document, valid_until and days_left,
+        ordered by expiration date
+    """
+    today = datetime.date.today()
+    date_from = datetime.date.min.isoformat() if include_expired else today.isoformat()
+    date_to = (today + datetime.timedelta(days=days)).isoformat()
+    
+    parts = []
+    params = []
+    for column, name in db_dates.EXPIRING_DOCUMENTS:
+        condition = f"{column}_iso BETWEEN ? AND ?"
+        if column == "skzi_valid_date":
+            # СКЗИ имеет значение только для машин с тахографом
+            condition += " AND tachograph_required"
+        parts.append(f"""
+            SELECT id AS vehicle_id, model, reg_number, ? AS document,
+                   {column} AS valid_until, {column}_iso AS valid_until_iso,
+                   {db_dates.days_left_sql(column + '_iso')} AS days_left
+            FROM vehicles
+            WHERE {condition}
+        """)
+        params.extend([name, date_from, date_to])
+    
+    try:
+        with db_pool.connection() as conn:
+            cursor = conn.execute(
+                " UNION ALL ".join(parts) + " ORDER BY valid_until_iso, model",
+                params
+            )
+            return [dict(row) for row in cursor.fetchall()]
+    except Exception as e:
+        logging.error(f"Error retrieving expiring documents: {e}")
+        return []
+
 # User operations 
 def register_user(user_id: int, username: str, full_name: str, is_admin: bool = False) -> bool:
     """
     Register a new user or update existing user's information
     
+    Regular users only go to the activity buffer (db_activity) and reach the
+    table with its next batch; registering an admin is written immediately.
+    
     Args:
         user_id (int): Telegram user ID
         username (str): Username
@@ -443,8 +1086,14 @@ def register_user(user_id: int, username: str, full_name: str, is_admin: bool =
     Returns:
         bool: True if registered/updated successfully, False otherwise
     """
-    try:
-        conn = get_connection()
+    if not is_admin:
+        activity_tracker.track(user_id, username, full_name)
+        return True
+    
+    # Накопленные события пользователя должны попасть в базу раньше
+    activity_tracker.flush()
+    
+    def write(conn):
         cursor = conn.cursor()
         
         # Check if user already exists
@@ -466,13 +1115,16 @@ def register_user(user_id: int, username: str, full_name: str, is_admin: bool =
             INSERT INTO users (id, username, full_name, is_admin, first_seen, last_activity)
             VALUES (?, ?, ?, ?, ?, ?)
             """, (user_id, username, full_name, is_admin, current_time, current_time))
-        
-        conn.commit()
-        conn.close()
         return True
+    
+    try:
+        return db_writer.execute(write)
     except Exception as e:
         logging.error(f"Error registering user {user_id}: {e}")
         return False
+    finally:
+        if is_admin:
+            admin_cache.invalidate(user_id)
 
 def get_all_users() -> List[Dict]:
     """
@@ -481,20 +1133,36 @@ def get_all_users() -> List[Dict]:
     Returns:
         List of dictionaries with user data
     """
+    activity_tracker.flush()
     try:
-        conn = get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM users ORDER BY first_seen DESC")
-        users = [dict(row) for row in cursor.fetchall()]
+        with db_pool.connection() as conn:
+            cursor = conn.execute("SELECT * FROM users ORDER BY first_seen DESC")
+            users = [dict(row) for row in cursor.fetchall()]
         
-        conn.close()
         return users
     except Exception as e:
         logging.error(f"Error retrieving users: {e}")
         return []
 
+def get_user(user_id: int) -> Optional[Dict]:
+    """
+    Get a registered user by Telegram ID
+    
+    Args:
+        user_id (int): Telegram user ID
+        
+    Returns:
+        Dictionary with user data or None if the user is not registered
+    """
+    activity_tracker.flush()
+    try:
+        with db_pool.connection() as conn:
+            user = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+        return dict(user) if user else None
+    except Exception as e:
+        logging.error(f"Error retrieving user {user_id}: {e}")
+        return None
+
 def delete_repair(repair_id: int) -> bool:
     """
     Delete a repair record
@@ -506,50 +1174,49 @@ def delete_repair(repair_id: int) -> bool:
         bool: True if deleted successfully, False otherwise
     """
     logging.info(f"Вызов функции delete_repair с repair_id={repair_id}")
-    try:
-        # Проверяем существование записи перед удалением
-        conn = get_connection()
-        conn.row_factory = sqlite3.Row  # Устанавливаем row_factory для получения словаря
+    touched = []
+    
+    def write(conn):
         cursor = conn.cursor()
         
-        # Get vehicle_id before deletion for reference
+        # Проверяем существование записи перед удалением
         logging.info(f"Проверка существования записи с ID={repair_id}")
         cursor.execute("SELECT * FROM repairs WHERE id = ?", (repair_id,))
         result = cursor.fetchone()
         
         if not result:
             logging.error(f"Запись ремонта с ID={repair_id} не найдена")
-            conn.close()
-            return False
+            return None
         
         vehicle_id = result["vehicle_id"]
+        touched.append(vehicle_id)
         logging.info(f"Найдена запись ремонта с vehicle_id={vehicle_id} для ID={repair_id}")
         
-        # Закрываем соединение и открываем новое для удаления
-        conn.close()
-        
         # Удаляем запись
-        conn = get_connection()
-        cursor = conn.cursor()
         logging.info(f"Удаление записи ремонта с ID={repair_id}")
         cursor.execute("DELETE FROM repairs WHERE id = ?", (repair_id,))
         
         # Check if the record was actually deleted
-        rows_affected = cursor.rowcount
-        conn.commit()
+        return cursor.rowcount
+    
+    try:
+        rows_affected = db_writer.execute(write)
+        if rows_affected is None:
+            return False
         
         if rows_affected > 0:
             logging.info(f"Успешно удалена запись о ремонте с ID={repair_id}")
-            conn.close()
             return True
         else:
             logging.error(f"Не удалось удалить запись о ремонте с ID={repair_id}, не найдено строк для удаления")
-            conn.close()
             return False
     except Exception as e:
         logging.error(f"Ошибка при удалении ремонта {repair_id}: {e}")
         logging.exception("Полная информация об ошибке:")
         return False
+    finally:
+        for vehicle_id in touched:
+            data_versions.bump(vehicle_id)
 
 def set_admin_status(user_id: int, is_admin: bool) -> bool:
     """
@@ -562,18 +1229,35 @@ def set_admin_status(user_id: int, is_admin: bool) -> bool:
     Returns:
         bool: True if updated successfully, False otherwise
     """
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("UPDATE users SET is_admin = ? WHERE id = ?", (is_admin, user_id))
-        
-        conn.commit()
-        conn.close()
+    # Пользователь может быть еще только в буфере активности
+    activity_tracker.flush()
+    
+    def write(conn):
+        conn.execute("UPDATE users SET is_admin = ? WHERE id = ?", (is_admin, user_id))
         return True
+    
+    try:
+        return db_writer.execute(write)
     except Exception as e:
         logging.error(f"Error setting admin status for user {user_id}: {e}")
         return False
+    finally:
+        # Сбрасываем кэш и при ошибке: неизвестно, дошла ли запись до базы
+        admin_cache.invalidate(user_id)
+
+def get_admin_ids() -> List[int]:
+    """
+    Get the IDs of all admins (used to warm the admin cache)
+    
+    Returns:
+        List of Telegram user IDs with is_admin = 1
+    """
+    try:
+        with db_pool.connection() as conn:
+            return [row[0] for row in conn.execute("SELECT id FROM users WHERE is_admin = 1").fetchall()]
+    except Exception as e:
+        logging.error(f"Error getting admin IDs: {e}")
+        return []
 
 def get_user_stats() -> Dict:
     """
@@ -582,29 +1266,28 @@ def get_user_stats() -> Dict:
     Returns:
         Dictionary with user statistics
     """
+    activity_tracker.flush()
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
         
-        # Get total number of users
-        cursor.execute("SELECT COUNT(*) FROM users")
-        total_users = cursor.fetchone()[0]
+            # Get total number of users
+            cursor.execute("SELECT COUNT(*) FROM users")
+            total_users = cursor.fetchone()[0]
         
-        # Get number of active users (active in the last 7 days)
-        seven_days_ago = (datetime.datetime.now() - datetime.timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S')
-        cursor.execute("SELECT COUNT(*) FROM users WHERE last_activity > ?", (seven_days_ago,))
-        active_users = cursor.fetchone()[0]
+            # Get number of active users (active in the last 7 days)
+            seven_days_ago = (datetime.datetime.now() - datetime.timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S')
+            cursor.execute("SELECT COUNT(*) FROM users WHERE last_activity > ?", (seven_days_ago,))
+            active_users = cursor.fetchone()[0]
         
-        # Get number of new users in the last 30 days
-        thirty_days_ago = (datetime.datetime.now() - datetime.timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
-        cursor.execute("SELECT COUNT(*) FROM users WHERE first_seen > ?", (thirty_days_ago,))
-        new_users = cursor.fetchone()[0]
+            # Get number of new users in the last 30 days
+            thirty_days_ago = (datetime.datetime.now() - datetime.timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
+            cursor.execute("SELECT COUNT(*) FROM users WHERE first_seen > ?", (thirty_days_ago,))
+            new_users = cursor.fetchone()[0]
         
-        # Get number of admins
-        cursor.execute("SELECT COUNT(*) FROM users WHERE is_admin = 1")
-        admin_count = cursor.fetchone()[0]
-        
-        conn.close()
+            # Get number of admins
+            cursor.execute("SELECT COUNT(*) FROM users WHERE is_admin = 1")
+            admin_count = cursor.fetchone()[0]
         
         return {
             "total_users": total_users,
@@ -632,13 +1315,9 @@ def is_user_admin(user_id: int) -> bool:
         bool: True if the user is an admin, False otherwise
     """
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT is_admin FROM users WHERE id = ?", (user_id,))
-        user = cursor.fetchone()
-        
-        conn.close()
+        with db_pool.connection() as conn:
+            cursor = conn.execute("SELECT is_admin FROM users WHERE id = ?", (user_id,))
+            user = cursor.fetchone()
         
         if user:
             return bool(user[0])
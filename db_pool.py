@@ -0,0 +1,264 @@
+import os
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+# Путь к базе данных (можно переопределить через переменную окружения)
+DB_PATH = os.environ.get("VEHICLES_DB_PATH", "vehicles.db")
+
+# Максимальное количество одновременно открытых соединений
+POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "5"))
+
+# Сколько ждать свободное соединение, прежде чем выбросить ошибку (секунды)
+POOL_ACQUIRE_TIMEOUT = 10.0
+
+# Соединение, простоявшее дольше этого времени, проверяется перед выдачей (секунды)
+HEALTH_CHECK_INTERVAL = 60.0
+
+# Режим журнала: "wal" (читатели не ждут писателя) или "delete" (прежний режим)
+JOURNAL_MODE = os.environ.get("DB_JOURNAL_MODE", "wal").lower()
+
+# Автоматический checkpoint WAL после указанного числа страниц (0 - отключить)
+WAL_AUTOCHECKPOINT = int(os.environ.get("DB_WAL_AUTOCHECKPOINT", "1000"))
+
+# PRAGMA, применяемые к каждому новому соединению
+CONNECTION_PRAGMAS = (
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -8000",
+    "PRAGMA mmap_size = 67108864",
+)
+
+
+def create_connection(db_path=DB_PATH, isolation_level=""):
+    """
+    Open a new tuned connection to the database
+
+    Args:
+        db_path (str): Path to the database file
+        isolation_level (str): sqlite3 isolation level (None for autocommit)
+
+    Returns:
+        sqlite3.Connection: Connection with row_factory set to sqlite3.Row
+    """
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=isolation_level)
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+
+    if JOURNAL_MODE == "wal":
+        mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+        if mode.lower() != "wal":
+            logging.warning(f"Не удалось включить WAL для {db_path}, используется режим {mode}")
+        conn.execute(f"PRAGMA wal_autocheckpoint = {WAL_AUTOCHECKPOINT}")
+    elif JOURNAL_MODE:
+        conn.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}")
+
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+class ConnectionPool:
+    """
+    Bounded pool of long-lived SQLite connections
+
+    Connections are created lazily up to max_size, tuned with CONNECTION_PRAGMAS
+    and reused between calls instead of opening vehicles.db on every query.
+    """
+
+    def __init__(self, db_path=DB_PATH, max_size=POOL_MAX_SIZE,
+                 acquire_timeout=POOL_ACQUIRE_TIMEOUT, health_check_interval=HEALTH_CHECK_INTERVAL):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+
+        # LIFO, чтобы чаще переиспользовать "горячие" соединения
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._size = 0
+        self._last_used = {}
+        self._closed = False
+
+    def _create_connection(self):
+        """Open and tune a new connection"""
+        conn = create_connection(self.db_path)
+        logging.debug(f"Открыто новое соединение с {self.db_path}")
+        return conn
+
+    def _is_healthy(self, conn):
+        """Check that a connection is still usable"""
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error as e:
+            logging.warning(f"Соединение с БД не прошло проверку: {e}")
+            return False
+
+    def _discard(self, conn):
+        """Close a connection and free its slot in the pool"""
+        self._last_used.pop(id(conn), None)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._size -= 1
+
+    def acquire(self):
+        """
+        Take a connection from the pool, creating one if the pool is not full
+
+        Returns:
+            sqlite3.Connection: Connection with row_factory set to sqlite3.Row
+
+        Raises:
+            TimeoutError: If no connection became free within acquire_timeout
+        """
+        if self._closed:
+            raise RuntimeError("Пул соединений закрыт")
+
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = None
+                with self._lock:
+                    if self._size < self.max_size:
+                        self._size += 1
+                        create = True
+                    else:
+                        create = False
+                if create:
+                    try:
+                        return self._create_connection()
+                    except Exception:
+                        with self._lock:
+                            self._size -= 1
+                        raise
+                try:
+                    conn = self._idle.get(timeout=self.acquire_timeout)
+                except queue.Empty:
+                    raise TimeoutError(
+                        f"Нет свободных соединений с БД (размер пула: {self.max_size})"
+                    )
+
+            idle_for = time.monotonic() - self._last_used.get(id(conn), 0)
+            if idle_for > self.health_check_interval and not self._is_healthy(conn):
+                self._discard(conn)
+                continue
+            return conn
+
+    def release(self, conn):
+        """
+        Return a connection to the pool
+
+        Any transaction left open by the caller is rolled back so the next
+        user gets a clean connection.
+        """
+        try:
+            if conn.in_transaction:
+                logging.warning("Соединение возвращено в пул с незавершенной транзакцией, выполняется откат")
+                conn.rollback()
+            conn.row_factory = sqlite3.Row
+        except sqlite3.Error as e:
+            logging.error(f"Ошибка при возврате соединения в пул: {e}")
+            self._discard(conn)
+            return
+
+        if self._closed:
+            self._discard(conn)
+            return
+
+        self._last_used[id(conn)] = time.monotonic()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that borrows a connection for the duration of a block
+
+        Example:
+            with pool.connection() as conn:
+                conn.execute("SELECT ...")
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Close all idle connections and refuse new checkouts"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self):
+        """
+        Get pool statistics
+
+        Returns:
+            dict: Number of open and idle connections and the size limit
+        """
+        return {
+            "open": self._size,
+            "idle": self._idle.qsize(),
+            "max_size": self.max_size,
+        }
+
+
+# Общий пул для всего процесса
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Get the process-wide connection pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def connection():
+    """Shortcut for get_pool().connection()"""
+    return get_pool().connection()
+
+
+def checkpoint(mode="PASSIVE"):
+    """
+    Run a WAL checkpoint
+
+    Args:
+        mode (str): PASSIVE, FULL, RESTART or TRUNCATE
+
+    Returns:
+        tuple: (busy, wal_pages, checkpointed_pages) or None if not in WAL mode
+    """
+    if JOURNAL_MODE != "wal":
+        return None
+    with connection() as conn:
+        return tuple(conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone())
+
+
+def close_pool():
+    """Close the process-wide pool (e.g. on shutdown or before replacing the DB file)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
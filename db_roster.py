@@ -0,0 +1,164 @@
+import os
+import time
+import bisect
+import logging
+import threading
+
+# Сколько секунд снимок списка ТС считается актуальным. Изменения через
+# add_vehicle / update_vehicle_fields сбрасывают его сразу; срок жизни нужен
+# для изменений из другого процесса
+ROSTER_TTL = float(os.environ.get("ROSTER_TTL", "60"))
+
+# Латинские буквы, которые пишут вместо кириллических в госномерах (A123BC -> А123ВС)
+_PLATE_LOOKALIKES = str.maketrans("ABEKMHOPCTYX", "АВЕКМНОРСТУХ")
+
+
+def normalize_key(text):
+    """
+    Normalize model or plate text for prefix search
+
+    Args:
+        text (str): Model, registration number or user input
+
+    Returns:
+        str: Uppercase text without spaces, with "Ё" folded to "Е" and Latin
+        lookalike letters replaced by Cyrillic ones
+    """
+    return (text or "").upper().replace("Ё", "Е").replace(" ", "").translate(_PLATE_LOOKALIKES)
+
+
+class RosterSnapshot:
+    """
+    Immutable list of (id, model, reg_number) for every vehicle, ordered by model
+
+    Pages are slices of the list. Prefix search uses two sorted key lists
+    (models and plates) and bisect, so it does not scan the fleet. memo()
+    keeps values derived from this snapshot (e.g. rendered keyboards); they
+    are dropped together with the snapshot when the roster changes.
+    """
+
+    def __init__(self, vehicles, version):
+        self.vehicles = tuple(vehicles)
+        self.version = version
+        self.built_at = time.monotonic()
+
+        self._by_id = {vehicle["id"]: vehicle for vehicle in self.vehicles}
+        self._model_keys = sorted((normalize_key(v["model"]), v["id"]) for v in self.vehicles)
+        self._plate_keys = sorted((normalize_key(v["reg_number"]), v["id"]) for v in self.vehicles)
+        self._position = {vehicle["id"]: index for index, vehicle in enumerate(self.vehicles)}
+        self._memo = {}
+        self._memo_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.vehicles)
+
+    def page_count(self, page_size):
+        return max(1, -(-len(self.vehicles) // page_size))
+
+    def page(self, page, page_size):
+        """
+        Get one page of the roster
+
+        Returns:
+            tuple: Vehicles on the page (empty if the page is out of range)
+        """
+        start = page * page_size
+        return self.vehicles[start:start + page_size]
+
+    def search(self, text, limit=None):
+        """
+        Find vehicles whose model or registration number starts with text
+
+        Args:
+            text (str): Prefix typed by the user
+            limit (int): Maximum number of results (all if None)
+
+        Returns:
+            list: Matching vehicles in roster order
+        """
+        prefix = normalize_key(text)
+        if not prefix:
+            return []
+
+        found = set()
+        for keys in (self._model_keys, self._plate_keys):
+            index = bisect.bisect_left(keys, (prefix,))
+            while index < len(keys) and keys[index][0].startswith(prefix):
+                found.add(keys[index][1])
+                index += 1
+
+        matches = sorted(found, key=self._position.__getitem__)
+        if limit is not None:
+            matches = matches[:limit]
+        return [self._by_id[vehicle_id] for vehicle_id in matches]
+
+    def memo(self, key, build):
+        """
+        Get a value derived from this snapshot, building it on first use
+
+        Args:
+            key: Hashable key (e.g. ("keyboard", page))
+            build (Callable): Function that builds the value
+
+        Returns:
+            The cached or newly built value
+        """
+        value = self._memo.get(key)
+        if value is None:
+            value = build()
+            with self._memo_lock:
+                value = self._memo.setdefault(key, value)
+        return value
+
+
+class FleetRoster:
+    """
+    Holder of the current RosterSnapshot
+
+    The snapshot is rebuilt on first access after invalidate() or after ttl
+    seconds; between rebuilds every caller gets the same object without a
+    query.
+    """
+
+    def __init__(self, ttl=ROSTER_TTL):
+        self.ttl = ttl
+        self.rebuilds = 0
+        self._snapshot = None
+        self._version = 0
+        self._lock = threading.Lock()
+        # Отдельная блокировка, чтобы сброс не ждал идущую перестройку
+        self._version_lock = threading.Lock()
+
+    def get(self, load):
+        """
+        Get the current snapshot
+
+        Args:
+            load (Callable): Returns the vehicle rows when a rebuild is needed
+
+        Returns:
+            RosterSnapshot
+        """
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == self._version \
+                and time.monotonic() - snapshot.built_at < self.ttl:
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            version = self._version
+            if snapshot is None or snapshot.version != version or time.monotonic() - snapshot.built_at >= self.ttl:
+                snapshot = RosterSnapshot(load(), version)
+                self._snapshot = snapshot
+                self.rebuilds += 1
+                logging.debug(f"Список ТС перестроен: {len(snapshot)} автомобилей")
+            return snapshot
+
+    def invalidate(self):
+        """Mark the snapshot as outdated (a vehicle was added or renamed)"""
+        with self._version_lock:
+            self._version += 1
+
+
+# Общий список ТС для процесса
+fleet_roster = FleetRoster()
@@ -0,0 +1,170 @@
+import re
+import logging
+
+# Полнотекстовый индекс по истории: работы ТО, описания ремонтов и заметки к ТС.
+# rowid строки индекса = день даты записи * 2^32 + id записи * 4 + код типа:
+# триггеры вычисляют его из строки таблицы без дополнительного поиска, а
+# ORDER BY rowid DESC перебирает совпадения от самых свежих без чтения дат.
+SEARCH_SOURCES = (
+    # (тип, код, таблица, текстовый столбец, столбец с ID автомобиля, столбец с датой)
+    ("maintenance", 1, "maintenance", "works", "vehicle_id", "date_iso"),
+    ("repairs", 2, "repairs", "description", "vehicle_id", "date_iso"),
+    ("vehicles", 3, "vehicles", "notes", "id", None),
+)
+
+# Длины префиксов, для которых FTS5 хранит отдельный индекс. Слова запроса
+# превращаются в префиксы (основа + *), и без такого индекса FTS5 пришлось бы
+# перебирать все слова словаря с этим началом.
+PREFIX_LENGTHS = (3, 4, 5, 6, 7, 8)
+
+# unicode61 не различает регистр, но "ё" и "е" считает разными буквами.
+# remove_diacritics 2 убирает ударения в скопированном тексте. Тип записи
+# индексируется, чтобы отбирать совпадения одного типа (kind_match_query).
+FTS_TABLE = f'''
+CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+    body,
+    kind,
+    record_id UNINDEXED,
+    vehicle_id UNINDEXED,
+    tokenize = "unicode61 remove_diacritics 2",
+    prefix = '{" ".join(map(str, PREFIX_LENGTHS))}'
+)
+'''
+
+# Релевантность только по тексту: совпадение с типом записи на нее не влияет
+RANK_SQL = "bm25(history_fts, 1.0, 0.0)"
+
+# Окончания, которые отбрасываются у слов запроса (самые длинные проверяются первыми).
+# "ок"/"ек" - беглая гласная в родительном падеже: колодок -> колод*
+RUSSIAN_ENDINGS = sorted((
+    "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ых", "их",
+    "ой", "ей", "ий", "ый", "ые", "ая", "яя", "ое", "ее", "ую", "юю", "ов", "ев",
+    "ам", "ям", "ах", "ях", "ом", "ем", "ию", "ия", "ие", "ье", "ья", "ью",
+    "ок", "ек", "ы", "и", "а", "я", "о", "е", "у", "ю", "ь", "й",
+), key=len, reverse=True)
+
+RUSSIAN_VOWELS = set("аеиоуыэюяё")
+
+# Основа короче этого не обрезается, чтобы запрос не стал слишком общим
+MIN_STEM_LENGTH = 4
+
+
+def normalize_sql(expr):
+    """SQL expression folding "ё" to "е" (the index stores folded text)"""
+    return f"replace(replace({expr}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def _row_id_sql(row, code, date_column):
+    day = f"COALESCE(CAST(julianday({row}.{date_column}) AS INTEGER), 0)" if date_column else "0"
+    return f"{day} * 4294967296 + {row}.id * 4 + {code}"
+
+
+def _triggers():
+    """(name, event, body) for the triggers that keep history_fts in sync"""
+    triggers = []
+    for kind, code, table, column, vehicle_column, date_column in SEARCH_SOURCES:
+        insert = (
+            f"INSERT INTO history_fts (rowid, body, kind, record_id, vehicle_id) "
+            f"SELECT {_row_id_sql('NEW', code, date_column)}, {normalize_sql('NEW.' + column)}, '{kind}', NEW.id, NEW.{vehicle_column} "
+            f"WHERE NEW.{column} IS NOT NULL AND NEW.{column} != '';"
+        )
+        delete = f"DELETE FROM history_fts WHERE rowid = {_row_id_sql('OLD', code, date_column)};"
+        # date_iso входит в rowid и заполняется триггером после вставки, поэтому
+        # его изменение тоже переписывает строку индекса
+        updated = ", ".join(c for c in (column, vehicle_column, date_column) if c)
+        triggers += [
+            (f"trg_{table}_fts_insert", f"AFTER INSERT ON {table}", insert),
+            (f"trg_{table}_fts_update", f"AFTER UPDATE OF {updated} ON {table}", delete + insert),
+            (f"trg_{table}_fts_delete", f"AFTER DELETE ON {table}", delete),
+        ]
+    return triggers
+
+
+def create_search_index(conn, rebuild=False):
+    """
+    Create history_fts with its sync triggers and fill it from the tables
+
+    Args:
+        conn (sqlite3.Connection): Open connection (the caller commits)
+        rebuild (bool): Drop the existing table first (its layout changed)
+
+    Returns:
+        int: Number of indexed records
+    """
+    if rebuild:
+        conn.execute("DROP TABLE IF EXISTS history_fts")
+    conn.execute(FTS_TABLE)
+    for name, event, body in _triggers():
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"CREATE TRIGGER {name} {event} BEGIN {body} END")
+
+    conn.execute("DELETE FROM history_fts")
+    for kind, code, table, column, vehicle_column, date_column in SEARCH_SOURCES:
+        conn.execute(f"""
+        INSERT INTO history_fts (rowid, body, kind, record_id, vehicle_id)
+        SELECT {_row_id_sql(table, code, date_column)}, {normalize_sql(column)}, '{kind}', id, {vehicle_column}
+        FROM {table}
+        WHERE {column} IS NOT NULL AND {column} != ''
+        """)
+    # Объединяем сегменты индекса после массовой загрузки
+    conn.execute("INSERT INTO history_fts (history_fts) VALUES ('optimize')")
+
+    count = conn.execute("SELECT COUNT(*) FROM history_fts").fetchone()[0]
+    logging.info(f"Полнотекстовый индекс построен: {count} записей")
+    return count
+
+
+def stem(word):
+    """
+    Cut a common Russian inflection ending off a word
+
+    Args:
+        word (str): Lowercase word
+
+    Returns:
+        str: Stem used as a prefix query
+    """
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            word = word[:-len(ending)]
+            break
+    # Суффикс "к" после согласной: колодки -> колодк -> колод (как и колодок -> колод)
+    if len(word) > MIN_STEM_LENGTH and word[-1] == "к" and word[-2] not in RUSSIAN_VOWELS:
+        word = word[:-1]
+    return word
+
+
+def build_match_query(text):
+    """
+    Turn user input into an FTS5 MATCH expression
+
+    Every word becomes a prefix query on its stem, so "тормозные колодки"
+    also finds "тормозных колодок". All words must match. Stems are cut to
+    the longest indexed prefix length to keep the lookup on the prefix index.
+
+    Args:
+        text (str): Search text as typed by the user
+
+    Returns:
+        str: MATCH expression, or None if the text has no searchable words
+    """
+    words = re.findall(r"\w+", text.lower().replace("ё", "е"))
+    if not words:
+        return None
+    # Кавычки защищают от синтаксиса FTS5 (AND, NEAR, "-" и т.п.) во вводе;
+    # ищется только текст записи, не ее тип
+    return "body : (" + " ".join(f'"{stem(word)[:max(PREFIX_LENGTHS)]}"*' for word in words) + ")"
+
+
+def kind_match_query(kind, match):
+    """
+    Restrict a MATCH expression to one kind of record
+
+    Args:
+        kind (str): 'maintenance', 'repairs' or 'vehicles'
+        match (str): Expression from build_match_query
+
+    Returns:
+        str: MATCH expression
+    """
+    return f"kind : {kind} AND {match}"
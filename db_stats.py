@@ -0,0 +1,155 @@
+import logging
+
+# Сводка по каждому автомобилю, которую поддерживают триггеры.
+# Суммы меняются на величину изменения (O(1)), а крайние значения
+# (первая/последняя заправка, последнее ТО) берутся по индексам (O(log n)),
+# поэтому чтение статистики - это поиск одной строки по первичному ключу.
+STATS_TABLE = '''
+CREATE TABLE IF NOT EXISTS vehicle_stats (
+    vehicle_id INTEGER PRIMARY KEY,
+    refuel_count INTEGER NOT NULL DEFAULT 0,
+    total_liters REAL NOT NULL DEFAULT 0,
+    total_fuel_cost REAL NOT NULL DEFAULT 0,
+    sum_cost_per_liter REAL NOT NULL DEFAULT 0,
+    first_mileage INTEGER,
+    first_liters REAL,
+    last_mileage INTEGER,
+    repair_count INTEGER NOT NULL DEFAULT 0,
+    repair_cost_total REAL NOT NULL DEFAULT 0,
+    last_to_mileage INTEGER,
+    last_to_date TEXT
+)
+'''
+
+
+def _ensure_row_sql(vehicle):
+    return f"INSERT INTO vehicle_stats (vehicle_id) VALUES ({vehicle}) ON CONFLICT (vehicle_id) DO NOTHING;"
+
+
+def _refuel_delta_sql(row, sign):
+    """Add (sign='+') or remove (sign='-') one refueling row from the sums"""
+    return f"""
+        UPDATE vehicle_stats SET
+            refuel_count = refuel_count {sign} 1,
+            total_liters = total_liters {sign} {row}.liters,
+            total_fuel_cost = total_fuel_cost {sign} {row}.liters * {row}.cost_per_liter,
+            sum_cost_per_liter = sum_cost_per_liter {sign} {row}.cost_per_liter
+        WHERE vehicle_id = {row}.vehicle_id;"""
+
+
+def _refuel_extremes_sql(vehicle):
+    """Refresh first/last refueling mileage from idx_refueling_vehicle_mileage"""
+    return f"""
+        UPDATE vehicle_stats SET
+            (first_mileage, first_liters) = (
+                SELECT mileage, liters FROM refueling WHERE vehicle_id = {vehicle} ORDER BY mileage LIMIT 1
+            ),
+            last_mileage = (SELECT MAX(mileage) FROM refueling WHERE vehicle_id = {vehicle})
+        WHERE vehicle_id = {vehicle};"""
+
+
+def _repair_delta_sql(row, sign):
+    return f"""
+        UPDATE vehicle_stats SET
+            repair_count = repair_count {sign} 1,
+            repair_cost_total = repair_cost_total {sign} COALESCE({row}.cost, 0)
+        WHERE vehicle_id = {row}.vehicle_id;"""
+
+
+def _last_to_sql(vehicle):
+    """Refresh the latest TO from idx_maintenance_vehicle_date"""
+    return f"""
+        UPDATE vehicle_stats SET
+            (last_to_mileage, last_to_date) = (
+                SELECT mileage, date FROM maintenance WHERE vehicle_id = {vehicle}
+                ORDER BY date_iso DESC, mileage DESC LIMIT 1
+            )
+        WHERE vehicle_id = {vehicle};"""
+
+
+def _triggers():
+    """(name, event, body) for every trigger that maintains vehicle_stats"""
+    return (
+        ("trg_vehicles_stats_insert", "AFTER INSERT ON vehicles",
+         _ensure_row_sql("NEW.id")),
+        ("trg_vehicles_stats_delete", "AFTER DELETE ON vehicles",
+         "DELETE FROM vehicle_stats WHERE vehicle_id = OLD.id;"),
+
+        ("trg_refueling_stats_insert", "AFTER INSERT ON refueling",
+         _ensure_row_sql("NEW.vehicle_id") + _refuel_delta_sql("NEW", "+")
+         + _refuel_extremes_sql("NEW.vehicle_id")),
+        ("trg_refueling_stats_update", "AFTER UPDATE OF vehicle_id, mileage, liters, cost_per_liter ON refueling",
+         _refuel_delta_sql("OLD", "-") + _refuel_extremes_sql("OLD.vehicle_id")
+         + _ensure_row_sql("NEW.vehicle_id") + _refuel_delta_sql("NEW", "+")
+         + _refuel_extremes_sql("NEW.vehicle_id")),
+        ("trg_refueling_stats_delete", "AFTER DELETE ON refueling",
+         _refuel_delta_sql("OLD", "-") + _refuel_extremes_sql("OLD.vehicle_id")),
+
+        ("trg_repairs_stats_insert", "AFTER INSERT ON repairs",
+         _ensure_row_sql("NEW.vehicle_id") + _repair_delta_sql("NEW", "+")),
+        ("trg_repairs_stats_update", "AFTER UPDATE OF vehicle_id, cost ON repairs",
+         _repair_delta_sql("OLD", "-") + _ensure_row_sql("NEW.vehicle_id") + _repair_delta_sql("NEW", "+")),
+        ("trg_repairs_stats_delete", "AFTER DELETE ON repairs",
+         _repair_delta_sql("OLD", "-")),
+
+        # date_iso заполняется отдельным триггером, поэтому его изменение тоже отслеживается
+        ("trg_maintenance_stats_insert", "AFTER INSERT ON maintenance",
+         _ensure_row_sql("NEW.vehicle_id") + _last_to_sql("NEW.vehicle_id")),
+        ("trg_maintenance_stats_update", "AFTER UPDATE OF vehicle_id, date, date_iso, mileage ON maintenance",
+         _last_to_sql("OLD.vehicle_id") + _ensure_row_sql("NEW.vehicle_id") + _last_to_sql("NEW.vehicle_id")),
+        ("trg_maintenance_stats_delete", "AFTER DELETE ON maintenance",
+         _last_to_sql("OLD.vehicle_id")),
+    )
+
+
+def create_stats_table(conn):
+    """
+    Create vehicle_stats and the triggers that keep it current
+
+    Args:
+        conn (sqlite3.Connection): Open connection (the caller commits)
+    """
+    conn.execute(STATS_TABLE)
+    for name, event, body in _triggers():
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"CREATE TRIGGER {name} {event} BEGIN {body} END")
+
+
+def rebuild_stats(conn):
+    """
+    Recompute vehicle_stats from the history tables
+
+    Needed once after the table is created, and to remove rounding drift
+    accumulated by the incremental updates.
+
+    Args:
+        conn (sqlite3.Connection): Open connection (the caller commits)
+
+    Returns:
+        int: Number of vehicles in the summary
+    """
+    conn.execute("DELETE FROM vehicle_stats")
+    conn.execute("""
+    INSERT INTO vehicle_stats (vehicle_id)
+    SELECT id FROM vehicles
+    UNION SELECT vehicle_id FROM refueling
+    UNION SELECT vehicle_id FROM repairs
+    UNION SELECT vehicle_id FROM maintenance
+    """)
+    vehicle = "vehicle_stats.vehicle_id"
+    conn.execute(f"""
+    UPDATE vehicle_stats SET
+        (refuel_count, total_liters, total_fuel_cost, sum_cost_per_liter) = (
+            SELECT COUNT(*), TOTAL(liters), TOTAL(liters * cost_per_liter), TOTAL(cost_per_liter)
+            FROM refueling WHERE vehicle_id = {vehicle}
+        ),
+        (repair_count, repair_cost_total) = (
+            SELECT COUNT(*), TOTAL(cost) FROM repairs WHERE vehicle_id = {vehicle}
+        )
+    """)
+    conn.execute(_refuel_extremes_sql(vehicle))
+    conn.execute(_last_to_sql(vehicle))
+
+    count = conn.execute("SELECT COUNT(*) FROM vehicle_stats").fetchone()[0]
+    logging.info(f"Сводная статистика пересчитана для {count} автомобилей")
+    return count
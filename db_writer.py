@@ -0,0 +1,249 @@
+import os
+import queue
+import atexit
+import logging
+import threading
+from concurrent.futures import Future
+
+import db_pool
+
+# Максимальное число операций записи, фиксируемых одним COMMIT
+WRITER_BATCH_SIZE = int(os.environ.get("DB_WRITER_BATCH_SIZE", "100"))
+
+# Через сколько секунд простоя писатель выполняет checkpoint WAL (0 - не выполнять)
+CHECKPOINT_INTERVAL = float(os.environ.get("DB_CHECKPOINT_INTERVAL", "300"))
+
+# Сколько ждать результата операции записи по умолчанию (секунды)
+WRITE_TIMEOUT = 30.0
+
+
+class DatabaseWriter:
+    """
+    Single serialized writer for vehicles.db
+
+    All write operations are executed by one background thread that owns its
+    own connection. Jobs queued while a commit is in progress are grouped into
+    one transaction; each job runs inside its own SAVEPOINT, so a failing job
+    is rolled back without affecting the rest of the batch.
+
+    A job is a callable that receives the writer connection as its first
+    argument. It must not call commit() or rollback() itself.
+    """
+
+    def __init__(self, db_path=db_pool.DB_PATH, batch_size=WRITER_BATCH_SIZE,
+                 checkpoint_interval=CHECKPOINT_INTERVAL):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.checkpoint_interval = checkpoint_interval
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = False
+
+        self.commits = 0
+        self.jobs_done = 0
+
+    def start(self):
+        """Start the writer thread if it is not running yet"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue a write job
+
+        Args:
+            fn (callable): Function called as fn(conn, *args, **kwargs)
+
+        Returns:
+            concurrent.futures.Future: Resolved with the job result after commit
+        """
+        if self._stopping:
+            raise RuntimeError("Писатель БД остановлен")
+        self.start()
+        future = Future()
+        self._queue.put((fn, args, kwargs, future))
+        return future
+
+    def execute(self, fn, *args, timeout=WRITE_TIMEOUT, **kwargs):
+        """
+        Queue a write job and wait until it is committed
+
+        Returns:
+            The value returned by fn
+
+        Raises:
+            Exception raised by fn, or by the commit of its batch
+        """
+        return self.submit(fn, *args, **kwargs).result(timeout=timeout)
+
+    def stop(self, timeout=10.0):
+        """Flush queued jobs and stop the writer thread"""
+        with self._lock:
+            thread = self._thread
+            if thread is None or not thread.is_alive():
+                return
+            self._stopping = True
+            self._queue.put(None)
+        thread.join(timeout)
+
+    def _take_batch(self, first):
+        """Collect jobs that are already waiting, up to batch_size"""
+        batch = [first]
+        stop = False
+        while len(batch) < self.batch_size:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                stop = True
+                break
+            batch.append(job)
+        return batch, stop
+
+    def _run_batch(self, conn, batch):
+        """Execute one batch of jobs in a single transaction"""
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, kwargs, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT write_job")
+                try:
+                    result = fn(conn, *args, **kwargs)
+                    conn.execute("RELEASE write_job")
+                    results.append((future, result, None))
+                except BaseException as e:
+                    conn.execute("ROLLBACK TO write_job")
+                    conn.execute("RELEASE write_job")
+                    results.append((future, None, e))
+            conn.execute("COMMIT")
+            self.commits += 1
+        except Exception as e:
+            logging.error(f"Ошибка при фиксации пакета записи ({len(batch)} операций): {e}")
+            try:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+            except Exception as rollback_error:
+                logging.error(f"Ошибка при откате пакета записи: {rollback_error}")
+            # Ошибку получают все операции пакета, в том числе не начатые
+            # (например, если не удалось выполнить BEGIN IMMEDIATE)
+            for fn, args, kwargs, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        self.jobs_done += len(results)
+
+    def _checkpoint(self, conn):
+        """Run a passive WAL checkpoint while the writer is idle"""
+        if db_pool.JOURNAL_MODE != "wal":
+            return
+        try:
+            busy, log_pages, checkpointed = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+            logging.debug(f"Checkpoint WAL: {checkpointed}/{log_pages} страниц")
+        except Exception as e:
+            logging.warning(f"Ошибка при выполнении checkpoint WAL: {e}")
+
+    def _run(self):
+        """Writer thread main loop"""
+        conn = db_pool.create_connection(self.db_path, isolation_level=None)
+        # Каждая операция выполняется внутри SAVEPOINT, а журнал SAVEPOINT в памяти
+        # (temp_store = MEMORY) многократно замедляет крупные вставки
+        conn.execute("PRAGMA temp_store = FILE")
+        # Checkpoint выполняется, если после последней записи писатель простаивал checkpoint_interval
+        wait = self.checkpoint_interval if self.checkpoint_interval > 0 else None
+        dirty = False
+
+        try:
+            while True:
+                try:
+                    job = self._queue.get(timeout=wait)
+                except queue.Empty:
+                    if dirty:
+                        self._checkpoint(conn)
+                        dirty = False
+                    continue
+
+                if job is None:
+                    break
+
+                batch, stop = self._take_batch(job)
+                self._run_batch(conn, batch)
+                dirty = True
+
+                if stop:
+                    break
+
+            # Дописываем то, что успели поставить в очередь до остановки
+            while True:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not None:
+                    self._run_batch(conn, [job])
+        finally:
+            conn.close()
+
+    def stats(self):
+        """
+        Get writer statistics
+
+        Returns:
+            dict: Queue length, number of commits and executed jobs
+        """
+        return {
+            "queued": self._queue.qsize(),
+            "commits": self.commits,
+            "jobs": self.jobs_done,
+        }
+
+
+# Общий писатель для всего процесса
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Get the process-wide writer, creating it on first use"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = DatabaseWriter()
+    return _writer
+
+
+def submit(fn, *args, **kwargs):
+    """Shortcut for get_writer().submit()"""
+    return get_writer().submit(fn, *args, **kwargs)
+
+
+def execute(fn, *args, **kwargs):
+    """Shortcut for get_writer().execute()"""
+    return get_writer().execute(fn, *args, **kwargs)
+
+
+def stop_writer():
+    """Flush and stop the process-wide writer"""
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.stop()
+            _writer = None
+
+
+atexit.register(stop_writer)
@@ -0,0 +1,378 @@
+import io
+import os
+import re
+import csv
+import json
+import zipfile
+import datetime
+import logging
+from xml.sax.saxutils import escape
+
+import db_pool
+
+# По сколько строк читается курсор при выгрузке
+EXPORT_FETCH_SIZE = int(os.environ.get("EXPORT_FETCH_SIZE", "1000"))
+
+# Разделитель CSV: ";" - Excel с русской локалью открывает такой файл по столбцам
+EXPORT_CSV_DELIMITER = os.environ.get("EXPORT_CSV_DELIMITER", ";")
+
+# Сколько байт накапливается перед отдачей очередной части выгрузки
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", str(64 * 1024)))
+
+# Таблицы для выгрузки: название и запрос (служебные *_iso столбцы не выгружаются)
+EXPORT_TABLES = {
+    "vehicles": ("Автомобили", """
+        SELECT id, model, reg_number, vin, category, qualification, year, mileage,
+               tachograph_required, osago_valid, tech_inspection_date, tech_inspection_valid,
+               skzi_install_date, skzi_valid_date, next_to, last_to_date, next_to_date,
+               fuel_type, fuel_tank_capacity, avg_fuel_consumption, notes
+        FROM vehicles
+        ORDER BY model, id
+    """),
+    "maintenance": ("Техническое обслуживание", """
+        SELECT m.id, m.vehicle_id, v.reg_number, v.model, m.date, m.mileage, m.works
+        FROM maintenance m
+        LEFT JOIN vehicles v ON v.id = m.vehicle_id
+        ORDER BY m.vehicle_id, m.date_iso, m.id
+    """),
+    "repairs": ("Ремонты", """
+        SELECT r.id, r.vehicle_id, v.reg_number, v.model, r.date, r.mileage, r.description, r.cost
+        FROM repairs r
+        LEFT JOIN vehicles v ON v.id = r.vehicle_id
+        ORDER BY r.vehicle_id, r.date_iso, r.id
+    """),
+    "refueling": ("Заправки", """
+        SELECT f.id, f.vehicle_id, v.reg_number, v.model, f.date, f.mileage, f.liters, f.cost_per_liter
+        FROM refueling f
+        LEFT JOIN vehicles v ON v.id = f.vehicle_id
+        ORDER BY f.vehicle_id, f.date_iso, f.id
+    """),
+    "users": ("Пользователи", """
+        SELECT id, username, full_name, is_admin, first_seen, last_activity, interaction_count
+        FROM users
+        ORDER BY id
+    """),
+}
+
+# Символы, которые нельзя записать в XML (управляющие, кроме табуляции и переводов строк)
+_XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+class _Buffer:
+    """Write-only file object whose contents are taken out in parts"""
+
+    def __init__(self):
+        self._parts = []
+        self.size = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._parts.append(data)
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        self.size = 0
+        return data
+
+
+def stream_rows(table, fetch_size=EXPORT_FETCH_SIZE):
+    """
+    Stream the rows of an export table from the database
+
+    The first item is the tuple of column names, then every row as a tuple.
+    Rows are read with fetchmany, so memory does not depend on the size of
+    the table. The pooled connection is held until the generator finishes.
+
+    Args:
+        table (str): Key of EXPORT_TABLES
+        fetch_size (int): Rows per fetchmany
+
+    Yields:
+        tuple: Column names, then row values
+    """
+    _, query = EXPORT_TABLES[table]
+    with db_pool.connection() as conn:
+        cursor = conn.execute(query)
+        yield tuple(column[0] for column in cursor.description)
+        while True:
+            batch = cursor.fetchmany(fetch_size)
+            if not batch:
+                return
+            for row in batch:
+                yield tuple(row)
+
+
+def csv_chunks(rows):
+    """
+    Write rows as CSV (UTF-8 with BOM, for Excel)
+
+    Args:
+        rows (Iterator[tuple]): Column names, then rows (stream_rows)
+
+    Yields:
+        bytes: Parts of the file of about EXPORT_CHUNK_SIZE
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=EXPORT_CSV_DELIMITER)
+    buffer.write("\ufeff")
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def ndjson_chunks(rows):
+    """
+    Write rows as JSON Lines: one object per row
+
+    Args:
+        rows (Iterator[tuple]): Column names, then rows (stream_rows)
+
+    Yields:
+        bytes: Parts of the file of about EXPORT_CHUNK_SIZE
+    """
+    columns = next(rows)
+    parts, size = [], 0
+    for row in rows:
+        line = json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str) + "\n"
+        parts.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield "".join(parts).encode("utf-8")
+            parts, size = [], 0
+    yield "".join(parts).encode("utf-8")
+
+
+def _column_letters(count):
+    letters = []
+    for index in range(count):
+        name = ""
+        index += 1
+        while index:
+            index, remainder = divmod(index - 1, 26)
+            name = chr(ord("A") + remainder) + name
+        letters.append(name)
+    return letters
+
+
+def _xlsx_cell(ref, value, style=""):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, (int, float)):
+        return f'<c r="{ref}"{style}><v>{value}</v></c>'
+    text = _XML_ILLEGAL.sub("", str(value))
+    return f'<c r="{ref}" t="inlineStr"{style}><is><t xml:space="preserve">{escape(text)}</t></is></c>'
+
+
+_XLSX_STATIC = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    # Два стиля ячеек: обычный и полужирный для заголовка
+    "xl/styles.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+        '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+}
+
+
+def xlsx_chunks(rows, sheet_name="Лист1"):
+    """
+    Write rows as an XLSX workbook with one sheet, without holding it in memory
+
+    The sheet XML is generated row by row (inline strings, no shared
+    string table) and compressed into a zip stream that is handed out in
+    parts, so no spreadsheet library is needed and memory stays constant.
+
+    Args:
+        rows (Iterator[tuple]): Column names, then rows (stream_rows)
+        sheet_name (str): Name of the sheet (up to 31 characters)
+
+    Yields:
+        bytes: Parts of the file
+    """
+    buffer = _Buffer()
+    sheet_name = escape(re.sub(r"[\][:*?/\\]", "", sheet_name)[:31])
+    workbook = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{sheet_name}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_STATIC.items():
+            archive.writestr(name, content)
+        archive.writestr("xl/workbook.xml", workbook)
+
+        columns = next(rows)
+        letters = _column_letters(len(columns))
+        with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            header = "".join(_xlsx_cell(f"{letter}1", name, ' s="1"') for letter, name in zip(letters, columns))
+            sheet.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" '
+                'activePane="bottomLeft" state="frozen"/></sheetView></sheetViews>'
+                f'<sheetData><row r="1">{header}</row>'
+            ).encode("utf-8"))
+
+            parts, size = [], 0
+            for number, row in enumerate(rows, start=2):
+                cells = "".join(_xlsx_cell(f"{letter}{number}", value) for letter, value in zip(letters, row))
+                line = f'<row r="{number}">{cells}</row>'
+                parts.append(line)
+                size += len(line)
+                if size >= EXPORT_CHUNK_SIZE:
+                    sheet.write("".join(parts).encode("utf-8"))
+                    parts, size = [], 0
+                    if buffer.size:
+                        yield buffer.take()
+            parts.append("</sheetData></worksheet>")
+            sheet.write("".join(parts).encode("utf-8"))
+    yield buffer.take()
+
+
+# Форматы выгрузки: функция записи, тип содержимого и расширение файла
+EXPORT_FORMATS = {
+    "csv": (csv_chunks, "text/csv; charset=utf-8", "csv"),
+    "xlsx": (xlsx_chunks, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+    "ndjson": (ndjson_chunks, "application/x-ndjson; charset=utf-8", "ndjson"),
+}
+
+
+def export_chunks(table, fmt):
+    """
+    Stream a table export in the given format
+
+    Args:
+        table (str): Key of EXPORT_TABLES
+        fmt (str): Key of EXPORT_FORMATS
+
+    Yields:
+        bytes: Parts of the file
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Неизвестная таблица: {table}")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат: {fmt}")
+
+    writer = EXPORT_FORMATS[fmt][0]
+    rows = stream_rows(table)
+    if fmt == "xlsx":
+        return writer(rows, EXPORT_TABLES[table][0])
+    return writer(rows)
+
+
+def export_filename(table, fmt):
+    """File name of an export, e.g. vehicles_20250312.xlsx"""
+    return f"{table}_{datetime.datetime.now().strftime('%Y%m%d')}.{EXPORT_FORMATS[fmt][2]}"
+
+
+def export_to_file(table, fmt, directory=None):
+    """
+    Write a table export to a temporary file
+
+    Args:
+        table (str): Key of EXPORT_TABLES
+        fmt (str): Key of EXPORT_FORMATS
+        directory (str): Folder for the file (default: system temp folder)
+
+    Returns:
+        tuple: (path, size in bytes); the caller deletes the file
+    """
+    import tempfile
+
+    handle, path = tempfile.mkstemp(prefix=f"{table}_", suffix=f".{EXPORT_FORMATS[fmt][2]}", dir=directory)
+    size = 0
+    try:
+        with os.fdopen(handle, "wb") as f:
+            for chunk in export_chunks(table, fmt):
+                f.write(chunk)
+                size += len(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    logging.info(f"Выгрузка {table} в {fmt}: {size} байт")
+    return path, size
+
+
+if __name__ == "__main__":
+    # Время и пиковая память выгрузки во всех форматах:
+    # python export.py [таблица ...]
+    import sys
+    import time
+    import tracemalloc
+    from db_migrations import apply_migrations
+
+    logging.basicConfig(level=logging.WARNING)
+    apply_migrations()
+    tables = sys.argv[1:] or list(EXPORT_TABLES)
+
+    print(f"{'table':<12} {'format':<7} {'rows':>8} {'size, KB':>9} {'time, ms':>9} {'peak, MB':>9}")
+    for table in tables:
+        with db_pool.connection() as conn:
+            count = conn.execute(f"SELECT COUNT(*) FROM ({EXPORT_TABLES[table][1]})").fetchone()[0]
+        for fmt in EXPORT_FORMATS:
+            started = time.perf_counter()
+            size = sum(len(chunk) for chunk in export_chunks(table, fmt))
+            elapsed = (time.perf_counter() - started) * 1000
+
+            tracemalloc.start()
+            for chunk in export_chunks(table, fmt):
+                pass
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{table:<12} {fmt:<7} {count:>8} {size / 1024:>9.0f} {elapsed:>9.1f} {peak / 2**20:>9.2f}")
@@ -0,0 +1,178 @@
+import time
+import json
+import asyncio
+import logging
+import itertools
+from collections import Counter
+
+from aiohttp import web, ClientSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from webhook import SECRET_HEADER, WEBHOOK_PATH, create_app
+
+
+class FakeTelegram:
+    """
+    Local stand-in for the Bot API, for testing the webhook mode
+
+    Answers every /bot<token>/<method> request with a plausible result and
+    records the calls. Point a bot at it with
+
+        bot.session.api = fake.api_server()
+    """
+
+    def __init__(self):
+        self.calls = []  # (method, params)
+        self._message_ids = itertools.count(1)
+        self._runner = None
+        self.url = None
+
+    async def _handle(self, request):
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls.append((method, params))
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        elif (method.startswith("send") or method.startswith("edit")) and method != "sendChatAction":
+            chat_id = int(params.get("chat_id", 0))
+            result = {
+                "message_id": int(params.get("message_id") or next(self._message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+                "text": params.get("text") or params.get("caption") or "",
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://{host}:{port}"
+        return self
+
+    def api_server(self):
+        return TelegramAPIServer.from_base(self.url)
+
+    def count(self, method=None):
+        if method is None:
+            return len(self.calls)
+        return sum(1 for name, _ in self.calls if name == method)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+def make_update(update_id, user_id, text):
+    """
+    Build a message update as Telegram sends it to the webhook
+
+    Returns:
+        dict: Update JSON
+    """
+    user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private", "first_name": user["first_name"]},
+        "from": user,
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+async def run_harness(updates=50, secret="harness-secret"):
+    """
+    Drive telegram_bot through the webhook against FakeTelegram
+
+    Sends `updates` /start commands from different users plus one request
+    with a wrong secret, and waits until every command has been handled.
+    The bot registers every sender, so point VEHICLES_DB_PATH at a copy of
+    the database before calling it (see __main__).
+
+    Returns:
+        dict: Timings and the number of calls per Bot API method
+    """
+    import telegram_bot
+
+    fake = await FakeTelegram().start()
+    telegram_bot.bot.session.api = fake.api_server()
+
+    app = create_app(telegram_bot.dp, telegram_bot.bot, secret=secret)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{runner.addresses[0][1]}{WEBHOOK_PATH}"
+
+    async with ClientSession() as session:
+        async with session.post(url, json=make_update(1, 1, "/start"), headers={SECRET_HEADER: "wrong"}) as response:
+            rejected_status = response.status
+
+        async def post(index):
+            body = json.dumps(make_update(100 + index, 10_000 + index, "/start"))
+            started = time.monotonic()
+            async with session.post(url, data=body, headers={SECRET_HEADER: secret,
+                                                             "Content-Type": "application/json"}) as response:
+                return response.status, time.monotonic() - started
+
+        started = time.monotonic()
+        results = await asyncio.gather(*(post(index) for index in range(updates)))
+        accepted = time.monotonic() - started
+
+        # Ждем, пока бот обработает все команды и отправит ответы
+        await app["webhook_handler"].drain()
+        answered = time.monotonic() - started
+
+    await runner.cleanup()
+    await fake.stop()
+
+    ack_times = sorted(elapsed for _, elapsed in results)
+    return {
+        "rejected_status": rejected_status,
+        "statuses": dict(Counter(status for status, _ in results)),
+        "accepted_s": round(accepted, 3),
+        "answered_s": round(answered, 3),
+        "ack_p50_ms": round(ack_times[len(ack_times) // 2] * 1000, 1),
+        "calls": dict(Counter(name for name, _ in fake.calls)),
+    }
+
+
+if __name__ == "__main__":
+    # Проверка режима webhook без Telegram: python fake_telegram.py [обновлений]
+    import os
+    import sys
+    import shutil
+    import sqlite3
+    import tempfile
+
+    # Бот регистрирует каждого отправителя, поэтому проверка идет на временной
+    # копии базы - в рабочей не появляются тестовые пользователи
+    workdir = tempfile.mkdtemp(prefix="fake_telegram_")
+    source = sqlite3.connect(os.environ.get("VEHICLES_DB_PATH", "vehicles.db"))
+    copy = sqlite3.connect(os.path.join(workdir, "vehicles.db"))
+    source.backup(copy)
+    source.close()
+    copy.close()
+    os.environ["VEHICLES_DB_PATH"] = os.path.join(workdir, "vehicles.db")
+
+    import db_writer
+    from db_migrations import apply_migrations
+
+    logging.basicConfig(level=logging.WARNING)
+    try:
+        apply_migrations()
+        count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+        print(json.dumps(asyncio.run(run_harness(count)), ensure_ascii=False, indent=2))
+    finally:
+        db_writer.stop_writer()
+        shutil.rmtree(workdir, ignore_errors=True)
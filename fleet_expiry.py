@@ -0,0 +1,332 @@
+import os
+import datetime
+import functools
+from array import array
+
+import db_dates
+
+try:
+    import numpy as np
+except ImportError:
+    # NumPy необязателен: без него массивы считаются модулем array
+    np = None
+
+# Считать ли через NumPy, если он установлен (0 - всегда через array)
+FLEET_EXPIRY_NUMPY = os.environ.get("FLEET_EXPIRY_NUMPY", "1") == "1"
+
+# Сколько дней до окончания документа считается "критически" и "скоро"
+DOCUMENT_CRITICAL_DAYS = 7
+DOCUMENT_SOON_DAYS = 30
+
+# Сколько километров до ТО считается "критически" и "скоро"
+TO_CRITICAL_KM = 500
+TO_SOON_KM = 1000
+
+# Статусы сроков
+EXPIRED, CRITICAL, SOON, OK, UNKNOWN, NOT_REQUIRED = range(6)
+
+# Столбцы документов со сроком действия (db_dates.EXPIRING_DOCUMENTS)
+DOCUMENTS = tuple(column for column, name in db_dates.EXPIRING_DOCUMENTS)
+
+# Значение "нет данных" в массивах дней и километров
+MISSING = -2**31
+
+
+@functools.lru_cache(maxsize=8192)
+def date_ordinal(iso):
+    """
+    Day number of an ISO date (datetime.date.toordinal)
+
+    Fleets share a few hundred distinct dates, so every date string is
+    parsed once per process.
+
+    Args:
+        iso (str): Date in the format YYYY-MM-DD (a *_iso column), or None
+
+    Returns:
+        int: Day number, or MISSING if the date is not set or invalid
+    """
+    if not iso:
+        return MISSING
+    try:
+        return datetime.date.fromisoformat(iso).toordinal()
+    except ValueError:
+        return MISSING
+
+
+def _bucket(value, expired_below, critical, soon):
+    if value is None or value == MISSING:
+        return UNKNOWN
+    if value < expired_below:
+        return EXPIRED
+    if value <= critical:
+        return CRITICAL
+    if value <= soon:
+        return SOON
+    return OK
+
+
+def document_status(days):
+    """
+    Status of a document by the days left until it expires
+
+    Args:
+        days (int): Days left (negative if expired), None if not set
+
+    Returns:
+        int: EXPIRED, CRITICAL, SOON, OK or UNKNOWN
+    """
+    return _bucket(days, 0, DOCUMENT_CRITICAL_DAYS, DOCUMENT_SOON_DAYS)
+
+
+def to_status(remaining_km):
+    """
+    Status of the next maintenance by the kilometres left
+
+    Args:
+        remaining_km (int): Kilometres left (0 or less if overdue), None if not planned
+
+    Returns:
+        int: EXPIRED, CRITICAL, SOON, OK or UNKNOWN
+    """
+    # ТО просрочено уже при нуле оставшихся километров
+    return _bucket(remaining_km, 1, TO_CRITICAL_KM, TO_SOON_KM)
+
+
+class ExpiryTable:
+    """
+    Days left and statuses of a batch of vehicles, stored by column
+
+    days[column] and status[column] hold one value per vehicle for every
+    column in DOCUMENTS; to_remaining and to_status do the same for the
+    next maintenance. The arrays are NumPy arrays when NumPy is used and
+    array.array otherwise; MISSING marks values that are not set.
+    """
+
+    def __init__(self, size, days, status, to_remaining, to_status):
+        self.size = size
+        self.days = days
+        self.status = status
+        self.to_remaining = to_remaining
+        self.to_status = to_status
+
+    def __len__(self):
+        return self.size
+
+    def vehicle(self, index):
+        """
+        Values of one vehicle
+
+        Returns:
+            dict: <column>_days (None if not set), <column>_status,
+            to_remaining (None if not planned) and to_status
+        """
+        result = {}
+        for column in DOCUMENTS:
+            days = int(self.days[column][index])
+            result[f"{column}_days"] = None if days == MISSING else days
+            result[f"{column}_status"] = int(self.status[column][index])
+        remaining = int(self.to_remaining[index])
+        result["to_remaining"] = None if remaining == MISSING else remaining
+        result["to_status"] = int(self.to_status[index])
+        return result
+
+    def columns(self):
+        """
+        All values as Python lists, keyed like vehicle()
+
+        Returns:
+            dict: <column>_days, <column>_status, to_remaining, to_status
+        """
+        def values(data):
+            data = data.tolist()
+            return [None if value == MISSING else value for value in data]
+
+        result = {}
+        for column in DOCUMENTS:
+            result[f"{column}_days"] = values(self.days[column])
+            result[f"{column}_status"] = self.status[column].tolist()
+        result["to_remaining"] = values(self.to_remaining)
+        result["to_status"] = self.to_status.tolist()
+        return result
+
+    def counts(self):
+        """
+        Number of vehicles in every status
+
+        Returns:
+            dict: column (and "to") -> list of counts indexed by status
+        """
+        result = {}
+        for column, statuses in list(self.status.items()) + [("to", self.to_status)]:
+            if np is not None and isinstance(statuses, np.ndarray):
+                result[column] = np.bincount(statuses, minlength=NOT_REQUIRED + 1).tolist()
+            else:
+                counts = [0] * (NOT_REQUIRED + 1)
+                for value in statuses:
+                    counts[value] += 1
+                result[column] = counts
+        return result
+
+
+def _compute_numpy(vehicles, today):
+    size = len(vehicles)
+    today = today.toordinal()
+    tachograph = np.fromiter((bool(v['tachograph_required']) for v in vehicles), dtype=bool, count=size)
+
+    def buckets(values, missing, expired_below, critical, soon):
+        return np.select(
+            [missing, values < expired_below, values <= critical, values <= soon],
+            [UNKNOWN, EXPIRED, CRITICAL, SOON],
+            OK,
+        ).astype(np.int8)
+
+    days, status = {}, {}
+    for column in DOCUMENTS:
+        ordinals = np.fromiter((date_ordinal(v[f"{column}_iso"]) for v in vehicles), dtype=np.int64, count=size)
+        missing = ordinals == MISSING
+        values = np.where(missing, MISSING, ordinals - today)
+        statuses = buckets(values, missing, 0, DOCUMENT_CRITICAL_DAYS, DOCUMENT_SOON_DAYS)
+        if column == "skzi_valid_date":
+            # СКЗИ нужен только машинам с тахографом
+            statuses[~tachograph] = NOT_REQUIRED
+        days[column], status[column] = values, statuses
+
+    next_to = np.fromiter((v['next_to'] or 0 for v in vehicles), dtype=np.int64, count=size)
+    mileage = np.fromiter((v['mileage'] or 0 for v in vehicles), dtype=np.int64, count=size)
+    missing = next_to == 0
+    remaining = np.where(missing, MISSING, next_to - mileage)
+    statuses = buckets(remaining, missing, 1, TO_CRITICAL_KM, TO_SOON_KM)
+    return ExpiryTable(size, days, status, remaining, statuses)
+
+
+def _compute_array(vehicles, today):
+    size = len(vehicles)
+    today = today.toordinal()
+    tachograph = [bool(v['tachograph_required']) for v in vehicles]
+
+    days, status = {}, {}
+    for column in DOCUMENTS:
+        ordinals = [date_ordinal(v[f"{column}_iso"]) for v in vehicles]
+        values = array('l', [MISSING if o == MISSING else o - today for o in ordinals])
+        statuses = array('b', map(document_status, values))
+        if column == "skzi_valid_date":
+            for index, required in enumerate(tachograph):
+                if not required:
+                    statuses[index] = NOT_REQUIRED
+        days[column], status[column] = values, statuses
+
+    remaining = array('l', [v['next_to'] - (v['mileage'] or 0) if v['next_to'] else MISSING for v in vehicles])
+    return ExpiryTable(size, days, status, remaining, array('b', map(to_status, remaining)))
+
+
+def compute(vehicles, today=None):
+    """
+    Compute days left and statuses for a batch of vehicles in one pass
+
+    Every date column is parsed into day numbers once, then the days and
+    statuses of the whole batch are computed column by column (NumPy if
+    available). Reports, cards and alerts use the same thresholds.
+
+    Args:
+        vehicles (Sequence): Rows with <column>_iso for DOCUMENTS,
+            tachograph_required, next_to and mileage
+        today (datetime.date): Date to count from (default: today)
+
+    Returns:
+        ExpiryTable: Values in the order of vehicles
+    """
+    today = today or datetime.date.today()
+    if not isinstance(vehicles, (list, tuple)):
+        vehicles = list(vehicles)
+    if np is not None and FLEET_EXPIRY_NUMPY:
+        return _compute_numpy(vehicles, today)
+    return _compute_array(vehicles, today)
+
+
+def annotate(batches, today=None):
+    """
+    Add days left and statuses to vehicle rows, batch by batch
+
+    Args:
+        batches (Iterable[Sequence]): Batches of vehicle rows (cursor.fetchmany)
+        today (datetime.date): Date to count from (default: today)
+
+    Yields:
+        dict: Vehicle row with the values of ExpiryTable.vehicle
+    """
+    today = today or datetime.date.today()
+    for batch in batches:
+        columns = compute(batch, today).columns()
+        for index, vehicle in enumerate(batch):
+            row = dict(vehicle)
+            for key, values in columns.items():
+                row[key] = values[index]
+            yield row
+
+
+if __name__ == "__main__":
+    # Скорость расчета по всему парку: построчно (strptime на каждое поле,
+    # как days_until), через array и через NumPy: python fleet_expiry.py [машин]
+    import sys
+    import time
+    import random
+
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    rng = random.Random(size)
+    start = datetime.date.today() - datetime.timedelta(days=60)
+
+    def random_date():
+        if rng.random() < 0.05:
+            return None
+        return (start + datetime.timedelta(days=rng.randint(0, 900))).isoformat()
+
+    vehicles = [{
+        **{f"{column}_iso": random_date() for column in DOCUMENTS},
+        "tachograph_required": rng.random() < 0.6,
+        "next_to": rng.choice([0, rng.randint(10000, 300000)]),
+        "mileage": rng.randint(5000, 290000),
+    } for _ in range(size)]
+    for vehicle in vehicles:
+        for column in DOCUMENTS:
+            iso = vehicle[f"{column}_iso"]
+            vehicle[column] = datetime.date.fromisoformat(iso).strftime("%d.%m.%Y") if iso else None
+
+    def per_field(vehicles):
+        # Как раньше: разбор текстовой даты и datetime.now() на каждое поле
+        result = []
+        for vehicle in vehicles:
+            row = []
+            for column in DOCUMENTS:
+                if vehicle[column]:
+                    days = (datetime.datetime.strptime(vehicle[column], "%d.%m.%Y") - datetime.datetime.now()).days
+                else:
+                    days = None
+                row.append(document_status(days))
+            result.append(row)
+        return result
+
+    def measure(fn):
+        best = None
+        for _ in range(3):
+            date_ordinal.cache_clear()
+            started = time.perf_counter()
+            fn(vehicles)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best * 1000
+
+    results = [("strptime на каждое поле", measure(per_field))]
+    FLEET_EXPIRY_NUMPY = False
+    results.append(("array", measure(compute)))
+    if np is not None:
+        FLEET_EXPIRY_NUMPY = True
+        results.append(("NumPy", measure(compute)))
+        FLEET_EXPIRY_NUMPY = False
+        array_counts = compute(vehicles).counts()
+        FLEET_EXPIRY_NUMPY = True
+        print(f"Одинаковый результат array и NumPy: {array_counts == compute(vehicles).counts()}")
+
+    print(f"{size} машин")
+    for title, elapsed in results:
+        print(f"{title:<26} {elapsed:>9.1f} мс")
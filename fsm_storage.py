@@ -0,0 +1,277 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+import functools
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+
+import db_pool
+import db_writer
+
+# Как часто накопленные изменения записываются в базу (секунды)
+FSM_FLUSH_INTERVAL = float(os.environ.get("FSM_FLUSH_INTERVAL", "0.5"))
+
+# Диалог, не менявшийся дольше этого времени, считается брошенным (секунды)
+FSM_TTL = float(os.environ.get("FSM_TTL", str(24 * 60 * 60)))
+
+# Несколько процессов обслуживают одного бота (webhook): состояние читается
+# из базы при каждом обращении и записывается сразу
+FSM_SHARED = os.environ.get("FSM_SHARED", "0") == "1"
+
+
+@functools.lru_cache(maxsize=4096)
+def _key_to_str(key: StorageKey) -> str:
+    return ":".join(str(part) if part is not None else "" for part in (
+        key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+    ))
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM storage kept in memory and persisted to the fsm_storage table
+
+    All reads are served from a dict, so get/set cost about the same as
+    MemoryStorage. Changes are coalesced: a key changed several times within
+    FSM_FLUSH_INTERVAL is written once, and all changed keys go to the
+    database in one writer transaction. Saved dialogs are loaded once by
+    load() (or on first use, after the bot has applied migrations), so a
+    restarted bot continues them. Dialogs untouched for FSM_TTL seconds are
+    dropped from memory and from the table.
+
+    With shared=True (several bot processes behind one webhook) every read
+    goes to the table and every change is written before the call returns,
+    so the next update of the dialog may be handled by another process.
+    Database reads and writes run in a thread, never on the event loop.
+
+    Call close() on shutdown to write the last changes:
+
+        dp.shutdown.register(storage.close)
+    """
+
+    def __init__(self, flush_interval=FSM_FLUSH_INTERVAL, ttl=FSM_TTL, shared=FSM_SHARED):
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.shared = shared
+        self.flushes = 0
+
+        self._records = {}  # key -> [state, data, updated_at]
+        self._dirty = set()
+        self._deleted = set()  # завершенные диалоги, еще не удаленные из таблицы
+        self._lock = threading.Lock()
+        self._flush_handle = None
+        self._loading = None
+
+    def _load(self):
+        """Load the dialogs that have not expired (blocking)"""
+        cutoff = time.time() - self.ttl
+        try:
+            with db_pool.connection() as conn:
+                rows = conn.execute(
+                    "SELECT key, state, data, updated_at FROM fsm_storage WHERE updated_at >= ?", (cutoff,)
+                ).fetchall()
+        except Exception as e:
+            logging.error(f"Не удалось загрузить состояния диалогов: {e}")
+            return
+        with self._lock:
+            for key, state, data, updated_at in rows:
+                self._records.setdefault(key, [state, json.loads(data), updated_at])
+        logging.info(f"Загружено состояний диалогов: {len(rows)}")
+
+    def _reload(self, name):
+        """Read one dialog from the table (shared mode, blocking)"""
+        with db_pool.connection() as conn:
+            row = conn.execute("SELECT state, data, updated_at FROM fsm_storage WHERE key = ?", (name,)).fetchone()
+        with self._lock:
+            if name in self._dirty or name in self._deleted:
+                return  # есть незаписанное изменение этого процесса
+            if row is None:
+                self._records.pop(name, None)
+            else:
+                self._records[name] = [row[0], json.loads(row[1]), row[2]]
+
+    async def load(self):
+        """Load the saved dialogs once (call after migrations, e.g. at startup)"""
+        if self._loading is None:
+            self._loading = asyncio.get_running_loop().run_in_executor(None, self._load)
+        await asyncio.shield(self._loading)
+
+    async def _prepare(self, key: StorageKey):
+        if self._loading is None or not self._loading.done():
+            await self.load()
+        if self.shared:
+            await asyncio.get_running_loop().run_in_executor(None, self._reload, _key_to_str(key))
+
+    def _get(self, key: StorageKey):
+        record = self._records.get(_key_to_str(key))
+        if record is None:
+            return None
+        if record[2] < time.time() - self.ttl:
+            return None
+        return record
+
+    def _set(self, key: StorageKey, state=..., data=...):
+        name = _key_to_str(key)
+        with self._lock:
+            record = self._records.get(name)
+            if record is None or record[2] < time.time() - self.ttl:
+                record = self._records[name] = [None, {}, 0.0]
+            if state is not ...:
+                record[0] = state
+            if data is not ...:
+                record[1] = data
+            record[2] = time.time()
+            self._dirty.add(name)
+        if not self.shared:
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне цикла событий (скрипты) записываем сразу
+            self.flush()
+            return
+        self._flush_handle = loop.call_later(self.flush_interval, self._start_flush, loop)
+
+    def _start_flush(self, loop):
+        self._flush_handle = None
+        loop.run_in_executor(None, self.flush)
+
+    async def _write_through(self):
+        if self.shared:
+            await asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._prepare(key)
+        self._set(key, state=state.state if isinstance(state, State) else state)
+        await self._write_through()
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        await self._prepare(key)
+        record = self._get(key)
+        return record[0] if record else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._prepare(key)
+        self._set(key, data=data.copy())
+        await self._write_through()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        await self._prepare(key)
+        record = self._get(key)
+        return record[1].copy() if record else {}
+
+    def flush(self):
+        """
+        Write changed dialogs to the database (blocking)
+
+        Returns:
+            int: Number of written keys
+        """
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            upserts = []
+            for name in self._dirty:
+                record = self._records.get(name)
+                if record is None:
+                    continue
+                state, data, updated_at = record
+                if state is None and not data:
+                    # Пустая запись - диалог завершен; ключ остается в _deleted,
+                    # пока удаление не будет записано
+                    self._deleted.add(name)
+                    del self._records[name]
+                    continue
+                try:
+                    upserts.append((name, state, json.dumps(data, ensure_ascii=False), updated_at))
+                except (TypeError, ValueError) as e:
+                    # Остальные диалоги записываются, этот остается только в памяти
+                    logging.error(f"Не удалось сохранить состояние диалога {name}: {e}")
+                    continue
+                self._deleted.discard(name)
+            self._dirty = set()
+            deletes = [(name,) for name in self._deleted]
+            expired = [name for name, record in self._records.items() if record[2] < cutoff]
+            for name in expired:
+                del self._records[name]
+
+        def write(conn):
+            if upserts:
+                conn.executemany("""
+                INSERT INTO fsm_storage (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+                """, upserts)
+            if deletes:
+                conn.executemany("DELETE FROM fsm_storage WHERE key = ?", deletes)
+            conn.execute("DELETE FROM fsm_storage WHERE updated_at < ?", (cutoff,))
+
+        if not upserts and not deletes and not expired:
+            return 0
+        try:
+            db_writer.execute(write)
+            self.flushes += 1
+        except Exception as e:
+            logging.error(f"Ошибка при сохранении состояний диалогов: {e}")
+            # Повторим при следующей записи (удаления остаются в _deleted)
+            with self._lock:
+                self._dirty |= {row[0] for row in upserts}
+            return 0
+        with self._lock:
+            self._deleted.difference_update(row[0] for row in deletes)
+        return len(upserts) + len(deletes)
+
+    async def close(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        await asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+
+if __name__ == "__main__":
+    # Сравнение с MemoryStorage и проверка восстановления: python fsm_storage.py [операций]
+    import sys
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from db_migrations import apply_migrations
+
+    logging.basicConfig(level=logging.INFO)
+    operations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    apply_migrations()
+
+    async def measure(storage):
+        keys = [StorageKey(bot_id=1, chat_id=i, user_id=i) for i in range(1000)]
+        started = time.perf_counter()
+        for i in range(operations):
+            key = keys[i % len(keys)]
+            await storage.set_state(key, "RepairState:cost")
+            await storage.update_data(key, {"vehicle_id": i, "date": "01.02.2025"})
+            await storage.get_state(key)
+            await storage.get_data(key)
+        return (time.perf_counter() - started) / (operations * 5) * 1e6
+
+    async def main():
+        memory_us = await measure(MemoryStorage())
+        storage = SQLiteStorage()
+        sqlite_us = await measure(storage)
+        await storage.close()
+        print(f"MemoryStorage {memory_us:.2f} us/op, SQLiteStorage {sqlite_us:.2f} us/op, "
+              f"{storage.flushes} flush(es)")
+
+        # "Перезапуск": новый экземпляр видит незавершенный диалог
+        restored = SQLiteStorage()
+        key = StorageKey(bot_id=1, chat_id=7, user_id=7)
+        print(f"После перезапуска: {await restored.get_state(key)} {await restored.get_data(key)}")
+
+        # Завершаем тестовые диалоги
+        for i in range(1000):
+            await restored.set_state(StorageKey(bot_id=1, chat_id=i, user_id=i), None)
+            await restored.set_data(StorageKey(bot_id=1, chat_id=i, user_id=i), {})
+        await restored.close()
+
+    asyncio.run(main())
@@ -1,5 +1,6 @@
-import sqlite3
 import logging
+import db_pool
+from db_migrations import apply_migrations
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -9,18 +10,14 @@ def init_sample_data():
     Initialize the database with sample vehicle data from the provided script
     """
     try:
+        # Create or upgrade the schema
+        apply_migrations()
+        
         # Connect to database
         logging.info("Connecting to database...")
-        conn = sqlite3.connect('vehicles.db')
+        conn = db_pool.create_connection()
         cursor = conn.cursor()
         
-        # Check if vehicles table exists
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='vehicles'")
-        if not cursor.fetchone():
-            logging.error("Vehicles table does not exist. Run db_init.py first.")
-            conn.close()
-            return False
-        
         # Check if we already have data and clear it if requested
         cursor.execute("SELECT COUNT(*) FROM vehicles")
         count = cursor.fetchone()[0]
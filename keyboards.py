@@ -54,4 +54,44 @@ def get_confirm_mileage_keyboard(mileage):
         [InlineKeyboardButton(text=f"✅ Подтвердить: {mileage} км", callback_data=f"confirm_mileage_{mileage}")],
         [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")],
     ])
-    return keyboard
\ No newline at end of file
+    return keyboard
+
+
+# Сколько автомобилей показывать на одной странице списка
+# (Telegram допускает до 100 кнопок в одной клавиатуре)
+ROSTER_PAGE_SIZE = 20
+
+
+def get_vehicle_list_keyboard(vehicles, page=0, page_count=1, extra_rows=(), page_callback="roster"):
+    """
+    Create vehicle selection keyboard for one page of the fleet roster
+    
+    Args:
+        vehicles (Iterable[dict]): Vehicles on the page (id, model, reg_number)
+        page (int): Current page number, from 0
+        page_count (int): Total number of pages
+        extra_rows (Iterable[list]): Button rows added below the list
+        page_callback (str): Callback prefix for page buttons ("<prefix>_<page>")
+        
+    Returns:
+        InlineKeyboardMarkup: Vehicle list keyboard
+    """
+    keyboard = [
+        [InlineKeyboardButton(
+            text=f"🚛 {vehicle['model']} ({vehicle['reg_number']})",
+            callback_data=f"vehicle_{vehicle['id']}"
+        )]
+        for vehicle in vehicles
+    ]
+    
+    if page_count > 1:
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton(text="⬅", callback_data=f"{page_callback}_{page - 1}"))
+        navigation.append(InlineKeyboardButton(text=f"{page + 1}/{page_count}", callback_data=f"{page_callback}_{page}"))
+        if page < page_count - 1:
+            navigation.append(InlineKeyboardButton(text="➡", callback_data=f"{page_callback}_{page + 1}"))
+        keyboard.append(navigation)
+    
+    keyboard.extend(list(row) for row in extra_rows)
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
@@ -1,14 +1,18 @@
 import logging
 import asyncio
 from aiogram import Bot, Dispatcher, types
+from aiogram.exceptions import TelegramAPIError
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 from config import TOKEN
 from db_init import init_database
-import db_operations as db
+from db_async import repo
+from fsm_storage import SQLiteStorage
+from send_queue import send_queue
+from update_scheduler import update_scheduler
+from keyboards import ROSTER_PAGE_SIZE, get_vehicle_list_keyboard
 from services_db import validate_date, validate_mileage, validate_float
 from states_db import MaintenanceState, RepairState, RefuelingState, VehicleState
 
@@ -27,29 +31,26 @@ def Text(text):
     return TextFilter(text)
 
 # Initialize bot and dispatcher
-bot = Bot(token=TOKEN)
-storage = MemoryStorage()
+bot = send_queue.attach(Bot(token=TOKEN))
+storage = SQLiteStorage()
 dp = Dispatcher(storage=storage)
+dp.shutdown.register(storage.close)
+# Обновления разных чатов обрабатываются параллельно, одного чата - по очереди
+dp.update.outer_middleware(update_scheduler)
 
 # Helper functions for UI
-def get_main_menu_keyboard():
+async def get_main_menu_keyboard(page=0):
     """
-    Create the main menu keyboard with vehicle selection
+    Create the main menu keyboard with vehicle selection (one page of the roster)
     """
-    vehicles = db.get_all_vehicles()
+    roster = await repo.get_fleet_roster()
+    page_count = roster.page_count(ROSTER_PAGE_SIZE)
+    page = min(max(0, page), page_count - 1)
 
-    keyboard = []
-    for vehicle in vehicles:
-        keyboard.append([
-            InlineKeyboardButton(
-                text=f"🚛 {vehicle['model']} ({vehicle['reg_number']})", 
-                callback_data=f"vehicle_{vehicle['id']}"
-            )
-        ])
-
-    keyboard.append([InlineKeyboardButton(text="➕ Добавить автомобиль", callback_data="add_vehicle")])
-
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+    return roster.memo(("main_db", page), lambda: get_vehicle_list_keyboard(
+        roster.page(page, ROSTER_PAGE_SIZE), page, page_count,
+        extra_rows=[[InlineKeyboardButton(text="➕ Добавить автомобиль", callback_data="add_vehicle")]]
+    ))
 
 def get_vehicle_keyboard(vehicle_id):
     """
@@ -96,11 +97,11 @@ def get_confirm_mileage_keyboard(vehicle_id, mileage):
         [InlineKeyboardButton(text="❌ Отмена", callback_data=f"vehicle_{vehicle_id}")],
     ])
 
-def format_vehicle_card(vehicle_id):
+async def format_vehicle_card(vehicle_id):
     """
     Format vehicle information into a text card
     """
-    vehicle = db.get_vehicle(vehicle_id)
+    vehicle = await repo.get_vehicle(vehicle_id)
     if not vehicle:
         return "❌ Автомобиль не найден"
 
@@ -108,7 +109,7 @@ def format_vehicle_card(vehicle_id):
     tachograph_status = "✔ Требуется" if vehicle['tachograph_required'] else "❌ Не требуется"
 
     # Add maintenance alert if needed
-    alert = db.get_maintenance_alert(vehicle_id)
+    alert = await repo.get_maintenance_alert(vehicle_id)
 
     card = (
         f"{alert}🚛 **{vehicle['model']} ({vehicle['reg_number']})**\n"
@@ -141,12 +142,13 @@ def format_vehicle_card(vehicle_id):
 
     return card
 
-def format_maintenance_history(vehicle_id):
+async def format_maintenance_history(vehicle_id):
     """
     Format maintenance history into text
     """
-    maintenance = db.get_maintenance_history(vehicle_id)
-    repairs = db.get_repairs(vehicle_id)
+    maintenance, repairs = await asyncio.gather(
+        repo.get_maintenance_history(vehicle_id), repo.get_repairs(vehicle_id)
+    )
 
     history = "\n📜 **История ТО:**\n"
 
@@ -191,8 +193,7 @@ def get_repair_management_keyboard(vehicle_id, repairs):
 async def manage_repairs(callback_query: types.CallbackQuery):
     """Handler for repair management menu"""
     vehicle_id = int(callback_query.data.split("_")[2])
-    vehicle = db.get_vehicle(vehicle_id)
-    repairs = db.get_repairs(vehicle_id)
+    vehicle, repairs = await asyncio.gather(repo.get_vehicle(vehicle_id), repo.get_repairs(vehicle_id))
 
     text = f"🛠 **Управление ремонтами для {vehicle['model']} ({vehicle['reg_number']})**\n\n"
     text += "Выберите запись о ремонте для управления или добавьте новую:"
@@ -210,19 +211,7 @@ async def show_repair_details(callback_query: types.CallbackQuery):
     repair_id = int(callback_query.data.split("_")[2])
 
     try:
-        conn = db.get_connection() # Assuming db_operations provides a get_connection function
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        cursor.execute("""
-        SELECT r.*, v.model, v.reg_number 
-        FROM repairs r
-        JOIN vehicles v ON r.vehicle_id = v.id
-        WHERE r.id = ?
-        """, (repair_id,))
-
-        record = cursor.fetchone()
-        conn.close()
+        record = await repo.get_repair_record(repair_id)
 
         if not record:
             await callback_query.answer("⚠️ Запись о ремонте не найдена")
@@ -250,12 +239,13 @@ async def show_repair_details(callback_query: types.CallbackQuery):
         logging.error(f"Ошибка при отображении деталей ремонта: {e}")
         await callback_query.answer("⚠️ Произошла ошибка", show_alert=True)
 
-def format_refueling_history(vehicle_id):
+async def format_refueling_history(vehicle_id):
     """
     Format refueling history into text
     """
-    refueling = db.get_refueling_history(vehicle_id)
-    stats = db.calculate_fuel_stats(vehicle_id)
+    refueling, stats = await asyncio.gather(
+        repo.get_refueling_history(vehicle_id), repo.calculate_fuel_stats(vehicle_id)
+    )
 
     history = "\n⛽ **История заправок:**\n"
 
@@ -289,7 +279,7 @@ async def cmd_start(message: types.Message):
         "👋 Добро пожаловать в систему учета обслуживания автомобилей!\n\n"
         "Выберите автомобиль из списка или добавьте новый:",
         parse_mode="Markdown",
-        reply_markup=get_main_menu_keyboard()
+        reply_markup=await get_main_menu_keyboard()
     )
 
 @dp.message(Command("help"))
@@ -327,16 +317,31 @@ async def back_to_main(callback_query: types.CallbackQuery, state: FSMContext =
     await callback_query.message.edit_text(
         "Выберите автомобиль из списка или добавьте новый:",
         parse_mode="Markdown",
-        reply_markup=get_main_menu_keyboard()
+        reply_markup=await get_main_menu_keyboard()
     )
 
+@dp.callback_query(lambda c: c.data.startswith("roster_"))
+async def show_roster_page(callback_query: types.CallbackQuery):
+    """Handler for vehicle list pagination"""
+    page = int(callback_query.data.split("_")[1])
+    await callback_query.answer()
+    keyboard = await get_main_menu_keyboard(page)
+    try:
+        await callback_query.message.edit_text(
+            "Выберите автомобиль из списка или добавьте новый:",
+            reply_markup=keyboard
+        )
+    except TelegramAPIError:
+        # Нажата кнопка текущей страницы - сообщение не изменилось
+        pass
+
 @dp.callback_query(lambda c: c.data.startswith("vehicle_"))
 async def show_vehicle(callback_query: types.CallbackQuery):
     """Handler for vehicle selection"""
     vehicle_id = int(callback_query.data.split("_")[1])
 
     # Get vehicle information
-    vehicle_card = format_vehicle_card(vehicle_id)
+    vehicle_card = await format_vehicle_card(vehicle_id)
 
     await callback_query.answer()
     await callback_query.message.edit_text(
@@ -405,7 +410,7 @@ async def vehicle_mileage_entered(message: types.Message, state: FSMContext):
 
         # Save the vehicle data
         data = await state.get_data()
-        vehicle_id = db.add_vehicle(
+        vehicle_id = await repo.add_vehicle(
             model=data["model"],
             reg_number=data["reg_number"],
             vin=data.get("vin"),
@@ -422,7 +427,7 @@ async def vehicle_mileage_entered(message: types.Message, state: FSMContext):
 
             # Show the vehicle
             await message.answer(
-                format_vehicle_card(vehicle_id),
+                await format_vehicle_card(vehicle_id),
                 parse_mode="Markdown",
                 reply_markup=get_vehicle_keyboard(vehicle_id)
             )
@@ -494,7 +499,7 @@ async def confirm_mileage(callback_query: types.CallbackQuery, state: FSMContext
     new_mileage = int(parts[3])
 
     # Update mileage
-    success = db.update_vehicle_mileage(vehicle_id, new_mileage)
+    success = await repo.update_vehicle_mileage(vehicle_id, new_mileage)
 
     if success:
         await callback_query.message.edit_text(
@@ -505,7 +510,7 @@ async def confirm_mileage(callback_query: types.CallbackQuery, state: FSMContext
         # Return to vehicle card after a short delay
         await asyncio.sleep(2)
         await callback_query.message.edit_text(
-            format_vehicle_card(vehicle_id),
+            await format_vehicle_card(vehicle_id),
             parse_mode="Markdown",
             reply_markup=get_vehicle_keyboard(vehicle_id)
         )
@@ -527,7 +532,7 @@ async def show_maintenance(callback_query: types.CallbackQuery):
 
     await callback_query.answer()
     await callback_query.message.edit_text(
-        f"📜 **История обслуживания автомобиля**\n\n{format_maintenance_history(vehicle_id)}",
+        f"📜 **История обслуживания автомобиля**\n\n{await format_maintenance_history(vehicle_id)}",
         parse_mode="Markdown",
         reply_markup=get_back_keyboard(vehicle_id)
     )
@@ -626,7 +631,7 @@ async def repair_cost_entered(message: types.Message, state: FSMContext):
         data = await state.get_data()
 
         # Add repair record
-        success = db.add_repair(
+        success = await repo.add_repair(
             vehicle_id=data["vehicle_id"],
             date=data["date"],
             mileage=data["mileage"],
@@ -640,7 +645,7 @@ async def repair_cost_entered(message: types.Message, state: FSMContext):
             # Return to vehicle card after a short delay
             await asyncio.sleep(1)
             await message.answer(
-                format_vehicle_card(data["vehicle_id"]),
+                await format_vehicle_card(data["vehicle_id"]),
                 parse_mode="Markdown",
                 reply_markup=get_vehicle_keyboard(data["vehicle_id"])
             )
@@ -667,7 +672,7 @@ async def show_fuel_stats(callback_query: types.CallbackQuery):
 
     await callback_query.answer()
     await callback_query.message.edit_text(
-        f"⛽ **Статистика расхода топлива**\n\n{format_refueling_history(vehicle_id)}",
+        f"⛽ **Статистика расхода топлива**\n\n{await format_refueling_history(vehicle_id)}",
         parse_mode="Markdown",
         reply_markup=get_back_keyboard(vehicle_id)
     )
@@ -777,7 +782,7 @@ async def refueling_cost_entered(message: types.Message, state: FSMContext):
     cost_per_liter = result
 
     # Add refueling record
-    success = db.add_refueling(
+    success = await repo.add_refueling(
         vehicle_id=vehicle_id,
         date=date,
         mileage=mileage,
@@ -798,7 +803,7 @@ async def refueling_cost_entered(message: types.Message, state: FSMContext):
         # Return to vehicle card after a short delay
         await asyncio.sleep(1)
         await message.answer(
-            format_vehicle_card(vehicle_id),
+            await format_vehicle_card(vehicle_id),
             parse_mode="Markdown",
             reply_markup=get_vehicle_keyboard(vehicle_id)
         )
@@ -819,20 +824,8 @@ async def delete_repair_confirm(callback_query: types.CallbackQuery):
     logging.debug(f"Запрос на подтверждение удаления ремонта с ID={repair_id}")
 
     try:
-        conn = db.get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
         # Получение информации о ремонте перед удалением
-        cursor.execute("""
-        SELECT r.*, v.model, v.reg_number 
-        FROM repairs r
-        JOIN vehicles v ON r.vehicle_id = v.id
-        WHERE r.id = ?
-        """, (repair_id,))
-
-        record = cursor.fetchone()
-        conn.close()
+        record = await repo.get_repair_record(repair_id)
 
         if not record:
             await callback_query.answer("⚠️ Запись о ремонте не найдена", show_alert=True)
@@ -869,21 +862,16 @@ async def repair_delete_execute(callback_query: types.CallbackQuery):
         logging.debug(f"Выполнение удаления ремонта с ID={repair_id}")
 
         # Получаем vehicle_id перед удалением
-        conn = db.get_connection()
-        conn.row_factory = sqlite3.Row  # Важная строка!
-        cursor = conn.cursor()
-        cursor.execute("SELECT vehicle_id FROM repairs WHERE id = ?", (repair_id,))
-        result = cursor.fetchone()
-        conn.close()
+        result = await repo.get_repair_record(repair_id)
 
         if not result:
             await callback_query.answer("⚠️ Запись уже удалена", show_alert=True)
             return
 
-        vehicle_id = result["vehicle_id"]  # Теперь result точно словарь
+        vehicle_id = result["vehicle_id"]
 
         # Вызов функции удаления из db_operations
-        success = db.delete_repair(repair_id)
+        success = await repo.delete_repair(repair_id)
 
         if success:
             await callback_query.message.edit_text(
@@ -951,7 +939,7 @@ async def refueling_cost_entered(message: types.Message, state: FSMContext):
     cost_per_liter = result
 
     # Add refueling record
-    success = db.add_refueling(
+    success = await repo.add_refueling(
         vehicle_id=vehicle_id,
         date=date,
         mileage=mileage,
@@ -972,7 +960,7 @@ async def refueling_cost_entered(message: types.Message, state: FSMContext):
         # Return to vehicle card after a short delay
         await asyncio.sleep(1)
         await message.answer(
-            format_vehicle_card(vehicle_id),
+            await format_vehicle_card(vehicle_id),
             parse_mode="Markdown",
             reply_markup=get_vehicle_keyboard(vehicle_id)
         )
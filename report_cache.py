@@ -0,0 +1,251 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+
+# Папка с готовыми отчетами. Она общая для всех процессов бота и для
+# рабочих процессов report_pool
+REPORT_CACHE_DIR = os.environ.get("REPORT_CACHE_DIR", "reports_cache")
+
+# Сколько места могут занимать отчеты (мегабайты); лишние удаляются,
+# начиная с тех, которые дольше всего не запрашивали
+REPORT_CACHE_MAX_MB = float(os.environ.get("REPORT_CACHE_MAX_MB", "100"))
+
+# Сколько дней хранится отчет, который никто не запрашивает
+REPORT_CACHE_MAX_AGE_DAYS = float(os.environ.get("REPORT_CACHE_MAX_AGE_DAYS", "7"))
+
+# Версия формата отчетов: увеличьте при изменении оформления, чтобы
+# отчеты, построенные прежним кодом, больше не выдавались
+REPORT_FORMAT_VERSION = 2
+
+
+class RowDigest:
+    """
+    Content hash of the rows a report is built from
+
+    The report name, its date and REPORT_FORMAT_VERSION are hashed first,
+    then every row in order. Update it with the rows while they are
+    consumed, so the digest describes exactly the data that went into the
+    report.
+    """
+
+    def __init__(self, name, date):
+        self._hash = hashlib.sha256(f"{name}:{date.isoformat()}:{REPORT_FORMAT_VERSION}".encode())
+
+    def update(self, row):
+        self._hash.update(repr(tuple(row)).encode())
+        self._hash.update(b"\n")
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+class ReportCache:
+    """
+    On-disk cache of built reports, keyed by RowDigest
+
+    A report is stored as <digest>.pdf. Reading it refreshes its mtime, and
+    evict() drops files not read for max_age seconds, then the least
+    recently read ones until the folder fits into max_bytes. Files are
+    written to a temporary name and renamed, so another process never
+    reads a half-written report.
+    """
+
+    def __init__(self, directory=REPORT_CACHE_DIR, max_bytes=REPORT_CACHE_MAX_MB * 2**20,
+                 max_age=REPORT_CACHE_MAX_AGE_DAYS * 86400):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+
+    def _path(self, digest):
+        return os.path.join(self.directory, f"{digest}.pdf")
+
+    def get(self, digest):
+        """
+        Get a stored report
+
+        Args:
+            digest (str): RowDigest.hexdigest() of the report data
+
+        Returns:
+            bytes: PDF document, or None if it is not cached
+        """
+        path = self._path(digest)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except OSError as e:
+            logging.warning(f"Не удалось прочитать отчет из кэша {path}: {e}")
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, digest, data):
+        """
+        Store a report and evict old ones
+
+        Args:
+            digest (str): RowDigest.hexdigest() of the report data
+            data (bytes): PDF document
+        """
+        path = self._path(digest)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logging.warning(f"Не удалось сохранить отчет в кэш {path}: {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+        self.evict()
+
+    def evict(self):
+        """
+        Remove expired reports, then the least recently read ones over the size limit
+
+        Returns:
+            int: Number of removed files
+        """
+        with self._lock:
+            try:
+                names = os.listdir(self.directory)
+            except FileNotFoundError:
+                return 0
+
+            files = []
+            for name in names:
+                if not name.endswith(".pdf"):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+            files.sort()
+
+            now = time.time()
+            total = sum(size for _, size, _ in files)
+            removed = 0
+            for mtime, size, path in files:
+                if now - mtime <= self.max_age and total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+
+            if removed:
+                self.evicted += removed
+                logging.info(f"Из кэша отчетов удалено файлов: {removed}")
+            return removed
+
+    def clear(self):
+        """Remove all cached reports"""
+        max_bytes, self.max_bytes = self.max_bytes, -1
+        try:
+            self.evict()
+        finally:
+            self.max_bytes = max_bytes
+
+    def stats(self):
+        """
+        Get cache counters of this process
+
+        Returns:
+            dict: hits, misses, hit_rate and evicted files
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "evicted": self.evicted,
+        }
+
+
+# Общий кэш для процесса
+report_cache = ReportCache()
+
+
+if __name__ == "__main__":
+    # Отчет без кэша, из кэша, при одновременных запросах и после изменения данных:
+    # python report_cache.py
+    import shutil
+    import asyncio
+    import sqlite3
+    import tempfile
+
+    # Пробег меняется во временной копии базы, кэш тоже временный - рабочие
+    # данные не затрагиваются, даже если проверку прервать
+    workdir = tempfile.mkdtemp(prefix="report_cache_")
+    source = sqlite3.connect(os.environ.get("VEHICLES_DB_PATH", "vehicles.db"))
+    copy = sqlite3.connect(os.path.join(workdir, "vehicles.db"))
+    source.backup(copy)
+    source.close()
+    copy.close()
+    os.environ["VEHICLES_DB_PATH"] = os.path.join(workdir, "vehicles.db")
+    os.environ["REPORT_CACHE_DIR"] = report_cache.directory = os.path.join(workdir, "reports")
+
+    import db_writer
+    from db_migrations import apply_migrations
+    from report_pool import ReportPool
+
+    logging.basicConfig(level=logging.WARNING)
+    apply_migrations()
+
+    def change_mileage(delta):
+        def write(conn):
+            conn.execute("UPDATE vehicles SET mileage = mileage + ? WHERE id = (SELECT MIN(id) FROM vehicles)", (delta,))
+        db_writer.execute(write)
+
+    async def timed(title, job):
+        started = time.perf_counter()
+        result = await job
+        print(f"{title:<36} {(time.perf_counter() - started) * 1000:>9.1f} мс")
+        return result
+
+    async def main():
+        pool = ReportPool()
+        report_cache.clear()
+        await pool.build("build_expiration_report")  # запуск процесса и импорт ReportLab
+
+        first = await timed("Первый запрос (построение)", pool.expiration_report())
+        second = await timed("Повторный запрос (кэш)", pool.expiration_report())
+        built = pool.built
+        await timed("10 одновременных запросов", asyncio.gather(*(pool.expiration_report() for _ in range(10))))
+        print(f"  построено {pool.built - built}, объединено {pool.deduplicated}")
+
+        change_mileage(1)
+        try:
+            changed = await timed("После изменения пробега", pool.expiration_report())
+        finally:
+            change_mileage(-1)
+        again = await timed("Данные возвращены (кэш)", pool.expiration_report())
+
+        print(f"Одинаковые отчеты из кэша: {first == second == again}, новый отчет отличается: {changed != first}")
+        print(f"Выдано из кэша: {pool.cache_hits}, файлов в кэше: {len(os.listdir(report_cache.directory))}")
+        pool.shutdown()
+
+    try:
+        asyncio.run(main())
+    finally:
+        db_writer.stop_writer()
+        shutil.rmtree(workdir, ignore_errors=True)
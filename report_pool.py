@@ -0,0 +1,208 @@
+import os
+import time
+import asyncio
+import logging
+import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Сколько процессов строят отчеты. ReportLab занимает процессор целиком,
+# поэтому в потоке он тормозит и цикл событий бота (GIL)
+REPORT_WORKERS = int(os.environ.get("REPORT_WORKERS", "1"))
+
+
+def _init_worker():
+    # Рабочий процесс не обрабатывает Ctrl+C - его останавливает родитель
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # Шрифты и стили загружаются один раз, до первого отчета
+    import report_render
+    report_render.warm()
+
+
+def _build(name, kwargs):
+    import utils
+    return getattr(utils, name)(**kwargs)
+
+
+def _lookup(digest_name):
+    # Хэш данных отчета и готовый отчет из кэша, если он есть
+    import utils
+    from report_cache import report_cache
+    digest = getattr(utils, digest_name)()
+    return digest, report_cache.get(digest)
+
+
+class ReportPool:
+    """
+    Process pool that builds PDF reports and returns them as bytes
+
+    Identical requests made while a report is being built share one job,
+    and a report whose data has not changed comes from report_cache:
+
+        pdf = await report_pool.expiration_report()
+
+    Worker processes are started with "spawn" on first use, so they do not
+    inherit the bot's threads, sockets or database connections.
+    """
+
+    def __init__(self, workers=REPORT_WORKERS):
+        self.workers = workers
+        self.built = 0
+        self.deduplicated = 0
+        self.cache_hits = 0
+        self._executor = None
+        self._inflight = {}  # key -> asyncio.Future
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        return self._executor
+
+    async def _shared(self, key, job):
+        """Run job() once for all callers that ask for the same key meanwhile"""
+        future = self._inflight.get(key)
+        if future is not None:
+            self.deduplicated += 1
+            return await asyncio.shield(future)
+
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await job()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            # Ошибку получат ожидающие; если их нет, не предупреждаем о ней
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _run(self, name, **kwargs):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            result = await loop.run_in_executor(self._get_executor(), _build, name, kwargs)
+        except BrokenProcessPool:
+            # Рабочий процесс упал - пересоздаем пул и пробуем еще раз
+            logging.error("Процесс построения отчетов завершился аварийно, пул пересоздается")
+            self._executor = None
+            result = await loop.run_in_executor(self._get_executor(), _build, name, kwargs)
+        self.built += 1
+        logging.info(f"Отчет {name} построен за {time.perf_counter() - started:.2f} с ({len(result)} байт)")
+        return result
+
+    async def build(self, name, key=None):
+        """
+        Build a report with utils.<name>() in a worker process
+
+        Args:
+            name (str): Name of a utils function that returns the PDF bytes
+            key (Hashable): Requests with the same key share one build
+                (default: name and today's date)
+
+        Returns:
+            bytes: PDF document
+        """
+        key = key or (name, datetime.date.today())
+        return await self._shared(key, lambda: self._run(name))
+
+    async def cached(self, name, digest_name):
+        """
+        Get a report from report_cache, building it only if its data changed
+
+        utils.<digest_name>() hashes the report rows (a query, no rendering)
+        in a database thread. On a miss the worker builds the report with
+        utils.<name>(cache=True), which stores it under the digest of the
+        rows it actually rendered. Concurrent requests share one lookup and
+        one build.
+
+        Args:
+            name (str): Name of a utils function that builds the PDF bytes
+            digest_name (str): Name of a utils function that returns the digest
+
+        Returns:
+            bytes: PDF document
+        """
+        from db_async import repo
+
+        async def lookup_or_build():
+            digest, pdf = await repo.run(_lookup, digest_name)
+            if pdf is not None:
+                self.cache_hits += 1
+                logging.info(f"Отчет {name} выдан из кэша ({len(pdf)} байт)")
+                return pdf
+            return await self._run(name, cache=True)
+
+        return await self._shared((name, "cached", datetime.date.today()), lookup_or_build)
+
+    async def expiration_report(self):
+        """
+        Get the document expiration report, rebuilt only when the data changed
+
+        Returns:
+            bytes: PDF document
+        """
+        return await self.cached("build_expiration_report", "expiration_report_digest")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Общий пул для процесса
+report_pool = ReportPool()
+
+
+if __name__ == "__main__":
+    # Задержка цикла событий во время построения отчета: в потоке и в процессе
+    # python report_pool.py
+    from concurrent.futures import ThreadPoolExecutor
+    from db_migrations import apply_migrations
+    import utils
+
+    logging.basicConfig(level=logging.WARNING)
+    apply_migrations()
+
+    async def loop_lag(job):
+        """Run job while measuring how late 1 ms timers fire"""
+        lags = []
+        task = asyncio.ensure_future(job)
+        while not task.done():
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append((time.perf_counter() - started - 0.001) * 1000)
+        await task
+        lags.sort()
+        return lags[int(len(lags) * 0.99)], lags[-1]
+
+    async def main():
+        pool = ReportPool()
+        await pool.build("build_expiration_report")  # запуск процесса и импорт ReportLab
+
+        thread_pool = ThreadPoolExecutor(1)
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        p99, worst = await loop_lag(loop.run_in_executor(thread_pool, utils.build_expiration_report))
+        print(f"Поток:   {time.perf_counter() - started:.2f} с, задержка цикла p99 {p99:.1f} мс, max {worst:.1f} мс")
+
+        started = time.perf_counter()
+        p99, worst = await loop_lag(pool.build("build_expiration_report"))
+        print(f"Процесс: {time.perf_counter() - started:.2f} с, задержка цикла p99 {p99:.1f} мс, max {worst:.1f} мс")
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(pool.build("build_expiration_report") for _ in range(10)))
+        print(f"10 одновременных запросов: {time.perf_counter() - started:.2f} с, "
+              f"построено {pool.built - 2}, объединено {pool.deduplicated}, "
+              f"одинаковый результат: {len(set(results)) == 1}")
+        pool.shutdown()
+
+    asyncio.run(main())
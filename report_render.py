@@ -0,0 +1,480 @@
+import io
+import os
+import logging
+import datetime
+import functools
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen.canvas import Canvas
+from reportlab.platypus import Table, TableStyle, Paragraph
+
+import fleet_expiry
+
+# Где искать шрифты с кириллицей: сначала в папке проекта, потом в системе
+FONT_DIRS = (".", "/usr/share/fonts/truetype/dejavu")
+FONT_REGULAR = "DejaVuSans.ttf"
+FONT_BOLD = "DejaVuSans-Bold.ttf"
+
+EXPIRATION_HEADERS = ("Транспортное средство", "ОСАГО", "Техосмотр", "СКЗИ", "ТО")
+EXPIRATION_COL_WIDTHS = (170, 90, 90, 90, 90)
+
+# Отступ после заголовка отчета и от нижнего поля до номера страницы (пункты)
+REPORT_TITLE_GAP = 20
+REPORT_FOOTER_HEIGHT = 16
+
+# По сколько строк читается курсор при построении отчета
+REPORT_FETCH_SIZE = int(os.environ.get("REPORT_FETCH_SIZE", "500"))
+
+
+@functools.lru_cache(maxsize=None)
+def get_fonts():
+    """
+    Register the Cyrillic fonts once per process
+
+    Returns:
+        tuple: (regular, bold) font names; Helvetica if DejaVuSans is missing
+    """
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    for directory in FONT_DIRS:
+        regular = os.path.join(directory, FONT_REGULAR)
+        bold = os.path.join(directory, FONT_BOLD)
+        if os.path.exists(regular) and os.path.exists(bold):
+            try:
+                pdfmetrics.registerFont(TTFont('CustomFont', regular))
+                pdfmetrics.registerFont(TTFont('CustomFontBold', bold))
+                logging.info(f"Используются шрифты DejaVuSans из {os.path.abspath(directory)}")
+                return 'CustomFont', 'CustomFontBold'
+            except Exception as e:
+                logging.error(f"Ошибка при регистрации шрифтов: {e}")
+    logging.warning("Шрифты DejaVuSans не найдены, используется Helvetica (без полной поддержки кириллицы)")
+    return 'Helvetica', 'Helvetica-Bold'
+
+
+@functools.lru_cache(maxsize=None)
+def get_styles():
+    """
+    Build the paragraph styles and the static table style commands once
+
+    Returns:
+        dict: "normal", "title" (ParagraphStyle) and "table" (tuple of
+        TableStyle commands shared by every expiration report)
+    """
+    font, font_bold = get_fonts()
+    styles = getSampleStyleSheet()
+    return {
+        "normal": ParagraphStyle(
+            'CyrillicNormal',
+            parent=styles['Normal'],
+            fontName=font,
+            fontSize=10,
+            leading=14,
+            encoding='utf-8',
+            alignment=1
+        ),
+        "title": ParagraphStyle(
+            'CyrillicTitle',
+            parent=styles['Heading1'],
+            fontName=font_bold,
+            fontSize=16,
+            leading=20,
+            alignment=1,
+            spaceAfter=20,
+            encoding='utf-8'
+        ),
+        "table": (
+            ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+            ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), font_bold),
+            ('FONTSIZE', (0, 0), (-1, 0), 12),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+            ('TOPPADDING', (0, 0), (-1, 0), 8),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.white),
+            ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+            ('FONTNAME', (0, 1), (-1, -1), font),
+            ('FONTSIZE', (0, 1), (-1, -1), 10),
+            ('BOTTOMPADDING', (0, 1), (-1, -1), 6),
+            ('TOPPADDING', (0, 1), (-1, -1), 6),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+            ('BOX', (0, 0), (-1, -1), 1, colors.black),
+            ('LINEBELOW', (0, 0), (-1, 0), 1, colors.black),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('ALIGN', (1, 1), (-1, -1), 'CENTER'),
+            ('ALIGN', (0, 1), (0, -1), 'LEFT'),
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.whitesmoke, colors.white]),
+        ),
+    }
+
+
+def warm():
+    """Load fonts and styles ahead of the first report (report_pool workers)"""
+    get_styles()
+
+
+@functools.lru_cache(maxsize=1024)
+def days_cell(days, status):
+    """
+    Text of a document column in the PDF (ASCII marks instead of emoji)
+
+    Args:
+        days (int): Days until expiration, None if not set
+        status (int): fleet_expiry status of the document
+
+    Returns:
+        str: Cell text
+    """
+    if status == fleet_expiry.NOT_REQUIRED:
+        return "Не требуется"
+    if status == fleet_expiry.UNKNOWN:
+        return "? Не задано"
+    if status == fleet_expiry.EXPIRED:
+        return f"-{-days} дн."
+    if status == fleet_expiry.CRITICAL:
+        return f"! ! ({days} дн.)"
+    if status == fleet_expiry.SOON:
+        return f"! Скоро ({days} дн.)"
+    return f"+ {days} дн."
+
+
+def to_cell(remaining_to, status):
+    """Text of the TO column: kilometres left until the next maintenance"""
+    if status == fleet_expiry.UNKNOWN:
+        return "Не задано"
+    if status == fleet_expiry.EXPIRED:
+        return f"-{-remaining_to} км"
+    if status != fleet_expiry.OK:
+        return f"!{remaining_to} км"
+    return f"{remaining_to} км"
+
+
+_ALERT_COLORS = (colors.mistyrose, colors.darkred)
+_WARNING_COLORS = (colors.lemonchiffon, colors.saddlebrown)
+
+# Фон и цвет текста ячейки по статусу срока (остальные не выделяются)
+STATUS_COLORS = {
+    fleet_expiry.EXPIRED: _ALERT_COLORS,
+    fleet_expiry.CRITICAL: _ALERT_COLORS,
+    fleet_expiry.SOON: _WARNING_COLORS,
+}
+
+
+def expiration_rows(vehicles):
+    """
+    Convert vehicle rows into table rows of the expiration report
+
+    Args:
+        vehicles (Iterable): Rows with model and reg_number plus the days
+            and statuses of fleet_expiry (fleet_expiry.annotate)
+
+    Yields:
+        tuple: (cell texts, statuses) of one vehicle; the status of the
+        first column is None
+    """
+    for vehicle in vehicles:
+        statuses = (
+            None,
+            vehicle['osago_valid_status'],
+            vehicle['tech_inspection_valid_status'],
+            vehicle['skzi_valid_date_status'],
+            vehicle['to_status'],
+        )
+        yield (
+            f"{vehicle['model']} ({vehicle['reg_number']})",
+            days_cell(vehicle['osago_valid_days'], statuses[1]),
+            days_cell(vehicle['tech_inspection_valid_days'], statuses[2]),
+            days_cell(vehicle['skzi_valid_date_days'], statuses[3]),
+            to_cell(vehicle['to_remaining'], statuses[4]),
+        ), statuses
+
+
+def highlight_runs(rows):
+    """
+    Find the highlighted cells of a page in bulk
+
+    Equally highlighted neighbours in a column are merged, so a page needs
+    a few rectangles per column instead of one per cell.
+
+    Args:
+        rows (Sequence): (cell texts, statuses) of one page (expiration_rows)
+
+    Returns:
+        list: (column, first_row, last_row, colors) with 0-based row indexes
+    """
+    runs = []
+    for j in range(1, len(EXPIRATION_HEADERS)):
+        run_start, run_colors = 0, None
+        for i, (_, statuses) in enumerate(rows):
+            cell_colors = STATUS_COLORS.get(statuses[j])
+            if cell_colors is not run_colors:
+                if run_colors is not None:
+                    runs.append((j, run_start, i - 1, run_colors))
+                run_start, run_colors = i, cell_colors
+        if run_colors is not None:
+            runs.append((j, run_start, len(rows) - 1, run_colors))
+    return runs
+
+
+_LINE_COMMANDS = ("GRID", "INNERGRID", "BOX", "OUTLINE", "LINEABOVE", "LINEBELOW", "LINEBEFORE", "LINEAFTER")
+
+
+def _table(rows, commands, headers=EXPIRATION_HEADERS):
+    blank = ("",) * len(EXPIRATION_HEADERS)
+    table = Table([headers or blank] + [blank] * rows, colWidths=EXPIRATION_COL_WIDTHS)
+    table.setStyle(TableStyle(commands))
+    return table
+
+
+@functools.lru_cache(maxsize=None)
+def get_layout():
+    """
+    Measure the report table once and derive the page layout
+
+    Returns:
+        dict: margins, column positions, header and row heights,
+        rows_per_page and first_page_rows
+    """
+    styles = get_styles()
+    header_height = _table(0, styles["table"]).wrap(0, 0)[1]
+    row_height = _table(1, styles["table"]).wrap(0, 0)[1] - header_height
+
+    page_width, page_height = A4
+    margin = 72
+    width = page_width - 2 * margin
+    left = margin + (width - sum(EXPIRATION_COL_WIDTHS)) / 2
+    title_height = (Paragraph("Т", styles["title"]).wrap(width, page_height)[1] + styles["title"].spaceAfter
+                    + Paragraph("Т", styles["normal"]).wrap(width, page_height)[1] + REPORT_TITLE_GAP)
+    columns = [left + sum(EXPIRATION_COL_WIDTHS[:j]) for j in range(len(EXPIRATION_COL_WIDTHS))]
+    return {
+        "margin": margin,
+        "width": width,
+        "left": left,
+        "top": page_height - margin,
+        "title_height": title_height,
+        "columns": columns,
+        "header_height": header_height,
+        "row_height": row_height,
+        "rows_per_page": int((page_height - 2 * margin - header_height) // row_height),
+        "first_page_rows": int((page_height - 2 * margin - title_height - header_height) // row_height),
+    }
+
+
+class _PageWriter:
+    """
+    Draws report pages with precomputed PDF fragments
+
+    The grid of a page (header, stripes, lines) depends only on the number
+    of rows and is drawn by ReportLab once into two form XObjects: stripes
+    and the header below the highlights, lines above them. Cell texts are
+    formatted by ReportLab once per distinct text and color and then placed
+    with a translation, so a page is a join of cached strings.
+    """
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.styles = get_styles()
+        self.layout = get_layout()
+        self.font, _ = get_fonts()
+        self._forms = set()
+        self._texts = {}
+
+    def _grid(self, rows, top):
+        """Name of the pair of forms for a table of `rows` rows at `top`"""
+        name = f"grid{rows}_{top:g}"
+        if name not in self._forms:
+            layout = self.layout
+            table_style = self.styles["table"]
+            # Размеры ячеек задают общие команды, поэтому они есть в обеих формах
+            below = [c for c in table_style if c[0] not in _LINE_COMMANDS]
+            above = [c for c in table_style if c[0] not in ("BACKGROUND", "ROWBACKGROUNDS")]
+            for suffix, commands, headers in (("bg", below, EXPIRATION_HEADERS), ("fg", above, None)):
+                table = _table(rows, commands, headers)
+                height = table.wrap(0, 0)[1]
+                self.canvas.beginForm(f"{name}_{suffix}")
+                table.drawOn(self.canvas, layout["left"], top - height)
+                self.canvas.endForm()
+            self._forms.add(name)
+        return name
+
+    def _text(self, text, color, centred):
+        """Text drawing operators at the origin (or centred on it)
+
+        Centred cells (dates, days, mileage) repeat and are formatted once;
+        the vehicle names are unique and are not kept.
+        """
+        key = (text, color)
+        code = self._texts.get(key) if centred else None
+        if code is None:
+            text_object = self.canvas.beginText(-stringWidth(text, self.font, 10) / 2 if centred else 0, 0)
+            text_object.setFont(self.font, 10, 12)
+            text_object.setFillColor(color)
+            text_object.textOut(text)
+            code = text_object.getCode()
+            if centred:
+                self._texts[key] = code
+        return code
+
+    def page(self, rows, top):
+        """Draw one table page; rows must fit below `top`"""
+        layout = self.layout
+        canvas = self.canvas
+        columns = layout["columns"]
+        row_height = layout["row_height"]
+        first_row_top = top - layout["header_height"]
+
+        grid = self._grid(len(rows), top)
+        canvas.doForm(f"{grid}_bg")
+
+        parts = []
+        for j, first, last, (background, _) in highlight_runs(rows):
+            y = first_row_top - (last + 1) * row_height
+            parts.append(f"q {background.red:.4f} {background.green:.4f} {background.blue:.4f} rg "
+                         f"{columns[j]:.2f} {y:.2f} {EXPIRATION_COL_WIDTHS[j]} {(last - first + 1) * row_height:.2f} re f Q")
+        canvas.addLiteral("\n".join(parts))
+        canvas.doForm(f"{grid}_fg")
+
+        # Базовая линия строки: как у Table с VALIGN MIDDLE (12 пт интерлиньяж, шрифт 10 пт)
+        baseline = (row_height + 12) / 2 - 10
+        parts = []
+        text_x = [columns[0] + 6] + [columns[j] + EXPIRATION_COL_WIDTHS[j] / 2 for j in range(1, len(columns))]
+        for i, (row, statuses) in enumerate(rows):
+            y = first_row_top - (i + 1) * row_height + baseline
+            parts.append(f"q 1 0 0 1 {text_x[0]:.2f} {y:.2f} cm {self._text(row[0], colors.black, False)} Q")
+            for j in range(1, len(row)):
+                text = row[j]
+                cell_colors = STATUS_COLORS.get(statuses[j])
+                color = cell_colors[1] if cell_colors else colors.black
+                parts.append(f"q 1 0 0 1 {text_x[j]:.2f} {y:.2f} cm {self._text(text, color, True)} Q")
+        canvas.addLiteral("\n".join(parts))
+
+
+def _chunks(rows, first_size, size):
+    chunk = []
+    limit = first_size
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == limit:
+            yield chunk
+            chunk, limit = [], size
+    if chunk:
+        yield chunk
+
+
+def render_expiration_report(vehicles, today=None):
+    """
+    Render the document expiration report into memory, page by page
+
+    Vehicles are consumed lazily (a cursor iterator is fine) in page-sized
+    chunks. Every page gets its own table with the header row; only one
+    page of rows is held at a time, and the time grows linearly with the
+    fleet (see _PageWriter).
+
+    Args:
+        vehicles (Iterable): Vehicle rows (see expiration_rows)
+        today (datetime.date): Report date (default: today)
+
+    Returns:
+        bytes: PDF document
+    """
+    today = today or datetime.date.today()
+    styles = get_styles()
+    layout = get_layout()
+    font, _ = get_fonts()
+
+    buffer = io.BytesIO()
+    canvas = Canvas(buffer, pagesize=A4, pageCompression=1)
+    canvas.setTitle("Отчет об истечении сроков документов")
+    writer = _PageWriter(canvas)
+    margin, width, top = layout["margin"], layout["width"], layout["top"]
+
+    # Заголовок на первой странице
+    y = top
+    for text, style, gap in (
+        ("Отчет об истечении сроков документов", styles["title"], styles["title"].spaceAfter),
+        (f"Дата создания: {today.strftime('%d.%m.%Y')}", styles["normal"], REPORT_TITLE_GAP),
+    ):
+        paragraph = Paragraph(text, style)
+        height = paragraph.wrap(width, top)[1]
+        paragraph.drawOn(canvas, margin, y - height)
+        y -= height + gap
+
+    page = 0
+    for rows in _chunks(expiration_rows(vehicles), layout["first_page_rows"], layout["rows_per_page"]):
+        page += 1
+        writer.page(rows, y)
+        canvas.setFont(font, 8)
+        canvas.drawCentredString(margin + width / 2, margin - REPORT_FOOTER_HEIGHT, f"Страница {page}")
+        canvas.showPage()
+        y = top
+
+    if page == 0:
+        # Пустой автопарк: одна страница с заголовком и шапкой таблицы
+        writer.page([], y)
+        canvas.showPage()
+
+    canvas.save()
+    return buffer.getvalue()
+
+
+if __name__ == "__main__":
+    # Время, пиковая память и размер отчета для больших автопарков:
+    # python report_render.py [число машин ...]
+    import sys
+    import time
+    import random
+    import tracemalloc
+
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 50000]
+    logging.basicConfig(level=logging.WARNING)
+
+    def fleet(count):
+        # Порции строк, как из курсора базы: все машины сразу в памяти не хранятся
+        rng = random.Random(count)
+        today = datetime.date.today()
+
+        def iso(low, high):
+            return (today + datetime.timedelta(days=rng.randint(low, high))).isoformat()
+
+        def batches():
+            batch = []
+            for i in range(count):
+                batch.append({
+                    "model": f"КАМАЗ {rng.randint(4300, 6600)}",
+                    "reg_number": f"А{i % 1000:03d}ВС{rng.randint(10, 199)}",
+                    "osago_valid_iso": rng.choice([None, iso(-60, 400)]),
+                    "tech_inspection_valid_iso": iso(-30, 400),
+                    "skzi_valid_date_iso": iso(-30, 900),
+                    "tachograph_required": rng.random() < 0.6,
+                    "next_to": rng.choice([0, rng.randint(10000, 300000)]),
+                    "mileage": rng.randint(5000, 290000),
+                })
+                if len(batch) == REPORT_FETCH_SIZE:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        return fleet_expiry.annotate(batches(), today)
+
+    warm()
+    render_expiration_report(fleet(10))  # прогрев импортов ReportLab
+
+    print(f"{'vehicles':>8} {'time, s':>8} {'us/vehicle':>11} {'pages':>6} {'pdf, KB':>8} {'peak, MB':>9}")
+    for size in sizes:
+        started = time.perf_counter()
+        pdf = render_expiration_report(fleet(size))
+        elapsed = time.perf_counter() - started
+
+        # Память - отдельным прогоном: tracemalloc сильно замедляет код
+        tracemalloc.start()
+        render_expiration_report(fleet(size))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        pages = pdf.count(b"/Type /Page\n")
+        print(f"{size:>8} {elapsed:>8.2f} {elapsed / size * 1e6:>11.1f} {pages:>6} "
+              f"{len(pdf) / 1024:>8.0f} {peak / 2**20:>9.1f}")
@@ -1,6 +1,7 @@
-import sqlite3
 import logging
 import os
+import db_pool
+import db_writer
 
 logging.basicConfig(level=logging.INFO)
 
@@ -11,11 +12,16 @@ def reset_database():
     try:
         logging.info("Resetting database...")
         
-        # Remove existing database file if it exists
-        if os.path.exists('vehicles.db'):
-            logging.info("Removing existing database file...")
-            os.remove('vehicles.db')
-            logging.info("Database file removed.")
+        # Close pooled connections and the writer before the file is removed
+        db_writer.stop_writer()
+        db_pool.close_pool()
+        
+        # Remove existing database file (and its WAL files) if it exists
+        for path in (db_pool.DB_PATH, db_pool.DB_PATH + "-wal", db_pool.DB_PATH + "-shm"):
+            if os.path.exists(path):
+                logging.info(f"Removing {path}...")
+                os.remove(path)
+        logging.info("Database file removed.")
         
         # Now import and run the database initialization
         from db_init import init_database
@@ -0,0 +1,396 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+import contextlib
+import contextvars
+from collections import deque
+
+from aiohttp import ClientConnectorError
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramServerError
+from aiogram.methods import EditMessageText
+
+# Ограничения Telegram: около 30 сообщений в секунду на бота, около одного
+# сообщения в секунду в личный чат (с небольшими всплесками) и 20 в минуту в группу
+SEND_GLOBAL_RATE = float(os.environ.get("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.environ.get("SEND_CHAT_RATE", "1"))
+SEND_GROUP_RATE = float(os.environ.get("SEND_GROUP_RATE", str(20 / 60)))
+
+# Сколько сообщений можно отправить в один чат подряд, прежде чем включится ограничение
+SEND_CHAT_BURST = int(os.environ.get("SEND_CHAT_BURST", "3"))
+
+# Повторы при сетевых ошибках и ошибках сервера: 0.5, 1, 2, 4, 8 секунд
+SEND_MAX_RETRIES = int(os.environ.get("SEND_MAX_RETRIES", "5"))
+SEND_RETRY_BASE = float(os.environ.get("SEND_RETRY_BASE", "0.5"))
+
+# Очереди: ответы пользователям обгоняют рассылки
+INTERACTIVE = 0
+BULK = 1
+
+_priority = contextvars.ContextVar("send_priority", default=INTERACTIVE)
+
+
+def _is_idempotent(method):
+    """Whether sending the method twice has the same effect as sending it once"""
+    name = getattr(method, "__api_method__", "")
+    return name == "sendChatAction" or not name.startswith(("send", "forward", "copy"))
+
+
+def _not_sent(error):
+    """Whether a network error happened before the request reached Telegram"""
+    # AiohttpSession оборачивает ошибку aiohttp в TelegramNetworkError внутри except
+    return isinstance(error.__context__, ClientConnectorError)
+
+
+class TokenBucket:
+    """Token bucket: `rate` tokens per second, at most `capacity` stored"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Seconds until a token is available (0 if one is available now)"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ("seq", "priority", "method", "make_request", "bot", "future", "attempts", "coalesce_key")
+
+    def __init__(self, seq, priority, method, make_request, bot, coalesce_key):
+        self.seq = seq
+        self.priority = priority
+        self.method = method
+        self.make_request = make_request
+        self.bot = bot
+        self.future = asyncio.get_running_loop().create_future()
+        self.attempts = 0
+        self.coalesce_key = coalesce_key
+
+
+class _Chat:
+    __slots__ = ("chat_id", "bucket", "lanes", "busy", "paused_until", "timer")
+
+    def __init__(self, chat_id, bucket):
+        self.chat_id = chat_id
+        self.bucket = bucket
+        self.lanes = (deque(), deque())  # INTERACTIVE, BULK
+        self.busy = False
+        self.paused_until = 0.0
+        self.timer = None
+
+    def head(self):
+        for lane in self.lanes:
+            if lane:
+                return lane[0]
+        return None
+
+
+class SendQueue(BaseRequestMiddleware):
+    """
+    Outbound dispatcher for Bot API calls that target a chat
+
+    Attached as a session middleware, so every bot.send_* / message.answer /
+    edit_text call goes through it without changing the call sites:
+
+        send_queue.attach(bot)
+
+    Each request waits for a token from the global bucket and from its
+    chat's bucket. Requests to one chat are sent one at a time in order;
+    different chats are served concurrently, so a broadcast runs at the
+    global limit. Interactive requests are served before bulk ones (use
+    `with send_queue.bulk():` for reports, backups and long listings).
+    A new edit_text for a message whose previous edit has not been sent yet
+    replaces it, and both callers get the result of the last edit. On 429 the
+    chat is paused for retry_after seconds; network and server errors are
+    retried with exponential backoff. New messages (send*, forward*, copy*)
+    are retried after such errors only if the connection failed before the
+    request was sent, since Telegram may have delivered them already.
+    Methods without a chat (getUpdates, answerCallbackQuery, ...) are
+    passed through unchanged.
+    """
+
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, chat_rate=SEND_CHAT_RATE, group_rate=SEND_GROUP_RATE,
+                 chat_burst=SEND_CHAT_BURST, max_retries=SEND_MAX_RETRIES, retry_base=SEND_RETRY_BASE):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+
+        self.sent = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.rate_limited = 0
+
+        # Без накопления: запросы идут равномерно, не больше global_rate за любую секунду
+        self._global = TokenBucket(global_rate, 1)
+        self._chats = {}
+        self._ready = []  # heap of (priority, seq, chat_id) for chats with a job that can be sent
+        self._pending_edits = {}  # coalesce key -> job not yet sent
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._worker = None
+
+    def attach(self, bot):
+        """Route the bot's requests through this queue"""
+        bot.session.middleware(self)
+        return bot
+
+    @contextlib.contextmanager
+    def bulk(self):
+        """Send requests made inside the block (and tasks started in it) with bulk priority"""
+        token = _priority.set(BULK)
+        try:
+            yield
+        finally:
+            _priority.reset(token)
+
+    async def broadcast(self, chat_ids, send):
+        """
+        Send to many chats at the maximum safe rate
+
+        Args:
+            chat_ids (Iterable[int]): Recipients
+            send (Callable): async function (chat_id) -> result, e.g. a
+                function that calls bot.send_message and bot.send_document
+
+        Returns:
+            dict: chat_id -> result of send, or the exception it raised
+        """
+        chat_ids = list(chat_ids)
+        with self.bulk():
+            results = await asyncio.gather(*(send(chat_id) for chat_id in chat_ids), return_exceptions=True)
+        return dict(zip(chat_ids, results))
+
+    def stats(self):
+        """
+        Get queue counters
+
+        Returns:
+            dict: sent, coalesced, retries, rate_limited and number of queued requests
+        """
+        return {
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "queued": sum(len(lane) for chat in self._chats.values() for lane in chat.lanes),
+        }
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        coalesce_key = None
+        if isinstance(method, EditMessageText) and method.message_id is not None:
+            coalesce_key = (bot.id, chat_id, method.message_id)
+            job = self._pending_edits.get(coalesce_key)
+            if job is not None:
+                # Предыдущая правка еще не отправлена - отправим только новую
+                job.method = method
+                self.coalesced += 1
+                return await asyncio.shield(job.future)
+
+        job = _Job(next(self._seq), _priority.get(), method, make_request, bot, coalesce_key)
+        if coalesce_key is not None:
+            self._pending_edits[coalesce_key] = job
+
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            rate = self.group_rate if isinstance(chat_id, int) and chat_id < 0 else self.chat_rate
+            chat = self._chats[chat_id] = _Chat(chat_id, TokenBucket(rate, self.chat_burst))
+        chat.lanes[job.priority].append(job)
+        self._activate(chat)
+        self._ensure_worker()
+        return await asyncio.shield(job.future)
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    def _activate(self, chat):
+        """Put the chat into the ready heap if its head job can be considered"""
+        if chat.busy:
+            return
+        job = chat.head()
+        if job is None:
+            return
+        heapq.heappush(self._ready, (job.priority, job.seq, chat.chat_id))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _defer(self, chat, delay):
+        if chat.timer is None:
+            chat.timer = asyncio.get_running_loop().call_later(delay, self._resume, chat)
+
+    def _resume(self, chat):
+        chat.timer = None
+        self._activate(chat)
+
+    async def _run(self):
+        while True:
+            if not self._ready:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # Сначала ждем глобальный токен, потом выбираем самый приоритетный чат
+            delay = self._global.delay(time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            _, _, chat_id = heapq.heappop(self._ready)
+            chat = self._chats.get(chat_id)
+            if chat is None or chat.busy or chat.head() is None:
+                continue  # устаревшая запись
+
+            now = time.monotonic()
+            wait = max(chat.paused_until - now, chat.bucket.delay(now))
+            if wait > 0:
+                self._defer(chat, wait)
+                continue
+
+            job = chat.lanes[0].popleft() if chat.lanes[0] else chat.lanes[1].popleft()
+            if job.coalesce_key is not None and self._pending_edits.get(job.coalesce_key) is job:
+                del self._pending_edits[job.coalesce_key]
+            self._global.take(now)
+            chat.bucket.take(now)
+            chat.busy = True
+            asyncio.get_running_loop().create_task(self._send(chat, job))
+
+    async def _send(self, chat, job):
+        try:
+            result = await job.make_request(job.bot, job.method)
+        except TelegramRetryAfter as e:
+            self.rate_limited += 1
+            logging.warning(f"Ограничение Telegram для чата {chat.chat_id}: повтор через {e.retry_after} с")
+            self._retry(chat, job, e.retry_after, e)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            if _is_idempotent(job.method) or (isinstance(e, TelegramNetworkError) and _not_sent(e)):
+                self._retry(chat, job, self.retry_base * 2 ** job.attempts, e)
+            else:
+                # Запрос мог дойти до Telegram - повтор дал бы дубликат сообщения
+                logging.error(f"Не удалось отправить {type(job.method).__name__} в чат {chat.chat_id}: {e}")
+                self._finish(chat, job, error=e)
+        except Exception as e:
+            self._finish(chat, job, error=e)
+        except BaseException:
+            # Отправку отменили (остановка бота) - освобождаем чат и ожидающих
+            job.future.cancel()
+            self._finish(chat, job)
+            raise
+        else:
+            self.sent += 1
+            self._finish(chat, job, result=result)
+
+    def _retry(self, chat, job, delay, error):
+        job.attempts += 1
+        if job.attempts > self.max_retries:
+            logging.error(f"Не удалось отправить {type(job.method).__name__} в чат {chat.chat_id}: {error}")
+            self._finish(chat, job, error=error)
+            return
+        self.retries += 1
+        # Повторяем первым в своей очереди, чтобы не нарушить порядок сообщений в чате
+        chat.lanes[job.priority].appendleft(job)
+        chat.paused_until = time.monotonic() + delay
+        chat.busy = False
+        self._defer(chat, delay)
+
+    def _finish(self, chat, job, result=None, error=None):
+        if not job.future.done():
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+        chat.busy = False
+        if chat.head() is not None:
+            self._activate(chat)
+        elif chat.timer is None and chat.bucket.full(time.monotonic()):
+            # Чат простаивает и лимит восстановлен - состояние больше не нужно
+            del self._chats[chat.chat_id]
+
+
+# Общая очередь для процесса: ограничения Telegram действуют на токен бота,
+# поэтому все экземпляры Bot с одним токеном подключаются к ней
+send_queue = SendQueue()
+
+
+if __name__ == "__main__":
+    # Рассылка с имитацией API: python send_queue.py [чатов] [сообщений в чат]
+    import sys
+    from types import SimpleNamespace
+    from aiogram.methods import SendMessage
+
+    chats = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    per_chat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    async def main():
+        queue = SendQueue()
+        bot = SimpleNamespace(id=1)
+        sent_at = []
+        flood = {"left": 1}
+
+        async def fake_request(bot, method):
+            await asyncio.sleep(0.02)  # задержка сети
+            if method.chat_id == 5 and flood["left"]:
+                flood["left"] -= 1
+                raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=1)
+            sent_at.append((time.monotonic(), method.chat_id))
+            return method.text
+
+        async def deliver(chat_id):
+            for i in range(per_chat):
+                await queue(fake_request, bot, SendMessage(chat_id=chat_id, text=f"{i}"))
+
+        started = time.monotonic()
+        results = await queue.broadcast(range(1, chats + 1), deliver)
+        elapsed = time.monotonic() - started
+        failed = sum(isinstance(result, Exception) for result in results.values())
+
+        # Наибольшее число отправок за любую секунду
+        times = [t for t, _ in sent_at]
+        peak = max(sum(1 for u in times if t <= u < t + 1) for t in times)
+        total = chats * per_chat
+        print(f"{total} сообщений в {chats} чатов за {elapsed:.2f} с "
+              f"({total / elapsed:.1f}/с, пик {peak} за секунду, лимит {SEND_GLOBAL_RATE:.0f}), ошибок {failed}")
+        print(f"Нижняя граница при этом лимите: {total / SEND_GLOBAL_RATE:.2f} с; статистика {queue.stats()}")
+
+        # Несколько правок одного сообщения подряд отправляются одной
+        edits = []
+
+        async def edit_request(bot, method):
+            await asyncio.sleep(0.02)
+            edits.append(method.text)
+            return method.text
+
+        from aiogram.methods import EditMessageText as Edit
+        await asyncio.gather(*(
+            queue(edit_request, bot, Edit(chat_id=999, message_id=1, text=f"шаг {i}")) for i in range(10)
+        ))
+        print(f"10 правок сообщения -> отправлено {len(edits)}: {edits}")
+
+    asyncio.run(main())
@@ -1,20 +1,31 @@
 import logging
-import sqlite3
 import asyncio
 import os
 import datetime
+import functools
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, BufferedInputFile
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.exceptions import TelegramAPIError
+from aiogram.utils.chat_action import ChatActionSender
 from config import TOKEN
 from db_init import init_database
-from db_operations import register_user, get_all_users, get_user_stats, is_user_admin, set_admin_status, delete_repair
+from db_async import repo
+from fsm_storage import SQLiteStorage
+from send_queue import send_queue
+from update_scheduler import update_scheduler
+from report_pool import report_pool
+from db_cache import admin_cache, card_cache, data_versions
+from db_activity import activity_tracker
+from db_operations import SEARCH_RANK_WINDOW
+from keyboards import ROSTER_PAGE_SIZE, get_vehicle_list_keyboard
 import utils
-from utils import days_until, format_days_remaining, get_to_interval_based_on_mileage, edit_fuel_info
+import fleet_expiry
+import export
+from callback_router import CallbackRouter
+from utils import format_days_remaining, get_to_interval_based_on_mileage, edit_fuel_info
 #ver 0.0.13
 # Configure logging
 logging.basicConfig(
@@ -33,14 +44,22 @@ init_database()
 ADMIN_IDS = [936544929]  # ID пользователя добавлен
 
 # Function to check if user is admin
-def is_admin(user_id):
+async def is_admin(user_id):
     """Check if user is admin"""
     # Первоначальная проверка по статичному списку админов для доступа до инициализации базы
     if user_id in ADMIN_IDS:
         return True
 
+    # Статус из кэша; set_admin_status сбрасывает его при изменении
+    cached = admin_cache.get(user_id)
+    if cached is not None:
+        return cached
+
     # Проверка через базу данных для динамического управления админами
-    return is_user_admin(user_id)
+    generation = admin_cache.generation
+    result = await repo.is_user_admin(user_id)
+    admin_cache.put(user_id, result, generation)
+    return result
 
 # Decorator for admin-only functions
 def admin_required(func):
@@ -51,10 +70,11 @@ def admin_required(func):
     sig = inspect.signature(func)
     param_names = list(sig.parameters.keys())
 
+    @functools.wraps(func)
     async def wrapper(event, *args, **kwargs):
         # Проверка прав администратора
         user_id = event.from_user.id
-        if not is_admin(user_id):
+        if not await is_admin(user_id):
             if isinstance(event, types.CallbackQuery):
                 await event.answer("⚠️ У вас нет прав администратора для выполнения этой операции", show_alert=True)
                 return
@@ -97,13 +117,19 @@ try:
         token=TOKEN,
         default=DefaultBotProperties(parse_mode="Markdown")
     )
+    # Все исходящие запросы проходят через очередь с ограничением частоты
+    send_queue.attach(bot)
 
     # Проверка соединения с API Telegram
     logging.info("Проверка соединения с API Telegram...")
 
     # Initialize storage and dispatcher
-    storage = MemoryStorage()
+    storage = SQLiteStorage()
     dp = Dispatcher(storage=storage)
+    # Записываем последние изменения диалогов перед остановкой
+    dp.shutdown.register(storage.close)
+    # Останавливаем процессы построения отчетов
+    dp.shutdown.register(report_pool.shutdown)
     logging.info("Dispatcher successfully initialized")
 except Exception as e:
     logging.error(f"Error initializing bot or dispatcher: {e}")
@@ -111,6 +137,26 @@ except Exception as e:
     logging.error(traceback.format_exc())
     raise
 
+# Все нажатия inline-кнопок проходят через одну таблицу обработчиков
+callbacks = CallbackRouter()
+dp.callback_query.register(callbacks.dispatch)
+
+# Обновления разных чатов обрабатываются параллельно, одного чата - по очереди
+dp.update.outer_middleware(update_scheduler)
+
+@dp.update.outer_middleware()
+async def track_activity(handler, event, data):
+    """Count every update of a user (last_activity, interaction_count) without a DB write"""
+    user = data.get("event_from_user")
+    if user is not None and not user.is_bot:
+        activity_tracker.track(user.id, user.username or "", user.full_name)
+    return await handler(event, data)
+
+async def flush_activity():
+    await repo.run(activity_tracker.flush)
+
+dp.shutdown.register(flush_activity)
+
 # States for form input
 class MaintenanceState(StatesGroup):
     date = State()
@@ -149,82 +195,70 @@ class AdminManageState(StatesGroup):
     user_id = State()
     action = State() # "add" или "remove"
 
+class SearchState(StatesGroup):
+    query = State()
+
 # Helper functions
-def get_vehicle_buttons():
-    """Create keyboard with vehicle selection buttons"""
-    conn = sqlite3.connect('vehicles.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, model, reg_number FROM vehicles ORDER BY model")
-    vehicles = cursor.fetchall()
-    conn.close()
+async def get_vehicle_buttons(page=0):
+    """Create keyboard with vehicle selection buttons (one page of the roster)"""
+    roster = await repo.get_fleet_roster()
+    page_count = roster.page_count(ROSTER_PAGE_SIZE)
+    page = min(max(0, page), page_count - 1)
+
+    def build():
+        # Добавляем кнопку для перехода на веб-интерфейс
+        web_url = "https://d933dc0e-c8d9-4501-bbd7-4bdac973738c-00-33heojbox43gm.picard.replit.dev"
+        return get_vehicle_list_keyboard(
+            roster.page(page, ROSTER_PAGE_SIZE), page, page_count,
+            extra_rows=[[InlineKeyboardButton(text="🌐 Открыть веб-интерфейс", url=web_url)]]
+        )
 
-    keyboard = []
-    for vehicle in vehicles:
-        keyboard.append([
-            InlineKeyboardButton(
-                text=f"🚛 {vehicle['model']} ({vehicle['reg_number']})",
-                callback_data=f"vehicle_{vehicle['id']}"
-            )
-        ])
+    # Клавиатура строится один раз на страницу и живет, пока не изменится список ТС
+    return roster.memo(("telegram_bot", page), build)
 
-    # Добавляем кнопку для перехода на веб-интерфейс
-    web_url = "https://d933dc0e-c8d9-4501-bbd7-4bdac973738c-00-33heojbox43gm.picard.replit.dev"
-    keyboard.append([
-        InlineKeyboardButton(
-            text="🌐 Открыть веб-интерфейс",
-            url=web_url
-        )
-    ])
+async def get_vehicle_card(vehicle_id, user_id=None):
+    """
+    Get the vehicle card, from the card cache when possible
+
+    Cards are cached per (vehicle, role, data version, day): any write to the
+    vehicle's data bumps its version, and the day in the key rebuilds the
+    "days remaining" figures after midnight.
 
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+    Args:
+        vehicle_id (int): Vehicle ID
+        user_id (int, optional): User ID, to check admin rights
+    """
+    is_user_admin = await is_admin(user_id) if user_id is not None else False
+
+    # Версию читаем до загрузки данных: запись, прошедшая во время загрузки,
+    # увеличит версию, и устаревшая карточка больше не будет выдана
+    key = (vehicle_id, is_user_admin, data_versions.get(vehicle_id), datetime.date.today())
+    cached = card_cache.get(key)
+    if cached is not None:
+        return cached
+
+    card, keyboard = await render_vehicle_card(vehicle_id, is_user_admin)
+    if keyboard is not None:
+        card_cache.put(key, (card, keyboard))
+    return card, keyboard
 
-def get_vehicle_card(vehicle_id, user_id=None):
+async def render_vehicle_card(vehicle_id, is_user_admin):
     """
     Generate detailed vehicle information card with all available data
 
     Args:
         vehicle_id (int): Vehicle ID
-        user_id (int, optional): User ID, to check admin rights
+        is_user_admin (bool): Whether to show the admin control buttons
     """
-    conn = sqlite3.connect('vehicles.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
-    # Get vehicle data with all fields from enhanced schema
-    cursor.execute("""
-        SELECT * FROM vehicles WHERE id = ?
-    """, (vehicle_id,))
-    vehicle = cursor.fetchone()
-
-    if not vehicle:
-        conn.close()
+    # Vehicle row, recent TO and repair history in one query
+    card_data = await repo.get_vehicle_card_data(vehicle_id)
+    if not card_data:
         return "Автомобиль не найден", None
 
-    # Get maintenance history
-    cursor.execute("""
-        SELECT date, mileage, works FROM maintenance
-        WHERE vehicle_id = ?
-        ORDER BY date DESC, mileage DESC
-    """, (vehicle_id,))
-    to_history = cursor.fetchall()
-
-    # Get repair history
-    cursor.execute("""
-        SELECT date, mileage, description, cost FROM repairs
-        WHERE vehicle_id = ?
-        ORDER BY date DESC, mileage DESC
-    """, (vehicle_id,))
-    repairs = cursor.fetchall()
-
-    # Get last maintenance record for interval calculation
-    cursor.execute("""
-        SELECT mileage FROM maintenance
-        WHERE vehicle_id = ?
-        ORDER BY date DESC, mileage DESC LIMIT 1
-    """, (vehicle_id,))
-    last_to_record = cursor.fetchone()
-    last_to_mileage = last_to_record['mileage'] if last_to_record else None
+    vehicle = card_data.vehicle
+    to_history = card_data.maintenance
+    repairs = card_data.repairs
+    last_to_mileage = card_data.last_to_mileage
 
     # Generate vehicle card with enhanced information
     card = (
@@ -239,16 +273,17 @@ def get_vehicle_card(vehicle_id, user_id=None):
         f"📝 **Документы и сроки:**\n"
     )
 
-    # Add document expiration with days remaining
-    osago_days = days_until(vehicle['osago_valid'])
-    tech_days = days_until(vehicle['tech_inspection_valid'])
+    # Add document expiration with days remaining (same thresholds as reports)
+    expiry = fleet_expiry.compute([vehicle]).vehicle(0)
+    osago_days = expiry['osago_valid_days']
+    tech_days = expiry['tech_inspection_valid_days']
 
     card += f"📅 **ОСАГО до:** `{vehicle['osago_valid'] or '-'}` {format_days_remaining(osago_days)}\n"
     card += f"🔧 **Техосмотр до:** `{vehicle['tech_inspection_valid'] or '-'}` {format_days_remaining(tech_days)}\n"
 
     # Add SKZI information if tachograph is required
     if vehicle['tachograph_required']:
-        skzi_days = days_until(vehicle['skzi_valid_date'])
+        skzi_days = expiry['skzi_valid_date_days']
         card += (
             f"🔐 **СКЗИ установлен:** `{vehicle['skzi_install_date'] or '-'}`\n"
             f"🔐 **СКЗИ действует до:** `{vehicle['skzi_valid_date'] or '-'}` {format_days_remaining(skzi_days)}\n"
@@ -268,11 +303,12 @@ def get_vehicle_card(vehicle_id, user_id=None):
         card += f"🔄 **Следующее ТО при:** `{next_to_mileage} км`\n"
         card += f"🔄 **Осталось до ТО:** `{remaining_km} км`\n"
 
-        if remaining_km <= 0:
+        to_status = fleet_expiry.to_status(remaining_km)
+        if to_status == fleet_expiry.EXPIRED:
             card += "⚠️ **ВНИМАНИЕ! Необходимо пройти ТО!**\n"
-        elif remaining_km <= 500:
+        elif to_status == fleet_expiry.CRITICAL:
             card += "⚠️ **ВНИМАНИЕ! ТО требуется в ближайшее время!**\n"
-        elif remaining_km <= 1000:
+        elif to_status == fleet_expiry.SOON:
             card += "⚠️ **Приближается плановое ТО!**\n"
 
     # Add fuel information if available
@@ -294,6 +330,8 @@ def get_vehicle_card(vehicle_id, user_id=None):
     if to_history:
         for record in to_history:
             card += f"📅 `{record['date']}` – `{record['mileage']} км` – {record['works']}\n"
+        if card_data.has_more_maintenance:
+            card += f"🔹 Показаны последние {len(to_history)} записей\n"
     else:
         card += "🔹 Нет данных о техническом обслуживании\n"
 
@@ -303,15 +341,14 @@ def get_vehicle_card(vehicle_id, user_id=None):
         for record in repairs:
             cost_text = f" – 💰 `{record['cost']} руб.`" if record['cost'] else ""
             card += f"🔧 `{record['date']}` – `{record['mileage']} км` – {record['description']}{cost_text}\n"
+        if card_data.has_more_repairs:
+            card += f"🔹 Показаны последние {len(repairs)} записей\n"
     else:
         card += "🔹 Нет данных о ремонтах\n"
 
     # Create action keyboard based on user's admin status
     keyboard_buttons = []
 
-    # Check if user is admin
-    is_user_admin = is_admin(user_id) if user_id is not None else False
-
     # For regular users, only show back button
     if not is_user_admin:
         keyboard_buttons = [
@@ -331,9 +368,17 @@ def get_vehicle_card(vehicle_id, user_id=None):
             [InlineKeyboardButton(text="⬅ Назад к списку", callback_data="back")]
         ]
 
+    # Кнопки полной истории, если в карточку попали не все записи
+    history_buttons = []
+    if card_data.has_more_maintenance:
+        history_buttons.append(InlineKeyboardButton(text="📜 Вся история ТО", callback_data=f"history_maintenance_{vehicle_id}_0"))
+    if card_data.has_more_repairs:
+        history_buttons.append(InlineKeyboardButton(text="🛠 Все ремонты", callback_data=f"history_repairs_{vehicle_id}_0"))
+    if history_buttons:
+        keyboard_buttons.insert(0, history_buttons)
+
     keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
 
-    conn.close()
     return card, keyboard
 
 # Command handlers
@@ -346,18 +391,13 @@ async def start_command(message: types.Message):
 
         logging.info(f"Пользователь {user_id} ({user_name}) запустил команду /start")
 
-        # Регистрируем пользователя в системе
-        try:
-            register_user(user_id, message.from_user.username or "", user_name)
-            logging.info(f"Пользователь {user_id} зарегистрирован/обновлен в системе")
-        except Exception as e:
-            logging.error(f"Ошибка при регистрации пользователя {user_id}: {e}")
+        # Пользователь регистрируется в track_activity вместе с любым другим действием
 
         # Show user ID
         user_id_info = f"🆔 Ваш Telegram ID: {user_id}"
         is_user_admin = False
         try:
-            is_user_admin = is_admin(user_id)
+            is_user_admin = await is_admin(user_id)
             if is_user_admin:
                 user_id_info += " (Вы администратор)"
             else:
@@ -383,6 +423,8 @@ async def start_command(message: types.Message):
             f"🔍 *Команды бота:*\n"
             f"/start - Запуск бота и список автомобилей\n"
             f"/help - Подробная справка по использованию\n"
+            f"/find - Поиск автомобиля по госномеру или модели\n"
+            f"/search - Поиск по истории ТО и ремонтов\n"
             f"/myid - Просмотр вашего Telegram ID"
         )
 
@@ -392,7 +434,7 @@ async def start_command(message: types.Message):
         # Получаем список автомобилей
         try:
             # Отправляем список автомобилей
-            keyboard = get_vehicle_buttons()
+            keyboard = await get_vehicle_buttons()
             await message.answer(
                 f"🚗 *Выберите автомобиль из списка для начала работы:*",
                 reply_markup=keyboard,
@@ -429,13 +471,16 @@ async def help_command(message: types.Message):
         "🚗 **Основные команды:**\n"
         "/start - Показать список автомобилей\n"
         "/help - Показать эту справку\n"
+        "/find <номер> - Найти автомобиль по началу госномера или модели\n"
+        "/search <текст> - Поиск по истории ТО, ремонтов и заметкам\n"
         "/myid - Показать ваш Telegram ID\n"
     )
 
     # Дополнительные команды для администраторов
-    if is_admin(message.from_user.id):
+    if await is_admin(message.from_user.id):
         help_text += (
             "/backup - Создать резервную копию базы данных\n"
+            "/export - Выгрузить таблицу в XLSX, CSV или NDJSON\n"
             "/users - Просмотр списка пользователей\n"
             "/admin - Управление статусом администратора\n"
         )
@@ -467,15 +512,12 @@ async def show_my_id(message: types.Message):
     user_id = message.from_user.id
     user_name = message.from_user.full_name
 
-    # Регистрируем пользователя при запросе ID
-    register_user(user_id, message.from_user.username or "", user_name)
-
     # Проверяем статус администратора и выводим информацию
-    admin_status = is_admin(user_id)
+    admin_status = await is_admin(user_id)
     help_text = ""
     if not admin_status and user_id in ADMIN_IDS:
         # Если пользователь в списке ADMIN_IDS, но не отмечен в БД как админ, исправляем
-        set_admin_status(user_id, True)
+        await repo.set_admin_status(user_id, True)
         admin_status = True
         help_text = "✅ Ваш статус администратора восстановлен в базе данных!"
 
@@ -507,7 +549,7 @@ async def admin_command(message: types.Message, state: FSMContext):
         parse_mode="Markdown"
     )
 
-@dp.callback_query(lambda c: c.data == "admin_add")
+@callbacks.exact("admin_add")
 @admin_required
 async def admin_add(callback: types.CallbackQuery, state: FSMContext):
     """Start process of adding an admin"""
@@ -526,7 +568,7 @@ async def admin_add(callback: types.CallbackQuery, state: FSMContext):
     await state.set_state(AdminManageState.user_id)
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "admin_remove")
+@callbacks.exact("admin_remove")
 @admin_required
 async def admin_remove(callback: types.CallbackQuery, state: FSMContext):
     """Start process of removing an admin"""
@@ -544,7 +586,7 @@ async def admin_remove(callback: types.CallbackQuery, state: FSMContext):
     await state.set_state(AdminManageState.user_id)
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "admin_cancel")
+@callbacks.exact("admin_cancel")
 @admin_required
 async def admin_cancel(callback: types.CallbackQuery):
     """Cancel admin management process"""
@@ -573,11 +615,7 @@ async def process_admin_user_id(message: types.Message, state: FSMContext):
             return
 
         # Проверяем, существует ли пользователь
-        conn = sqlite3.connect('vehicles.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, full_name, is_admin FROM users WHERE id = ?", (user_id,))
-        user = cursor.fetchone()
-        conn.close()
+        user = await repo.get_user(user_id)
 
         if not user:
             logging.warning(f"Пользователь с ID {user_id} не найден в базе данных")
@@ -589,8 +627,8 @@ async def process_admin_user_id(message: types.Message, state: FSMContext):
             return
 
         # Извлекаем данные о пользователе
-        user_name = user[1]
-        is_admin = bool(user[2])
+        user_name = user['full_name']
+        is_admin = bool(user['is_admin'])
         logging.info(f"Найден пользователь: {user_name}, админ: {is_admin}")
 
         # Проверяем, что действие имеет смысл
@@ -642,7 +680,7 @@ async def process_admin_user_id(message: types.Message, state: FSMContext):
             "Попробуйте снова:"
         )
 
-@dp.callback_query(lambda c: c.data.startswith("confirm_"))
+@callbacks.prefix("confirm")
 @admin_required
 async def confirm_admin_action(callback: types.CallbackQuery, state: FSMContext):
     """Confirm admin status change"""
@@ -673,13 +711,7 @@ async def confirm_admin_action(callback: types.CallbackQuery, state: FSMContext)
                 user_id = int(user_id_str)
 
                 # Получаем имя пользователя из базы данных
-                conn = sqlite3.connect('vehicles.db')
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-                # Исправлено: column user_id -> id в таблице users
-                cursor.execute("SELECT username, full_name FROM users WHERE id = ?", (user_id,))
-                user_data = cursor.fetchone()
-                conn.close()
+                user_data = await repo.get_user(user_id)
 
                 if user_data:
                     # Восстанавливаем данные в состоянии
@@ -692,27 +724,14 @@ async def confirm_admin_action(callback: types.CallbackQuery, state: FSMContext)
                     data = await state.get_data()
                     logging.info(f"Восстановили данные в состоянии: {data}")
                 else:
-                    # Проверяем, существует ли таблица users и есть ли в ней записи
-                    conn = sqlite3.connect('vehicles.db')
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-                    table_exists = cursor.fetchone()
-
-                    if not table_exists:
-                        logging.error("Таблица users не существует в базе данных")
-                        message_text = "⚠️ Ошибка: Таблица пользователей не найдена. Необходимо инициализировать базу данных."
+                    # Проверяем, есть ли в таблице users записи (таблицу создают миграции)
+                    stats = await repo.get_user_stats()
+                    if stats["total_users"] == 0:
+                        logging.error("Таблица users пуста, нет зарегистрированных пользователей")
+                        message_text = "⚠️ Ошибка: В системе нет зарегистрированных пользователей. Пользователь должен сначала использовать команду /start."
                     else:
-                        # Проверяем, есть ли записи в таблице
-                        cursor.execute("SELECT COUNT(*) FROM users")
-                        count = cursor.fetchone()[0]
-                        if count == 0:
-                            logging.error("Таблица users пуста, нет зарегистрированных пользователей")
-                            message_text = "⚠️ Ошибка: В системе нет зарегистрированных пользователей. Пользователь должен сначала использовать команду /start."
-                        else:
-                            logging.error(f"Пользователь {user_id} не найден в базе данных")
-                            message_text = f"⚠️ Ошибка: Пользователь с ID {user_id} не найден. Попросите его выполнить команду /start или /myid."
-
-                    conn.close()
+                        logging.error(f"Пользователь {user_id} не найден в базе данных")
+                        message_text = f"⚠️ Ошибка: Пользователь с ID {user_id} не найден. Попросите его выполнить команду /start или /myid."
 
                     await callback.message.edit_text(
                         message_text,
@@ -759,7 +778,7 @@ async def confirm_admin_action(callback: types.CallbackQuery, state: FSMContext)
     # Изменяем статус администратора
     new_status = (action == "add")
     logging.info(f"Устанавливаем статус администратора: {new_status}")
-    result = set_admin_status(user_id, new_status)
+    result = await repo.set_admin_status(user_id, new_status)
     logging.info(f"Результат установки статуса: {result}")
 
     # Очищаем состояние до вывода сообщения
@@ -789,8 +808,7 @@ async def confirm_admin_action(callback: types.CallbackQuery, state: FSMContext)
 @admin_required
 async def show_users(message: types.Message):
     """Handler for showing registered users (admin only)"""
-    users = get_all_users()
-    stats = get_user_stats()
+    users, stats = await asyncio.gather(repo.get_all_users(), repo.get_user_stats())
 
     if not users:
         await message.answer("⚠️ Список пользователей пуст.")
@@ -802,7 +820,27 @@ async def show_users(message: types.Message):
         f"👥 Всего пользователей: {stats['total_users']}\n"
         f"👤 Активных за 7 дней: {stats['active_users']}\n"
         f"🆕 Новых за 30 дней: {stats['new_users']}\n"
-        f"🔑 Администраторов: {stats['admin_count']}\n\n"
+        f"🔑 Администраторов: {stats['admin_count']}\n"
+    )
+    cache_stats = admin_cache.stats()
+    stats_text += (
+        f"⚡ Кэш прав: {cache_stats['hits']} попаданий, {cache_stats['misses']} промахов "
+        f"({cache_stats['hit_rate']:.0%})\n"
+    )
+    cache_stats = card_cache.stats()
+    stats_text += (
+        f"🗂 Кэш карточек: {cache_stats['hits']} попаданий, {cache_stats['misses']} промахов "
+        f"({cache_stats['hit_rate']:.0%}), в памяти {cache_stats['size']}\n"
+    )
+    queue_stats = send_queue.stats()
+    stats_text += (
+        f"📤 Отправлено: {queue_stats['sent']}, объединено правок {queue_stats['coalesced']}, "
+        f"повторов {queue_stats['retries']} (429: {queue_stats['rate_limited']})\n"
+    )
+    scheduler_stats = update_scheduler.stats()
+    stats_text += (
+        f"⏱ Обновления: {scheduler_stats['processed']} обработано, {scheduler_stats['running']} выполняется, "
+        f"{scheduler_stats['waiting']} в очереди; ожидание p95 {scheduler_stats['wait_p95_ms']} мс\n\n"
     )
 
     # Список пользователей
@@ -832,6 +870,7 @@ async def show_users(message: types.Message):
 
         # Разделяем список пользователей на части
         remaining_text = users_text
+        chunks = []
         while remaining_text:
             # Находим безопасную точку разделения (между записями пользователей)
             split_point = remaining_text[:max_message_length].rfind("\n\n")
@@ -840,19 +879,24 @@ async def show_users(message: types.Message):
             if split_point == -1:  # Если и это не помогло, просто отрезаем максимальную длину
                 split_point = max_message_length - 1
 
-            # Отправляем часть текста
-            await message.answer(remaining_text[:split_point+1], parse_mode="Markdown")
+            chunks.append(remaining_text[:split_point+1])
 
             # Обновляем оставшийся текст
             remaining_text = remaining_text[split_point+1:]
 
+        # Части длинного списка отправляются как рассылка, чтобы не задерживать
+        # ответы другим пользователям; порядок частей в чате сохраняется
+        with send_queue.bulk():
+            for chunk in chunks:
+                await message.answer(chunk, parse_mode="Markdown")
+
 # Callback query handlers
-@dp.callback_query(lambda c: c.data.startswith("vehicle_"))
+@callbacks.prefix("vehicle")
 async def show_vehicle(callback: types.CallbackQuery):
     """Handler for vehicle selection"""
     vehicle_id = int(callback.data.split("_")[1])
     user_id = callback.from_user.id
-    card, keyboard = get_vehicle_card(vehicle_id, user_id)
+    card, keyboard = await get_vehicle_card(vehicle_id, user_id)
 
     await callback.message.edit_text(
         card,
@@ -861,17 +905,178 @@ async def show_vehicle(callback: types.CallbackQuery):
     )
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "back")
+# Сколько записей истории показывать на одной странице "Вся история"
+HISTORY_PAGE_SIZE = 20
+
+@callbacks.prefix("history")
+async def show_history_page(callback: types.CallbackQuery):
+    """Handler for the full TO / repair history, shown page by page"""
+    _, kind, vehicle_id, offset = callback.data.split("_")
+    vehicle_id = int(vehicle_id)
+    offset = int(offset)
+
+    records, has_more = await repo.get_history_page(vehicle_id, kind, offset, HISTORY_PAGE_SIZE)
+
+    if kind == "maintenance":
+        text = "📜 **История ТО:**\n"
+        for record in records:
+            text += f"📅 `{record['date']}` – `{record['mileage']} км` – {record['works']}\n"
+    else:
+        text = "🛠 **Внеплановые ремонты:**\n"
+        for record in records:
+            cost_text = f" – 💰 `{record['cost']} руб.`" if record['cost'] else ""
+            text += f"🔧 `{record['date']}` – `{record['mileage']} км` – {record['description']}{cost_text}\n"
+    if not records:
+        text += "🔹 Больше записей нет\n"
+
+    navigation = []
+    if offset > 0:
+        navigation.append(InlineKeyboardButton(
+            text="⬅ Новее", callback_data=f"history_{kind}_{vehicle_id}_{max(0, offset - HISTORY_PAGE_SIZE)}"
+        ))
+    if has_more:
+        navigation.append(InlineKeyboardButton(
+            text="Старее ➡", callback_data=f"history_{kind}_{vehicle_id}_{offset + HISTORY_PAGE_SIZE}"
+        ))
+
+    keyboard = [navigation] if navigation else []
+    keyboard.append([InlineKeyboardButton(text="🔙 Вернуться к карточке ТС", callback_data=f"vehicle_{vehicle_id}")])
+
+    await callback.message.edit_text(
+        text,
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard),
+        parse_mode="Markdown"
+    )
+    await callback.answer()
+
+# Search handlers
+# Сколько результатов поиска показывать на одной странице
+SEARCH_PAGE_SIZE = 10
+
+# Метка совпадения во фрагменте: заменяется на "*" после экранирования текста
+SEARCH_HIGHLIGHT = "\x01"
+
+SEARCH_ICONS = {"maintenance": "📅 ТО", "repairs": "🔧 Ремонт", "vehicles": "📝 Заметка"}
+
+def escape_markdown(text):
+    """Escape Telegram Markdown control characters in user-entered text"""
+    for char in ("_", "*", "`", "["):
+        text = text.replace(char, "\\" + char)
+    return text
+
+async def send_search_page(message: types.Message, query, offset, edit=False):
+    """Render one page of /search results"""
+    results, has_more, truncated = await repo.search_history(
+        query, offset, SEARCH_PAGE_SIZE, highlight=SEARCH_HIGHLIGHT
+    )
+
+    text = f"🔍 **Поиск:** {escape_markdown(query)}\n\n"
+    for result in results:
+        snippet = escape_markdown(result["snippet"]).replace(SEARCH_HIGHLIGHT, "*")
+        line = f"{SEARCH_ICONS.get(result['kind'], '•')} – {escape_markdown(result['model'])} ({escape_markdown(result['reg_number'])})"
+        if result["date"]:
+            line += f" – `{result['date']}` – `{result['mileage']} км`"
+        text += f"{line}\n{snippet}\n\n"
+    if not results:
+        text += "🔹 Ничего не найдено\n" if offset == 0 else "🔹 Больше результатов нет\n"
+    if truncated:
+        # Старые совпадения не ранжировались - без подсказки выдача выглядела бы полной
+        text += f"ℹ️ Совпадений слишком много, учтены {SEARCH_RANK_WINDOW} самых свежих записей каждого типа. Уточните запрос\n"
+
+    navigation = []
+    if offset > 0:
+        navigation.append(InlineKeyboardButton(
+            text="⬅ Назад", callback_data=f"search_{max(0, offset - SEARCH_PAGE_SIZE)}"
+        ))
+    if has_more:
+        navigation.append(InlineKeyboardButton(
+            text="Далее ➡", callback_data=f"search_{offset + SEARCH_PAGE_SIZE}"
+        ))
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[navigation] if navigation else [])
+
+    if edit:
+        await message.edit_text(text, reply_markup=keyboard, parse_mode="Markdown")
+    else:
+        await message.answer(text, reply_markup=keyboard, parse_mode="Markdown")
+
+@dp.message(Command("search"))
+async def search_command(message: types.Message, state: FSMContext):
+    """Handler for /search - full-text search over the history"""
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        await message.answer("🔍 Введите текст для поиска (например: *колодки*):", parse_mode="Markdown")
+        await state.set_state(SearchState.query)
+        return
+
+    await state.update_data(search_query=parts[1])
+    await send_search_page(message, parts[1], 0)
+
+@dp.message(SearchState.query)
+async def process_search_query(message: types.Message, state: FSMContext):
+    """Search text entered after a bare /search"""
+    await state.set_state(None)
+    await state.update_data(search_query=message.text)
+    await send_search_page(message, message.text, 0)
+
+@callbacks.prefix("search")
+async def search_page(callback: types.CallbackQuery, state: FSMContext):
+    """Handler for search result pagination"""
+    offset = int(callback.data.split("_")[1])
+    query = (await state.get_data()).get("search_query")
+    if not query:
+        await callback.answer("Запрос устарел, выполните /search заново", show_alert=True)
+        return
+
+    await send_search_page(callback.message, query, offset, edit=True)
+    await callback.answer()
+
+@callbacks.exact("back")
 async def back_to_menu(callback: types.CallbackQuery):
     """Handler for back button"""
     await callback.message.edit_text(
         "Выберите автомобиль из списка:",
-        reply_markup=get_vehicle_buttons()
+        reply_markup=await get_vehicle_buttons()
     )
     await callback.answer()
 
+@callbacks.prefix("roster")
+async def show_roster_page(callback: types.CallbackQuery):
+    """Handler for vehicle list pagination"""
+    page = int(callback.data.split("_")[1])
+    try:
+        await callback.message.edit_text(
+            "Выберите автомобиль из списка:",
+            reply_markup=await get_vehicle_buttons(page)
+        )
+    except TelegramAPIError:
+        # Нажата кнопка текущей страницы - сообщение не изменилось
+        pass
+    await callback.answer()
+
+@dp.message(Command("find"))
+async def find_vehicle(message: types.Message):
+    """Handler for /find - vehicle lookup by plate or model prefix"""
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        await message.answer("🔍 Укажите начало госномера или модели, например: /find А123")
+        return
+
+    roster = await repo.get_fleet_roster()
+    vehicles = roster.search(parts[1], limit=ROSTER_PAGE_SIZE + 1)
+    if not vehicles:
+        await message.answer("🔹 Автомобили не найдены", reply_markup=await get_vehicle_buttons())
+        return
+
+    text = f"🔍 Найдено автомобилей: {len(vehicles)}"
+    if len(vehicles) > ROSTER_PAGE_SIZE:
+        text = f"🔍 Показаны первые {ROSTER_PAGE_SIZE} совпадений, уточните запрос"
+    await message.answer(text, reply_markup=get_vehicle_list_keyboard(
+        vehicles[:ROSTER_PAGE_SIZE],
+        extra_rows=[[InlineKeyboardButton(text="⬅ Весь список", callback_data="back")]]
+    ))
+
 # Update mileage handlers
-@dp.callback_query(lambda c: c.data.startswith("update_mileage_"))
+@callbacks.prefix("update_mileage")
 @admin_required
 async def update_mileage_start(callback: types.CallbackQuery, state: FSMContext):
     """Start mileage update process"""
@@ -879,11 +1084,8 @@ async def update_mileage_start(callback: types.CallbackQuery, state: FSMContext)
     await state.update_data(vehicle_id=vehicle_id)
 
     # Get current mileage
-    conn = sqlite3.connect('vehicles.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT mileage FROM vehicles WHERE id = ?", (vehicle_id,))
-    current_mileage = cursor.fetchone()[0]
-    conn.close()
+    vehicle = await repo.get_vehicle(vehicle_id)
+    current_mileage = vehicle['mileage']
 
     await callback.message.edit_text(
         f"📊 **Обновление пробега**\n\n"
@@ -903,10 +1105,8 @@ async def process_mileage_update(message: types.Message, state: FSMContext):
         vehicle_id = data["vehicle_id"]
 
         # Get current mileage
-        conn = sqlite3.connect('vehicles.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT mileage FROM vehicles WHERE id = ?", (vehicle_id,))
-        current_mileage = cursor.fetchone()[0]
+        vehicle = await repo.get_vehicle(vehicle_id)
+        current_mileage = vehicle['mileage']
 
         # Validate new mileage
         if new_mileage <= current_mileage:
@@ -920,12 +1120,9 @@ async def process_mileage_update(message: types.Message, state: FSMContext):
             return
 
         # Update mileage
-        cursor.execute("UPDATE vehicles SET mileage = ? WHERE id = ?", (new_mileage, vehicle_id))
-        conn.commit()
-        conn.close()
+        await repo.update_vehicle_mileage(vehicle_id, new_mileage)
 
         await state.clear()
-        card, keyboard = get_vehicle_card(vehicle_id)
 
         await message.answer(
             f"✅ Пробег успешно обновлен: {new_mileage} км",
@@ -941,7 +1138,7 @@ async def process_mileage_update(message: types.Message, state: FSMContext):
         )
 
 # Maintenance record handlers
-@dp.callback_query(lambda c: c.data.startswith("add_to_"))
+@callbacks.prefix("add_to")
 @admin_required
 async def add_to_start(callback: types.CallbackQuery, state: FSMContext):
     """Start maintenance record addition"""
@@ -987,24 +1184,8 @@ async def process_to_works(message: types.Message, state: FSMContext):
     data = await state.get_data()
     vehicle_id = data["vehicle_id"]
 
-    # Also update vehicle's last_to_date
-    conn = sqlite3.connect('vehicles.db')
-    cursor = conn.cursor()
-
-    # Add maintenance record
-    cursor.execute(
-        "INSERT INTO maintenance (vehicle_id, date, mileage, works) VALUES (?, ?, ?, ?)",
-        (vehicle_id, data["date"], data["mileage"], message.text)
-    )
-
-    # Update vehicle's last_to_date
-    cursor.execute(
-        "UPDATE vehicles SET last_to_date = ? WHERE id = ?",
-        (data["date"], vehicle_id)
-    )
-
-    conn.commit()
-    conn.close()
+    # Add maintenance record and update vehicle's last_to_date
+    await repo.add_maintenance(vehicle_id, data["date"], data["mileage"], message.text, update_last_to_date=True)
 
     await state.clear()
     await message.answer(
@@ -1015,7 +1196,7 @@ async def process_to_works(message: types.Message, state: FSMContext):
     )
 
 # Repair record handlers
-@dp.callback_query(lambda c: c.data.startswith("add_repair_"))
+@callbacks.prefix("add_repair")
 @admin_required
 async def add_repair_start(callback: types.CallbackQuery, state: FSMContext):
     """Start repair record addition"""
@@ -1134,20 +1315,13 @@ async def process_repair_cost(message: types.Message, state: FSMContext):
                 new_cost = int(message.text)
 
             # Update repair record
-            conn = sqlite3.connect('vehicles.db')
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE repairs SET date = ?, mileage = ?, description = ?, cost = ? WHERE id = ?",
-                (
-                    data['new_date'],
-                    data['new_mileage'],
-                    data['new_description'],
-                    new_cost if new_cost > 0 else None,
-                    data['repair_id']
-                )
+            await repo.update_repair(
+                data['repair_id'],
+                data['new_date'],
+                data['new_mileage'],
+                data['new_description'],
+                new_cost if new_cost > 0 else None
             )
-            conn.commit()
-            conn.close()
 
             await state.clear()
             await message.answer(
@@ -1162,14 +1336,7 @@ async def process_repair_cost(message: types.Message, state: FSMContext):
             cost = int(message.text)
             vehicle_id = data["vehicle_id"]
 
-            conn = sqlite3.connect('vehicles.db')
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO repairs (vehicle_id, date, mileage, description, cost) VALUES (?, ?, ?, ?, ?)",
-                (vehicle_id, data["date"], data["mileage"], data["description"], cost if cost > 0 else None)
-            )
-            conn.commit()
-            conn.close()
+            await repo.add_repair(vehicle_id, data["date"], data["mileage"], data["description"], cost if cost > 0 else None)
 
             await state.clear()
             await message.answer(
@@ -1185,7 +1352,7 @@ async def process_repair_cost(message: types.Message, state: FSMContext):
         )
 
 # Edit vehicle handlers
-@dp.callback_query(lambda c: c.data.startswith("edit_") and not c.data.startswith("edit_field_") and not c.data.startswith("edit_repair_") and not c.data.startswith("edit_maintenance_") and not c.data.startswith("edit_fuel_"))
+@callbacks.prefix("edit")
 @admin_required
 async def edit_vehicle_start(callback: types.CallbackQuery, state: FSMContext):
     """Start vehicle editing process"""
@@ -1241,7 +1408,7 @@ async def edit_vehicle_start(callback: types.CallbackQuery, state: FSMContext):
     )
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data.startswith("edit_field_"))
+@callbacks.prefix("edit_field")
 async def select_edit_field(callback: types.CallbackQuery, state: FSMContext):
     """Handler for selecting field to edit"""
     parts = callback.data.split("_")
@@ -1339,14 +1506,7 @@ async def process_edit_value(message: types.Message, state: FSMContext):
             value = int(value)
 
         # Update database
-        conn = sqlite3.connect('vehicles.db')
-        cursor = conn.cursor()
-        cursor.execute(
-            f"UPDATE vehicles SET {selected_field} = ? WHERE id = ?",
-            (value, vehicle_id)
-        )
-        conn.commit()
-        conn.close()
+        await repo.update_vehicle_fields(vehicle_id, {selected_field: value})
 
         await state.clear()
 
@@ -1363,23 +1523,14 @@ async def process_edit_value(message: types.Message, state: FSMContext):
         )
 
 # Maintenance Management Handlers
-@dp.callback_query(lambda c: c.data.startswith("manage_to_"))
+@callbacks.prefix("manage_to")
 @admin_required
 async def manage_maintenance(callback: types.CallbackQuery):
     """Handler for managing maintenance records"""
     vehicle_id = int(callback.data.split("_")[2])
 
     # Get maintenance records
-    conn = sqlite3.connect('vehicles.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, date, mileage, works FROM maintenance
-        WHERE vehicle_id = ?
-        ORDER BY date DESC, mileage DESC
-    """, (vehicle_id,))
-    maintenance_records = cursor.fetchall()
-    conn.close()
+    maintenance_records = await repo.get_maintenance_history(vehicle_id)
 
     # Create keyboard with maintenance records
     keyboard = []
@@ -1417,7 +1568,7 @@ async def manage_maintenance(callback: types.CallbackQuery):
     )
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data.startswith("maintenance_") and not c.data.startswith("maintenance_delete_"))
+@callbacks.prefix("maintenance")
 async def show_maintenance_record(callback: types.CallbackQuery):
     """Handler for showing maintenance record details"""
     # Проверяем формат callback data
@@ -1433,17 +1584,7 @@ async def show_maintenance_record(callback: types.CallbackQuery):
         return
 
     # Get maintenance record
-    conn = sqlite3.connect('vehicles.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT m.id, m.date, m.mileage, m.works, m.vehicle_id, v.model, v.reg_number
-        FROM maintenance m
-        JOIN vehicles v ON m.vehicle_id = v.id
-        WHERE m.id = ?
-    """, (maintenance_id,))
-    record = cursor.fetchone()
-    conn.close()
+    record = await repo.get_maintenance_record(maintenance_id)
 
     if not record:
         await callback.answer("⚠️ Запись не найдена")
@@ -1451,7 +1592,7 @@ async def show_maintenance_record(callback: types.CallbackQuery):
 
     # Check if user is admin
     user_id = callback.from_user.id
-    admin = is_admin(user_id)
+    admin = await is_admin(user_id)
 
     # Create keyboard with actions based on user role
     if admin:
@@ -1476,19 +1617,14 @@ async def show_maintenance_record(callback: types.CallbackQuery):
     )
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data.startswith("edit_maintenance_"))
+@callbacks.prefix("edit_maintenance")
 @admin_required
 async def edit_maintenance_start(callback: types.CallbackQuery, state: FSMContext):
     """Handler for starting maintenance record edit"""
     maintenance_id = int(callback.data.split("_")[2])
 
     # Get maintenance record
-    conn = sqlite3.connect('vehicles.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, date, mileage, works, vehicle_id FROM maintenance WHERE id = ?", (maintenance_id,))
-    record = cursor.fetchone()
-    conn.close()
+    record = await repo.get_maintenance_record(maintenance_id)
 
     if not record:
         await callback.answer("⚠️ Запись не найдена")
@@ -1567,31 +1703,8 @@ async def process_maintenance_edit_works(message: types.Message, state: FSMConte
     else:
         new_works = message.text
 
-    # Update maintenance record
-    conn = sqlite3.connect('vehicles.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE maintenance SET date = ?, mileage = ?, works = ? WHERE id = ?",
-        (data['new_date'], data['new_mileage'], new_works, data['maintenance_id'])
-    )
-
-    # If this is the most recent maintenance, update vehicle's last_to_date
-    cursor.execute("""
-        SELECT id FROM maintenance
-        WHERE vehicle_id = ?
-        ORDER BY date DESC, mileage DESC
-        LIMIT 1
-    """, (data['vehicle_id'],))
-    latest_maintenance = cursor.fetchone()
-
-    if latest_maintenance and latest_maintenance[0] == data['maintenance_id']:
-        cursor.execute(
-            "UPDATE vehicles SET last_to_date = ? WHERE id = ?",
-            (data['new_date'], data['vehicle_id'])
-        )
-
-    conn.commit()
-    conn.close()
+    # Update maintenance record (and vehicle's last_to_date if it is the most recent one)
+    await repo.update_maintenance(data['maintenance_id'], data['new_date'], data['new_mileage'], new_works)
 
     await state.clear()
 
@@ -1604,7 +1717,7 @@ async def process_maintenance_edit_works(message: types.Message, state: FSMConte
     )
 
 
-@dp.callback_query(lambda c: c.data.startswith("delete_maintenance_"))
+@callbacks.prefix("delete_maintenance")
 @admin_required
 async def delete_maintenance_confirm(callback: types.CallbackQuery, state: FSMContext):
     """Handler for confirming maintenance record deletion"""
@@ -1623,12 +1736,7 @@ async def delete_maintenance_confirm(callback: types.CallbackQuery, state: FSMCo
         await state.clear()
 
         # Получаем данные о записи ТО
-        conn = sqlite3.connect('vehicles.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT date, mileage, vehicle_id FROM maintenance WHERE id = ?", (maintenance_id,))
-        record = cursor.fetchone()
-        conn.close()
+        record = await repo.get_maintenance_record(maintenance_id)
 
         if not record:
             await callback.answer("⚠️ Запись о ТО не найдена", show_alert=True)
@@ -1656,7 +1764,7 @@ async def delete_maintenance_confirm(callback: types.CallbackQuery, state: FSMCo
         logging.error(f"Ошибка при подготовке удаления записи ТО: {e}")
         await callback.answer("⚠️ Произошла ошибка", show_alert=True)
 
-@dp.callback_query(lambda c: c.data.startswith("maintenance_delete_confirm_"))
+@callbacks.prefix("maintenance_delete_confirm")
 @admin_required
 async def maintenance_delete_execute(callback: types.CallbackQuery, state: FSMContext):
     """Handler for executing maintenance record deletion"""
@@ -1665,24 +1773,13 @@ async def maintenance_delete_execute(callback: types.CallbackQuery, state: FSMCo
         maintenance_id = int(callback.data.split("_")[3])
         logging.info(f"Выполнение удаления записи ТО с ID={maintenance_id}")
 
-        # Получаем ID транспортного средства
-        conn = sqlite3.connect('vehicles.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT vehicle_id FROM maintenance WHERE id = ?", (maintenance_id,))
-        result = cursor.fetchone()
+        # Удаляем запись и получаем ID транспортного средства
+        vehicle_id = await repo.delete_maintenance(maintenance_id)
 
-        if not result:
+        if vehicle_id is None:
             await callback.answer("⚠️ Запись уже удалена", show_alert=True)
-            conn.close()
             return
 
-        vehicle_id = result[0]
-
-        # Удаляем запись
-        cursor.execute("DELETE FROM maintenance WHERE id = ?", (maintenance_id,))
-        conn.commit()
-        conn.close()
-
         await callback.message.edit_text(
             "✅ Запись о техническом обслуживании успешно удалена!",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
@@ -1706,23 +1803,14 @@ async def maintenance_delete_execute(callback: types.CallbackQuery, state: FSMCo
 
 
 # Repair Management Handlers
-@dp.callback_query(lambda c: c.data.startswith("manage_repairs_"))
+@callbacks.prefix("manage_repairs")
 @admin_required
 async def manage_repairs(callback: types.CallbackQuery):
     """Handler for managing repair records"""
     vehicle_id = int(callback.data.split("_")[2])
 
     # Get repair records
-    conn = sqlite3.connect('vehicles.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, date, mileage, description, cost FROM repairs
-        WHERE vehicle_id = ?
-        ORDER BY date DESC, mileage DESC
-    """, (vehicle_id,))
-    repair_records = cursor.fetchall()
-    conn.close()
+    repair_records = await repo.get_repairs(vehicle_id)
 
     # Create keyboard with repair records
     keyboard = []
@@ -1761,12 +1849,12 @@ async def manage_repairs(callback: types.CallbackQuery):
     )
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "no_action")
+@callbacks.exact("no_action")
 async def no_action(callback: types.CallbackQuery):
     """Handler for empty action"""
     await callback.answer("Нет доступных записей")
 
-@dp.callback_query(lambda c: c.data.startswith("repair_") and not c.data.startswith("repair_delete"))
+@callbacks.prefix("repair")
 async def show_repair_record(callback: types.CallbackQuery):
     try:
         # Формат строки: repair_ID
@@ -1778,17 +1866,7 @@ async def show_repair_record(callback: types.CallbackQuery):
         logging.info(f"Запрос на просмотр записи ремонта с ID={repair_id}")
 
         # Get repair record
-        conn = sqlite3.connect('vehicles.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT r.id, r.date, r.mileage, r.description, r.cost, r.vehicle_id, v.model, v.reg_number
-            FROM repairs r
-            JOIN vehicles v ON r.vehicle_id = v.id
-            WHERE r.id = ?
-        """, (repair_id,))
-        record = cursor.fetchone()
-        conn.close()
+        record = await repo.get_repair_record(repair_id)
 
         if not record:
             await callback.answer("⚠️ Запись не найдена")
@@ -1799,7 +1877,7 @@ async def show_repair_record(callback: types.CallbackQuery):
 
         # Check if user is admin
         user_id = callback.from_user.id
-        admin = is_admin(user_id)
+        admin = await is_admin(user_id)
 
         # Create keyboard with actions based on user role
         if admin:
@@ -1828,7 +1906,7 @@ async def show_repair_record(callback: types.CallbackQuery):
         logging.error(f"Ошибка при отображении записи ремонта: {e}")
         await callback.answer("⚠️ Произошла ошибка при загрузке данных", show_alert=True)
 
-@dp.callback_query(lambda c: c.data.startswith("edit_repair_"))
+@callbacks.prefix("edit_repair")
 @admin_required
 async def edit_repair_start(callback: types.CallbackQuery, state: FSMContext):
     """Handler for starting repair record edit"""
@@ -1837,12 +1915,7 @@ async def edit_repair_start(callback: types.CallbackQuery, state: FSMContext):
     repair_id = int(callback_parts[-1])  # Берем последний элемент как ID
 
     # Get repair record
-    conn = sqlite3.connect('vehicles.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, date, mileage, description, cost, vehicle_id FROM repairs WHERE id = ?", (repair_id,))
-    record = cursor.fetchone()
-    conn.close()
+    record = await repo.get_repair_record(repair_id)
 
     if not record:
         await callback.answer("⚠️ Запись не найдена")
@@ -1868,7 +1941,7 @@ async def edit_repair_start(callback: types.CallbackQuery, state: FSMContext):
     await state.set_state(RepairState.date)
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data.startswith("delete_repair_"))
+@callbacks.prefix("delete_repair")
 @admin_required
 async def delete_repair_confirm(callback: types.CallbackQuery, state: FSMContext):
     """Handler for confirming repair record deletion"""
@@ -1880,12 +1953,7 @@ async def delete_repair_confirm(callback: types.CallbackQuery, state: FSMContext
         logging.info(f"Запрос на удаление записи ремонта с ID={repair_id}")
 
         # Получаем данные о записи ремонта
-        conn = sqlite3.connect('vehicles.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT date, mileage, vehicle_id FROM repairs WHERE id = ?", (repair_id,))
-        record = cursor.fetchone()
-        conn.close()
+        record = await repo.get_repair_record(repair_id)
 
         if not record:
             await callback.answer("⚠️ Запись о ремонте не найдена", show_alert=True)
@@ -1913,50 +1981,37 @@ async def delete_repair_confirm(callback: types.CallbackQuery, state: FSMContext
         logging.error(f"Ошибка при подготовке удаления записи ремонта: {e}")
         await callback.answer("⚠️ Произошла ошибка", show_alert=True)
 
-@dp.callback_query(lambda c: c.data.startswith("repair_delete_confirm_"))
+@callbacks.prefix("repair_delete_confirm")
 @admin_required
 async def repair_delete_execute(callback: types.CallbackQuery, state: FSMContext):
     """Handler for executing repair record deletion"""
     user_id = callback.from_user.id
 
-    # Проверяем наличие пользователя в базе данных
-    conn = None
+    vehicle_id = 0
     try:
-        conn = sqlite3.connect('vehicles.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE id = ?", (user_id,))
-        user_exists = cursor.fetchone()
+        # Получаем ID записи ремонта из callback data
+        # Формат строки: repair_delete_confirm_ID
+        callback_parts = callback.data.split("_")
+        repair_id = int(callback_parts[-1])  # Берем последний элемент как ID
+
+        # Проверяем наличие пользователя в базе данных и получаем ID транспортного средства
+        user_exists, result = await asyncio.gather(repo.get_user(user_id), repo.get_repair_record(repair_id))
 
         if not user_exists:
             logging.warning(f"Пользователь с ID {user_id} не найден в базе данных при попытке удалить ремонт")
             await callback.answer("⚠️ Ошибка: Пользователь с ID {} не найден. Попросите его выполнить команду /start или /myid.".format(user_id), show_alert=True)
-            if conn:
-                conn.close()
             return
 
-        # Получаем ID записи ремонта из callback data
-        # Формат строки: repair_delete_confirm_ID
-        callback_parts = callback.data.split("_")
-        repair_id = int(callback_parts[-1])  # Берем последний элемент как ID
         logging.info(f"Выполнение удаления записи ремонта с ID={repair_id}")
 
-        # Получаем ID транспортного средства
-        cursor.execute("SELECT vehicle_id FROM repairs WHERE id = ?", (repair_id,))
-        result = cursor.fetchone()
-
         if not result:
             await callback.answer("⚠️ Запись уже удалена", show_alert=True)
-            conn.close()
             return
 
-        vehicle_id = result[0]
-
-        # Закрываем соединение перед вызовом функции delete_repair
-        conn.close()
-        conn = None
+        vehicle_id = result['vehicle_id']
 
         # Удаляем запись с использованием функции delete_repair
-        success = delete_repair(repair_id)
+        success = await repo.delete_repair(repair_id)
 
         if not success:
             await callback.answer("⚠️ Произошла ошибка при удалении записи о ремонте", show_alert=True)
@@ -1973,19 +2028,6 @@ async def repair_delete_execute(callback: types.CallbackQuery, state: FSMContext
         logging.info(f"Запись ремонта с ID={repair_id} для ТС ID={vehicle_id} успешно удалена")
     except Exception as e:
         logging.error(f"Ошибка при удалении записи ремонта: {e}")
-        vehicle_id = 0
-        try:
-            # Попытка получить ID автомобиля в случае ошибки
-            if conn:
-                cursor = conn.cursor()
-                callback_parts = callback.data.split("_")
-                repair_id = int(callback_parts[-1])  # Берем последний элемент как ID
-                cursor.execute("SELECT vehicle_id FROM repairs WHERE id = ?", (repair_id,))
-                result = cursor.fetchone()
-                if result:
-                    vehicle_id = result[0]
-        except:
-            pass
 
         # Формируем кнопки для возврата
         back_buttons = []
@@ -2000,16 +2042,12 @@ async def repair_delete_execute(callback: types.CallbackQuery, state: FSMContext
             reply_markup=InlineKeyboardMarkup(inline_keyboard=back_buttons)
         )
     finally:
-        # Закрываем соединение с БД
-        if conn:
-            conn.close()
-
         # Очищаем состояние и отвечаем на callback
         await state.clear()
         await callback.answer()
 
 # Fuel information handling
-@dp.callback_query(lambda c: c.data.startswith("edit_fuel_"))
+@callbacks.prefix("edit_fuel")
 @admin_required
 async def edit_fuel_start(callback: types.CallbackQuery, state: FSMContext):
     """Start fuel information editing process"""
@@ -2018,16 +2056,7 @@ async def edit_fuel_start(callback: types.CallbackQuery, state: FSMContext):
     await state.update_data(vehicle_id=vehicle_id)
 
     # Get current fuel information
-    conn = sqlite3.connect('vehicles.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT fuel_type, fuel_tank_capacity, avg_fuel_consumption
-        FROM vehicles
-        WHERE id = ?
-    """, (vehicle_id,))
-    fuel_data = cursor.fetchone()
-    conn.close()
+    fuel_data = await repo.get_vehicle(vehicle_id)
 
     # Create a message with the current values
     message_text = (
@@ -2094,7 +2123,8 @@ async def process_fuel_consumption(message: types.Message, state: FSMContext):
             return
 
     # Update fuel information in the database
-    success = edit_fuel_info(
+    success = await repo.run(
+        edit_fuel_info,
         vehicle_id=vehicle_id,
         fuel_type=data.get("fuel_type"),
         fuel_tank_capacity=data.get("fuel_tank_capacity"),
@@ -2118,32 +2148,29 @@ async def process_fuel_consumption(message: types.Message, state: FSMContext):
         )
 
 # Report generation handler
-@dp.callback_query(lambda c: c.data == "generate_report")
+@callbacks.exact("generate_report")
 @admin_required
 async def generate_pdf_report(callback: types.CallbackQuery):
     """Generate and send PDF report"""
+    await callback.answer("⏳ Отчет формируется...")
+    status = await callback.message.answer("⏳ Формирую отчет о сроках документов, это может занять некоторое время...")
     try:
-        # Generate the report
-        report_path = utils.generate_expiration_report()
+        # Отчет строится в отдельном процессе; пока он готовится, чат показывает
+        # "отправляет файл", а бот продолжает отвечать остальным
+        async with ChatActionSender.upload_document(bot=callback.bot, chat_id=callback.message.chat.id):
+            pdf = await report_pool.expiration_report()
 
-        # Send the report
-        with open(report_path, 'rb') as pdf:
             await callback.message.answer_document(
                 types.BufferedInputFile(
-                    pdf.read(),
+                    pdf,
                     filename=f"report_{datetime.datetime.now().strftime('%Y%m%d')}.pdf"
                 ),
                 caption="📊 Отчет о сроках действия документов для всех транспортных средств"
             )
-
-        # Cleanup the file
-        os.remove(report_path)
-
-        await callback.answer("✅ Отчет успешно сгенерирован!")
+        await status.edit_text("✅ Отчет успешно сгенерирован!")
     except Exception as e:
         logging.error(f"Error generating report: {e}")
-        await callback.message.answer(f"❌ Ошибка при генерации отчета: {str(e)}")
-        await callback.answer("❌ Ошибка при генерации отчета")
+        await status.edit_text(f"❌ Ошибка при генерации отчета: {str(e)}", parse_mode=None)
 
 # Обработчик команды резервного копирования
 @dp.message(Command("backup"))
@@ -2163,18 +2190,80 @@ async def backup_command(message: types.Message):
     else:
         await message.answer("❌ Ошибка при создании резервной копии!")
 
+# Больше этого размера бот не может отправить документ (ограничение Bot API)
+EXPORT_DOCUMENT_LIMIT = 50 * 2**20
+
+# Выгрузка таблиц: /export [таблица] [формат]
+@dp.message(Command("export"))
+@admin_required
+async def export_command(message: types.Message):
+    """Handler for /export - streams a table to a file and sends it as a document"""
+    parts = message.text.split()[1:]
+    table = parts[0].lower() if parts else "vehicles"
+    fmt = parts[1].lower() if len(parts) > 1 else "xlsx"
+
+    if table not in export.EXPORT_TABLES or fmt not in export.EXPORT_FORMATS:
+        tables = "\n".join(f"`{name}` - {title}" for name, (title, _) in export.EXPORT_TABLES.items())
+        await message.answer(
+            "📤 **Выгрузка данных:** `/export [таблица] [формат]`\n\n"
+            f"Таблицы:\n{tables}\n\n"
+            f"Форматы: {', '.join(f'`{name}`' for name in export.EXPORT_FORMATS)}\n"
+            "Например: `/export maintenance csv`",
+            parse_mode="Markdown"
+        )
+        return
+
+    status = await message.answer(f"⏳ Выгружаю «{export.EXPORT_TABLES[table][0]}» в {fmt.upper()}...")
+    path = None
+    try:
+        async with ChatActionSender.upload_document(bot=message.bot, chat_id=message.chat.id):
+            # Строки идут из базы в файл порциями, поэтому память не зависит от размера таблицы
+            path, size = await repo.run_heavy(export.export_to_file, table, fmt)
+            if size > EXPORT_DOCUMENT_LIMIT:
+                await status.edit_text(
+                    f"❌ Файл слишком большой для Telegram ({size / 2**20:.1f} МБ). "
+                    f"Скачайте его через веб-интерфейс: /api/export/{table}.{fmt}",
+                    parse_mode=None
+                )
+                return
+            await message.answer_document(
+                types.FSInputFile(path, filename=export.export_filename(table, fmt)),
+                caption=f"📤 {export.EXPORT_TABLES[table][0]} ({fmt.upper()})"
+            )
+        await status.edit_text("✅ Выгрузка готова!")
+    except Exception as e:
+        logging.error(f"Error exporting {table} to {fmt}: {e}")
+        await status.edit_text(f"❌ Ошибка при выгрузке: {str(e)}", parse_mode=None)
+    finally:
+        if path:
+            os.remove(path)
+
 # Main function to run the bot
 async def main():
     # Initialize database
     init_database()
 
+    # Загружаем администраторов в кэш, чтобы первые проверки не шли в базу
+    admin_cache.warm(await repo.get_admin_ids())
+    # Загружаем сохраненные диалоги один раз, до первого обновления
+    await storage.load()
+
     # Запуск планировщика резервного копирования в отдельной задаче
-    try:
-        from backup import scheduled_backup
-        asyncio.create_task(scheduled_backup(hour=3, minute=0))
-        logging.info("Планировщик резервного копирования запущен")
-    except Exception as e:
-        logging.error(f"Ошибка при запуске планировщика резервного копирования: {e}")
+    # (при нескольких процессах webhook - только в первом)
+    if os.environ.get("RUN_SCHEDULERS", "1") == "1":
+        try:
+            from backup import scheduled_backup
+            asyncio.create_task(scheduled_backup(hour=3, minute=0))
+            logging.info("Планировщик резервного копирования запущен")
+        except Exception as e:
+            logging.error(f"Ошибка при запуске планировщика резервного копирования: {e}")
+
+    # Режим webhook: обновления приходят на aiohttp-сервер (см. webhook.py)
+    if os.environ.get("BOT_MODE", "polling") == "webhook":
+        from webhook import run_webhook
+        logging.info("Starting vehicle maintenance bot (webhook)...")
+        await run_webhook(dp, bot, register=os.environ.get("WEBHOOK_REGISTER", "1") == "1")
+        return
 
     # Reset webhook before starting polling to avoid conflicts
     await bot.delete_webhook(drop_pending_updates=True)
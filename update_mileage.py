@@ -1,29 +1,21 @@
-import sqlite3
 import logging
+import db_pool
+from db_migrations import apply_migrations
 
 logging.basicConfig(level=logging.INFO)
 
 def update_mileage():
     """
-    Ensure the vehicles table has a mileage column and update specific mileage values
+    Set default mileage values by vehicle type
     """
     try:
-        # Connect to the database
+        # The mileage column itself is added by migration 2 (db_migrations.py)
+        apply_migrations()
+        
         logging.info("Connecting to database...")
-        conn = sqlite3.connect('vehicles.db')
+        conn = db_pool.create_connection()
         cursor = conn.cursor()
         
-        # Check if mileage column exists
-        cursor.execute('PRAGMA table_info(vehicles)')
-        columns = [col[1] for col in cursor.fetchall()]
-        
-        if 'mileage' not in columns:
-            logging.info("Adding mileage column to vehicles table...")
-            cursor.execute('ALTER TABLE vehicles ADD COLUMN mileage INTEGER DEFAULT 0')
-            logging.info("Mileage column added.")
-        else:
-            logging.info("Mileage column already exists.")
-        
         # Get all vehicles
         cursor.execute("SELECT id, vin, model, reg_number FROM vehicles")
         vehicles = cursor.fetchall()
@@ -0,0 +1,156 @@
+import os
+import time
+import asyncio
+from collections import deque
+
+from aiogram import BaseMiddleware
+
+# Сколько обработчиков выполняется одновременно (в разных чатах)
+UPDATE_MAX_CONCURRENCY = int(os.environ.get("UPDATE_MAX_CONCURRENCY", "16"))
+
+# По скольким последним обновлениям считается время ожидания
+UPDATE_WAIT_SAMPLES = int(os.environ.get("UPDATE_WAIT_SAMPLES", "1000"))
+
+
+class _ChatSlot:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class UpdateScheduler(BaseMiddleware):
+    """
+    Outer update middleware: concurrent across chats, ordered within a chat
+
+    aiogram starts a task per update (polling with handle_as_tasks, and the
+    webhook server), so without this middleware two updates of one chat can
+    run at the same time and an FSM dialog can see them out of order. Here
+    each update first takes its chat's lock (asyncio.Lock is FIFO, and the
+    lock is taken before the first await, so updates keep their arrival
+    order), then one of max_concurrency slots. A slow handler (a PDF
+    report, a backup) holds only its own chat and one slot.
+
+    Register it before the other outer middlewares:
+
+        dp.update.outer_middleware(update_scheduler)
+    """
+
+    def __init__(self, max_concurrency=UPDATE_MAX_CONCURRENCY, wait_samples=UPDATE_WAIT_SAMPLES):
+        self.max_concurrency = max_concurrency
+        self.processed = 0
+        self.running = 0
+        self.waiting = 0
+        self.max_chat_depth = 0
+
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._chats = {}  # chat_id -> _ChatSlot
+        self._waits = deque(maxlen=wait_samples)
+
+    @staticmethod
+    def _chat_key(data):
+        chat = data.get("event_chat")
+        if chat is not None:
+            return chat.id
+        user = data.get("event_from_user")
+        return ("user", user.id) if user is not None else None
+
+    async def __call__(self, handler, event, data):
+        queued_at = time.monotonic()
+        key = self._chat_key(data)
+        slot = None
+        if key is not None:
+            slot = self._chats.get(key)
+            if slot is None:
+                slot = self._chats[key] = _ChatSlot()
+            slot.users += 1
+            self.max_chat_depth = max(self.max_chat_depth, slot.users)
+
+        self.waiting += 1
+        started = False
+        try:
+            if slot is not None:
+                await slot.lock.acquire()
+            try:
+                async with self._slots:
+                    started = True
+                    self.waiting -= 1
+                    self.running += 1
+                    self._waits.append(time.monotonic() - queued_at)
+                    try:
+                        return await handler(event, data)
+                    finally:
+                        self.running -= 1
+                        self.processed += 1
+            finally:
+                if slot is not None:
+                    slot.lock.release()
+        finally:
+            if not started:
+                # Отмена во время ожидания: обработчик так и не запустился
+                self.waiting -= 1
+            if slot is not None:
+                slot.users -= 1
+                if slot.users == 0:
+                    del self._chats[key]
+
+    def stats(self):
+        """
+        Get scheduler metrics
+
+        Returns:
+            dict: processed, running, waiting (queue depth), active_chats,
+            max_chat_depth and wait times in ms (avg, p95, max) over the
+            last UPDATE_WAIT_SAMPLES updates
+        """
+        waits = sorted(self._waits)
+        return {
+            "processed": self.processed,
+            "running": self.running,
+            "waiting": self.waiting,
+            "active_chats": len(self._chats),
+            "max_chat_depth": self.max_chat_depth,
+            "wait_avg_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            "wait_p95_ms": round(waits[int(len(waits) * 0.95)] * 1000, 1) if waits else 0.0,
+            "wait_max_ms": round(waits[-1] * 1000, 1) if waits else 0.0,
+        }
+
+
+# Общий планировщик для процесса
+update_scheduler = UpdateScheduler()
+
+
+if __name__ == "__main__":
+    # Пропускная способность и порядок в зависимости от числа чатов:
+    # python update_scheduler.py [обновлений на чат] [время обработчика, мс]
+    import sys
+    import random
+    from types import SimpleNamespace
+
+    per_chat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    handler_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    async def measure(chats):
+        scheduler = UpdateScheduler()
+        seen = {}
+
+        async def handler(event, data):
+            # Случайная длительность, чтобы неупорядоченная обработка проявилась
+            await asyncio.sleep(handler_ms / 1000 * random.uniform(0.5, 1.5))
+            seen.setdefault(event[0], []).append(event[1])
+
+        updates = [(chat, index) for index in range(per_chat) for chat in range(chats)]
+        started = time.monotonic()
+        # Как в aiogram: отдельная задача на каждое обновление
+        await asyncio.gather(*(
+            scheduler(handler, update, {"event_chat": SimpleNamespace(id=update[0])}) for update in updates
+        ))
+        elapsed = time.monotonic() - started
+        ordered = all(indexes == sorted(indexes) for indexes in seen.values())
+        return len(updates) / elapsed, ordered, scheduler.stats()
+
+    print(f"{'chats':>6} {'updates/s':>10} {'ordered':>8} {'wait p95, ms':>13}")
+    for chats in (1, 2, 4, 8, 16, 32, 64):
+        rate, ordered, stats = asyncio.run(measure(chats))
+        print(f"{chats:>6} {rate:>10.1f} {str(ordered):>8} {stats['wait_p95_ms']:>13.1f}")
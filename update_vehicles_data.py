@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import sqlite3
+import db_pool
+from db_migrations import apply_migrations
 
 # Данные из документа
 vehicle_data = [
@@ -21,7 +22,8 @@ vehicle_data = [
 ]
 
 def update_vehicle_data():
-    conn = sqlite3.connect('vehicles.db')
+    apply_migrations()
+    conn = db_pool.create_connection()
     cursor = conn.cursor()
     
     # Получаем список всех автомобилей с их ID и госномерами
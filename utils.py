@@ -1,10 +1,8 @@
 import datetime
-import os
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-import sqlite3
+import db_pool
+import db_writer
+import fleet_expiry
+from db_cache import data_versions
 
 def parse_date(date_str):
     """
@@ -51,14 +49,15 @@ def format_days_remaining(days):
     Returns:
         str: Formatted string with emoji and days count
     """
-    if days is None:
+    status = fleet_expiry.document_status(days)
+    if status == fleet_expiry.UNKNOWN:
         return "❓ Не задано"
 
-    if days < 0:
+    if status == fleet_expiry.EXPIRED:
         return f"🚫 Просрочено ({-days} дн.)"
-    elif days <= 7:
+    elif status == fleet_expiry.CRITICAL:
         return f"⚠️ Критически ({days} дн.)"
-    elif days <= 30:
+    elif status == fleet_expiry.SOON:
         return f"⚠️ Скоро ({days} дн.)"
     else:
         return f"✅ {days} дн."
@@ -96,9 +95,6 @@ def edit_fuel_info(vehicle_id, fuel_type=None, fuel_tank_capacity=None, avg_fuel
     Returns:
         bool: True if updated successfully
     """
-    conn = sqlite3.connect('vehicles.db')
-    cursor = conn.cursor()
-
     # Create SET clause parts based on provided values
     updates = []
     params = []
@@ -116,25 +112,26 @@ def edit_fuel_info(vehicle_id, fuel_type=None, fuel_tank_capacity=None, avg_fuel
         params.append(avg_fuel_consumption)
 
     if not updates:  # No fields to update
-        conn.close()
         return False
 
     # Add vehicle_id to params
     params.append(vehicle_id)
 
     # Execute the update
-    try:
-        cursor.execute(
+    def write(conn):
+        conn.execute(
             f"UPDATE vehicles SET {', '.join(updates)} WHERE id = ?",
             params
         )
-        conn.commit()
-        conn.close()
         return True
+
+    try:
+        return db_writer.execute(write)
     except Exception as e:
-        conn.close()
         print(f"Error updating fuel info: {e}")
         return False
+    finally:
+        data_versions.bump(vehicle_id)
 
 def generate_expiration_report():
     """
@@ -143,200 +140,91 @@ def generate_expiration_report():
     Returns:
         str: Path to the generated PDF file
     """
-    import logging  # Добавим логирование для диагностики
+    filename = f"report_{datetime.datetime.now().strftime('%Y%m%d')}.pdf"
+    with open(filename, 'wb') as f:
+        f.write(build_expiration_report())
+    return filename
+
+def _expiration_batches(conn):
+    """
+    Stream the vehicles of the expiration report from the database
 
-    # Get today's date
-    today = datetime.datetime.now()
-    filename = f"report_{today.strftime('%Y%m%d')}.pdf"
+    Args:
+        conn (sqlite3.Connection): Open connection
 
-    # Connect to the database
-    conn = sqlite3.connect('vehicles.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    Yields:
+        list: Batches of vehicle rows (REPORT_FETCH_SIZE) with the ISO
+        copies of the document dates, by model
+    """
+    from report_render import REPORT_FETCH_SIZE
 
-    # Get all vehicles with their expiration dates
-    cursor.execute("""
-        SELECT id, model, reg_number, osago_valid, tech_inspection_valid,
-               skzi_valid_date, mileage, tachograph_required, next_to
+    cursor = conn.execute("""
+        SELECT id, model, reg_number, osago_valid_iso, tech_inspection_valid_iso,
+               skzi_valid_date_iso, mileage, tachograph_required, next_to
         FROM vehicles
-        ORDER BY model
+        ORDER BY model, id
     """)
-    vehicles = cursor.fetchall()
 
-    # Register appropriate fonts with Cyrillic support
-    from reportlab.pdfbase import pdfmetrics
-    from reportlab.pdfbase.ttfonts import TTFont
+    # Строки читаются порциями по мере заполнения страниц отчета
+    while True:
+        batch = cursor.fetchmany(REPORT_FETCH_SIZE)
+        if not batch:
+            return
+        yield batch
+
+def expiration_report_digest():
+    """
+    Hash the data of today's expiration report without building it
+
+    Returns:
+        str: Key of the report in report_cache
+    """
+    from report_cache import RowDigest
 
-    # Локальные пути к шрифтам (нужно положить файлы в директорию проекта)
-    font_regular = 'DejaVuSans.ttf'
-    font_bold = 'DejaVuSans-Bold.ttf'
+    digest = RowDigest("expiration", datetime.date.today())
+    with db_pool.connection() as conn:
+        for batch in _expiration_batches(conn):
+            for row in batch:
+                digest.update(row)
+    return digest.hexdigest()
 
-    # Попробуем зарегистрировать шрифты
-    cyrillic_font = 'Helvetica'  # Запасной шрифт по умолчанию
-    cyrillic_font_bold = 'Helvetica-Bold'
+def build_expiration_report(cache=False):
+    """
+    Build the document expiration report in memory
 
-    try:
-        if os.path.exists(font_regular) and os.path.exists(font_bold):
-            pdfmetrics.registerFont(TTFont('CustomFont', font_regular))
-            pdfmetrics.registerFont(TTFont('CustomFontBold', font_bold))
-            cyrillic_font = 'CustomFont'
-            cyrillic_font_bold = 'CustomFontBold'
-            logging.info("Используются локальные шрифты DejaVuSans")
-        else:
-            # Попробуем системные пути
-            system_font = '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
-            system_font_bold = '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf'
-            if os.path.exists(system_font) and os.path.exists(system_font_bold):
-                pdfmetrics.registerFont(TTFont('CustomFont', system_font))
-                pdfmetrics.registerFont(TTFont('CustomFontBold', system_font_bold))
-                cyrillic_font = 'CustomFont'
-                cyrillic_font_bold = 'CustomFontBold'
-                logging.info("Используются системные шрифты DejaVuSans")
-            else:
-                logging.warning("Шрифты DejaVuSans не найдены, используется Helvetica (без полной поддержки кириллицы)")
-    except Exception as e:
-        logging.error(f"Ошибка при регистрации шрифтов: {e}")
-        logging.info("Падение на встроенные шрифты Helvetica")
-
-    # Create the PDF document
-    doc = SimpleDocTemplate(filename, pagesize=A4)
-    styles = getSampleStyleSheet()
-
-    # Create custom styles for Cyrillic text
-    cyrillic_normal = ParagraphStyle(
-        'CyrillicNormal',
-        parent=styles['Normal'],
-        fontName=cyrillic_font,
-        fontSize=10,
-        leading=14,
-        encoding='utf-8',
-        alignment=1
-    )
-
-    cyrillic_title = ParagraphStyle(
-        'CyrillicTitle',
-        parent=styles['Heading1'],
-        fontName=cyrillic_font_bold,
-        fontSize=16,
-        leading=20,
-        alignment=1,
-        spaceAfter=20,
-        encoding='utf-8'
-    )
-
-    # Add title and date
-    elements = []
-    title_text = "Отчет об истечении сроков документов"
-    date_text = f"Дата создания: {today.strftime('%d.%m.%Y')}"
-
-    elements.append(Paragraph(title_text, cyrillic_title))
-    elements.append(Paragraph(date_text, cyrillic_normal))
-    elements.append(Spacer(1, 20))
-
-    # Create data for the table
-    headers = ["Транспортное средство", "ОСАГО", "Техосмотр", "СКЗИ", "ТО"]
-    data = [headers]
-
-    for vehicle in vehicles:
-        osago_days = days_until(vehicle['osago_valid'])
-        tech_days = days_until(vehicle['tech_inspection_valid'])
-        skzi_days = days_until(vehicle['skzi_valid_date']) if vehicle['tachograph_required'] else None
-
-        if vehicle['next_to']:
-            remaining_to = vehicle['next_to'] - vehicle['mileage']
-            if remaining_to <= 0:
-                to_status = f"Просрочено ({-remaining_to} км)"
-            elif remaining_to <= 500:
-                to_status = f"Критически ({remaining_to} км)"
-            elif remaining_to <= 1000:
-                to_status = f"Скоро ({remaining_to} км)"
-            else:
-                to_status = f"{remaining_to} км"
-        else:
-            to_status = "Не задано"
-
-        vehicle_text = f"{vehicle['model']} ({vehicle['reg_number']})"
-
-        if osago_days is not None and osago_days < 0:
-            osago_text = f"-{-osago_days} дн."
-        else:
-            osago_text = format_days_remaining(osago_days).replace("⚠️", "!").replace("✅", "+").replace("🚫", "X").replace("❓", "?").replace("Просрочено", "-").replace("Критически", "!")
-
-        if tech_days is not None and tech_days < 0:
-            tech_text = f"-{-tech_days} дн."
-        else:
-            tech_text = format_days_remaining(tech_days).replace("⚠️", "!").replace("✅", "+").replace("🚫", "X").replace("❓", "?").replace("Просрочено", "-").replace("Критически", "!")
-
-        if vehicle['tachograph_required']:
-            if skzi_days is not None and skzi_days < 0:
-                skzi_text = f"-{-skzi_days} дн."
-            else:
-                skzi_text = format_days_remaining(skzi_days).replace("⚠️", "!").replace("✅", "+").replace("🚫", "X").replace("❓", "?").replace("Просрочено", "-").replace("Критически", "!")
-        else:
-            skzi_text = "Не требуется"
-
-        if vehicle['next_to']:
-            remaining_to = vehicle['next_to'] - vehicle['mileage']
-            if remaining_to <= 0:
-                to_status = f"-{-remaining_to} км"
-            elif remaining_to <= 500:
-                to_status = f"!{remaining_to} км"
-            elif remaining_to <= 1000:
-                to_status = f"!{remaining_to} км"
-            else:
-                to_status = f"{remaining_to} км"
-        else:
-            to_status = "Не задано"
-
-        row = [vehicle_text, osago_text, tech_text, skzi_text, to_status]
-        data.append(row)
-
-    # Create table
-    table = Table(data, colWidths=[170, 90, 90, 90, 90])
-
-    table_style = TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-        ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), cyrillic_font_bold),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-        ('TOPPADDING', (0, 0), (-1, 0), 8),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-        ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-        ('FONTNAME', (0, 1), (-1, -1), cyrillic_font),
-        ('FONTSIZE', (0, 1), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 1), (-1, -1), 6),
-        ('TOPPADDING', (0, 1), (-1, -1), 6),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-        ('BOX', (0, 0), (-1, -1), 1, colors.black),
-        ('LINEBELOW', (0, 0), (-1, 0), 1, colors.black),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('ALIGN', (1, 1), (-1, -1), 'CENTER'),
-        ('ALIGN', (0, 1), (0, -1), 'LEFT'),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.whitesmoke, colors.white]),
-    ])
-
-    for i in range(1, len(data)):
-        for j in range(1, 5):
-            cell_data = str(data[i][j]).lower()
-            if cell_data.startswith("-") or "критически" in cell_data or "просрочено" in cell_data or "!" in cell_data:
-                table_style.add('BACKGROUND', (j, i), (j, i), colors.mistyrose)
-                table_style.add('TEXTCOLOR', (j, i), (j, i), colors.darkred)
-            elif "скоро" in cell_data:
-                table_style.add('BACKGROUND', (j, i), (j, i), colors.lemonchiffon)
-                table_style.add('TEXTCOLOR', (j, i), (j, i), colors.saddlebrown)
-
-    table.setStyle(table_style)
-    elements.append(table)
-
-    # Build the PDF
-    try:
-        doc.build(elements)
-        logging.info(f"PDF отчет успешно создан: {filename}")
-    except Exception as e:
-        logging.error(f"Ошибка при сборке PDF: {e}")
-        raise
+    Runs in a report_pool worker process for the bot; no file is written.
+    Fonts and styles are loaded once per process by report_render, and
+    vehicles are streamed from the cursor page by page; days left and
+    statuses are computed by fleet_expiry for a whole batch at once.
 
-    conn.close()
-    return filename
+    Args:
+        cache (bool): Store the report in report_cache under the digest of
+            the rows it was built from
+
+    Returns:
+        bytes: PDF document
+    """
+    import logging
+    from report_cache import RowDigest, report_cache
+    from report_render import render_expiration_report
+
+    today = datetime.date.today()
+    digest = RowDigest("expiration", today)
+    with db_pool.connection() as conn:
+        def batches():
+            for batch in _expiration_batches(conn):
+                if cache:
+                    for row in batch:
+                        digest.update(row)
+                yield batch
+
+        try:
+            pdf = render_expiration_report(fleet_expiry.annotate(batches(), today), today)
+            logging.info(f"PDF отчет успешно создан: {len(pdf)} байт")
+        except Exception as e:
+            logging.error(f"Ошибка при сборке PDF: {e}")
+            raise
+
+    if cache:
+        report_cache.put(digest.hexdigest(), pdf)
+    return pdf
@@ -0,0 +1,199 @@
+import os
+import sys
+import hmac
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+
+from aiohttp import web
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+from aiogram.webhook.aiohttp_server import setup_application
+
+# Публичный адрес, на который Telegram отправляет обновления (https://bot.example.com)
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+
+# Путь обработчика обновлений
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram/webhook")
+
+# Адрес и порт, на которых слушает сервер (за обратным прокси с TLS)
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8080"))
+
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token. Если не задан, выводится
+# из токена бота, поэтому все рабочие процессы используют одно значение
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+
+# Сколько обновлений один процесс обрабатывает одновременно. Когда лимит
+# занят, ответ Telegram задерживается, и он не присылает новые обновления
+WEBHOOK_MAX_CONCURRENCY = int(os.environ.get("WEBHOOK_MAX_CONCURRENCY", "32"))
+
+# Сколько одновременных соединений Telegram открывает к серверу (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def derive_secret(token):
+    """
+    Build the default webhook secret from the bot token
+
+    Args:
+        token (str): Bot token
+
+    Returns:
+        str: 64 hex characters (allowed by setWebhook secret_token)
+    """
+    return hashlib.sha256(f"webhook:{token}".encode()).hexdigest()
+
+
+class WebhookHandler:
+    """
+    aiohttp handler that verifies and processes Telegram updates
+
+    A request with a wrong secret gets 401. A valid update is answered with
+    200 as soon as a processing slot is free; the handlers run in the
+    background, at most max_concurrency at a time per process.
+    """
+
+    def __init__(self, dispatcher, bot, secret, max_concurrency=WEBHOOK_MAX_CONCURRENCY):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.secret = secret.encode()
+        self.received = 0
+        self.rejected = 0
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tasks = set()
+
+    async def handle(self, request):
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, "").encode(), self.secret):
+            self.rejected += 1
+            return web.Response(status=401)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            logging.warning(f"Некорректное обновление от Telegram: {e}")
+            return web.Response(status=400)
+
+        # Ждем свободный слот до ответа: так нагрузку ограничивает сам Telegram
+        await self._slots.acquire()
+        self.received += 1
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update):
+        try:
+            result = await self.dispatcher.feed_update(self.bot, update)
+            # Обработчик может вернуть метод API вместо вызова - выполняем его
+            if isinstance(result, TelegramMethod):
+                await self.bot(result)
+        except Exception as e:
+            logging.error(f"Ошибка при обработке обновления {update.update_id}: {e}")
+        finally:
+            self._slots.release()
+
+    async def health(self, request):
+        return web.json_response({
+            "status": "ok",
+            "pid": os.getpid(),
+            "received": self.received,
+            "rejected": self.rejected,
+            "in_progress": len(self._tasks),
+        })
+
+    async def drain(self, app=None):
+        """Wait for updates that are still being processed (on shutdown)"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def create_app(dispatcher, bot, secret=None, max_concurrency=WEBHOOK_MAX_CONCURRENCY, path=WEBHOOK_PATH):
+    """
+    Build the aiohttp application that serves the webhook
+
+    Args:
+        dispatcher (Dispatcher): aiogram dispatcher with the bot's handlers
+        bot (Bot): Bot instance
+        secret (str): Expected secret token (derived from the bot token if None)
+        max_concurrency (int): Updates processed at once by this process
+        path (str): Path of the update endpoint
+
+    Returns:
+        web.Application: App with POST <path> and GET /healthz
+    """
+    handler = WebhookHandler(dispatcher, bot, secret or WEBHOOK_SECRET or derive_secret(bot.token), max_concurrency)
+    app = web.Application()
+    app["webhook_handler"] = handler
+    app.router.add_post(path, handler.handle)
+    app.router.add_get("/healthz", handler.health)
+    # Сначала дожидаемся начатых обработчиков, потом останавливаем диспетчер
+    app.on_shutdown.append(handler.drain)
+    setup_application(app, dispatcher, bot=bot)
+    return app
+
+
+async def run_webhook(dispatcher, bot, register=True):
+    """
+    Serve updates over a webhook until the process is stopped
+
+    Args:
+        dispatcher (Dispatcher): aiogram dispatcher
+        bot (Bot): Bot instance
+        register (bool): Call setWebhook (only one worker needs to)
+    """
+    secret = WEBHOOK_SECRET or derive_secret(bot.token)
+    app = create_app(dispatcher, bot, secret)
+
+    if register:
+        if not WEBHOOK_URL:
+            raise RuntimeError("WEBHOOK_URL не задан: укажите публичный адрес бота")
+        await bot.set_webhook(
+            WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=secret,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+        logging.info(f"Webhook зарегистрирован: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    # reuse_port позволяет нескольким процессам слушать один порт
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT, reuse_port=sys.platform.startswith("linux"))
+    await site.start()
+    logging.info(f"Сервер webhook слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH} (PID {os.getpid()})")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
+
+
+def _worker(index):
+    # Первый процесс регистрирует webhook и запускает планировщики
+    os.environ["BOT_MODE"] = "webhook"
+    os.environ["WEBHOOK_REGISTER"] = "1" if index == 0 else "0"
+    os.environ["RUN_SCHEDULERS"] = "1" if index == 0 else "0"
+    import telegram_bot
+    asyncio.run(telegram_bot.main())
+
+
+if __name__ == "__main__":
+    # Запуск нескольких процессов за одним портом: python webhook.py [процессов]
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    if workers > 1:
+        # Лимиты Telegram общие для бота - делим их между процессами,
+        # а состояния диалогов читаем из базы, а не из памяти процесса
+        from send_queue import SEND_GLOBAL_RATE
+        os.environ["SEND_GLOBAL_RATE"] = str(SEND_GLOBAL_RATE / workers)
+        os.environ["FSM_SHARED"] = "1"
+
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=_worker, args=(index,), name=f"bot-worker-{index}") for index in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()